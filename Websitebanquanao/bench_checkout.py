@@ -0,0 +1,116 @@
+"""
+Concurrency benchmark for checkout stock holds (inventory.py).
+Many threads check out the same SKU (product + size + color) at once
+against a file-backed SQLite database; the run fails if more units are
+held than were in stock.
+
+    python bench_checkout.py --threads 32 --stock 100 --attempts 10
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from uuid import uuid4
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+from database import db, init_db, Product, Order, Inventory
+from orders import set_order_items
+from pricing import price_cart
+from inventory import hold_stock, set_stock
+
+SIZE, COLOR = 'M', 'Đen'
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app)
+    return app
+
+
+def checkout_once(user_email, product_id, qty=1):
+    """The checkout route's pricing + stock hold path. Returns True if an order was placed."""
+    lines, problems = price_cart([{'id': product_id, 'qty': qty, 'color': COLOR, 'size': SIZE}])
+    if problems:
+        return False
+    order = Order(id=str(uuid4()), user_email=user_email, status='pending',
+                  subtotal=sum(line['price'] * line['qty'] for line in lines),
+                  total=sum(line['price'] * line['qty'] for line in lines))
+    set_order_items(order, lines)
+    if hold_stock(order.id, lines):
+        db.session.rollback()
+        return False
+    db.session.add(order)
+    db.session.commit()
+    return True
+
+
+def run_benchmark(threads=16, stock=50, attempts=10, path=None):
+    """Return a dict of results; 'oversold' must be 0"""
+    folder = None
+    if path is None:
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'bench.db')
+    app = make_app('sqlite:///' + path)
+    with app.app_context():
+        product = Product.query.filter_by(name='Áo thun Basic').first()
+        set_stock(product.id, stock, SIZE, COLOR)
+        db.session.commit()
+        product_id = product.id
+
+    placed = []
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def buyer(index):
+        with app.app_context():
+            barrier.wait()
+            for _ in range(attempts):
+                try:
+                    if checkout_once(f'bench{index}@example.com', product_id):
+                        placed.append(index)
+                except OperationalError as e:  # database is locked
+                    db.session.rollback()
+                    errors.append(str(e))
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=buyer, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        final_stock = Inventory.query.filter_by(product_id=product_id, size=SIZE, color=COLOR).one().available
+        orders = Order.query.filter(Order.user_email.like('bench%')).count()
+        for engine in db.engines.values():
+            engine.dispose()
+    if folder:
+        shutil.rmtree(folder)
+
+    return {
+        'attempts': threads * attempts,
+        'orders': orders,
+        'placed': len(placed),
+        'final_stock': final_stock,
+        'oversold': max(0, orders - stock) + max(0, -final_stock),
+        'lock_errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'checkouts_per_second': round(threads * attempts / elapsed, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--attempts', type=int, default=10)
+    args = parser.parse_args()
+    result = run_benchmark(args.threads, args.stock, args.attempts)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    print("✅ No oversell" if result['oversold'] == 0 else "❌ OVERSOLD")
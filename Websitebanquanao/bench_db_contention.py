@@ -0,0 +1,123 @@
+"""
+Multi-process read/write contention benchmark for the SQLite engine setup
+(database.configure_engines). Reader processes load catalog pages while
+writer processes commit small updates (wishlist toggles, sold counters)
+against one database file, first with the old setup (rollback journal, no
+read pool) and then with WAL + pragmas + the read-only pool.
+
+    python bench_db_contention.py --readers 4 --writers 2 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+from database import db, init_db, Product, User
+from catalog import query_catalog
+
+MODES = {
+    # Cấu hình cũ: journal mặc định, không pool đọc riêng
+    'legacy': {'SQLITE_PRAGMAS': {'journal_mode': 'DELETE'}, 'DB_READ_POOL_SIZE': 0},
+    'tuned': {},
+}
+
+
+def make_app(path, mode):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(MODES[mode])
+    init_db(app)
+    return app
+
+
+def reader(path, mode, deadline, results):
+    app = make_app(path, mode)
+    latencies, errors = [], 0
+    categories = ['', 'Áo', 'Quần', 'Váy']
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            with app.app_context():  # Một app context = một request
+                query_catalog(category=random.choice(categories), sort='popular')
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+    results.put(('read', latencies, errors))
+
+
+def writer(path, mode, deadline, results):
+    app = make_app(path, mode)
+    latencies, errors = [], 0
+    with app.app_context():
+        product_ids = [row.id for row in db.session.query(Product.id)]
+        emails = [row.email for row in db.session.query(User.email)]
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                product_id = random.choice(product_ids)
+                db.session.query(Product).filter_by(id=product_id).update({'sold': Product.sold + 1})
+                db.session.query(User).filter_by(email=random.choice(emails)).update(
+                    {'wishlist': f'["{product_id}"]'})
+                db.session.commit()
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+    results.put(('write', latencies, errors))
+
+
+def _p95(values):
+    return round(sorted(values)[int(len(values) * 0.95)] * 1000, 2) if values else None
+
+
+def run_mode(mode, readers=4, writers=2, seconds=5.0):
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'bench.db')
+    try:
+        app = make_app(path, mode)  # Tạo bảng + dữ liệu mẫu trước khi các process bắt đầu
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        deadline = time.time() + seconds + 2  # +2s để các process kịp khởi động
+        processes = ([context.Process(target=reader, args=(path, mode, deadline, results)) for _ in range(readers)]
+                     + [context.Process(target=writer, args=(path, mode, deadline, results)) for _ in range(writers)])
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(folder)
+
+    reads = [latency for kind, latencies, _ in collected if kind == 'read' for latency in latencies]
+    writes = [latency for kind, latencies, _ in collected if kind == 'write' for latency in latencies]
+    return {
+        'mode': mode,
+        'reads': len(reads),
+        'writes': len(writes),
+        'read_p95_ms': _p95(reads),
+        'write_p95_ms': _p95(writes),
+        'lock_errors': sum(errors for _, _, errors in collected),
+    }
+
+
+def run_benchmark(readers=4, writers=2, seconds=5.0, modes=('legacy', 'tuned')):
+    return [run_mode(mode, readers, writers, seconds) for mode in modes]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+    for result in run_benchmark(args.readers, args.writers, args.seconds):
+        print(' '.join(f"{key}={value}" for key, value in result.items()))
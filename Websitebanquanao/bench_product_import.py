@@ -0,0 +1,97 @@
+"""
+Benchmark for bulk product import (product_io.py).
+Imports N generated products into a file database: batched upserts (one
+executemany + commit per batch) against the admin form's path of one
+Product + set_stock + index_product + commit per product, then times a
+full streaming export.
+
+    python bench_product_import.py --products 20000 --per-row 500
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from uuid import uuid4
+from flask import Flask
+from database import db, init_db, Product
+from inventory import set_stock
+from search_index import index_product
+from product_io import read_rows, import_products, export_products, IMPORT_BATCH_SIZE
+
+
+def make_jsonl(count):
+    lines = []
+    for i in range(count):
+        lines.append(json.dumps({'name': f'Sản phẩm mùa thu {i}', 'price': 100000 + i % 500 * 1000,
+                                 'category': ['Áo', 'Quần', 'Váy'][i % 3], 'image': f'/Images/bench{i}.png',
+                                 'sizes': 'S, M, L, XL', 'colors': 'Đen, Trắng', 'stock': i % 50,
+                                 'description': 'Chất liệu cotton, form rộng'}, ensure_ascii=False))
+    return '\n'.join(lines) + '\n'
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app)
+    return app
+
+
+def run_benchmark(products=20000, per_row=500, batch_size=IMPORT_BATCH_SIZE):
+    folder = tempfile.mkdtemp()
+    try:
+        app = make_app(os.path.join(folder, 'bulk.db'))
+        with app.app_context():
+            text = make_jsonl(products)
+            started = time.perf_counter()
+            summary = import_products(read_rows(io.StringIO(text), 'jsonl'), batch_size=batch_size)
+            bulk_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            exported = sum(1 for _ in export_products('csv')) - 1
+            export_seconds = time.perf_counter() - started
+            db.engine.dispose()
+
+        app = make_app(os.path.join(folder, 'per_row.db'))
+        with app.app_context():
+            started = time.perf_counter()
+            for _, row in read_rows(io.StringIO(make_jsonl(per_row)), 'jsonl'):
+                product = Product(id=str(uuid4()), name=row['name'], price=row['price'], category=row['category'],
+                                  image=row['image'], images=json.dumps([row['image']]),
+                                  description=row['description'], stock=row['stock'],
+                                  sizes=json.dumps(row['sizes'].split(', ')), colors=json.dumps(row['colors'].split(', ')),
+                                  color_images='{}', rating=0, reviews=0, sold=0)
+                db.session.add(product)
+                set_stock(product.id, row['stock'])
+                index_product(product)
+                db.session.commit()
+            per_row_seconds = time.perf_counter() - started
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(folder)
+
+    bulk_rate = products / bulk_seconds
+    per_row_rate = per_row / per_row_seconds
+    return {
+        'products': products,
+        'created': summary['created'],
+        'invalid': summary['invalid'],
+        'bulk_rows_per_second': round(bulk_rate),
+        'per_row_rows_per_second': round(per_row_rate),
+        'speedup': round(bulk_rate / per_row_rate, 1),
+        'exported': exported,
+        'export_rows_per_second': round(exported / export_seconds),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--per-row', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    for key, value in run_benchmark(args.products, args.per_row, args.batch_size).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for voucher evaluation (vouchers.py).
+Finds the best of many voucher rules for random carts: the cached
+VoucherSet (bisect on min_order, then per-type math in memory) against
+querying the vouchers table for every cart.
+
+    python bench_vouchers.py --rules 1000 --carts 10000
+"""
+import argparse
+import random
+import time
+from flask import Flask
+from database import db, init_db, Voucher
+from vouchers import VoucherSet, discount_for, TYPES
+
+
+def make_rules(count, seed=1):
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        voucher_type = rng.choice(TYPES)
+        discount = rng.randint(1, 50) if voucher_type == 'percent' else rng.randrange(10000, 200000, 5000)
+        rules.append({'code': f'BENCH{i}', 'type': voucher_type, 'discount': discount,
+                      'min_order': rng.randrange(0, 2000000, 50000),
+                      'usage_limit': None, 'per_user_limit': None})
+    return rules
+
+
+def make_carts(count, seed=2):
+    rng = random.Random(seed)
+    carts = []
+    for _ in range(count):
+        subtotal = rng.randrange(50000, 3000000, 1000)
+        carts.append((subtotal, 0 if subtotal >= 500000 else 30000))
+    return carts
+
+
+def brute_force_best(rules, subtotal, shipping):
+    return max([discount_for(rule, subtotal, shipping) for rule in rules] + [0])
+
+
+def run_benchmark(rules=1000, carts=10000, db_carts=200):
+    """Return a dict of results; 'mismatches' must be 0"""
+    rule_list = make_rules(rules)
+    cart_list = make_carts(carts)
+
+    started = time.perf_counter()
+    vouchers = VoucherSet(rule_list)
+    results = [vouchers.best(subtotal, shipping)[1] for subtotal, shipping in cart_list]
+    cached_seconds = time.perf_counter() - started
+
+    sample = cart_list[:db_carts]
+    mismatches = sum(1 for (subtotal, shipping), found in zip(sample, results)
+                     if found != brute_force_best(rule_list, subtotal, shipping))
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app)
+    with app.app_context():
+        Voucher.query.delete()
+        db.session.add_all(Voucher(active=True, **rule) for rule in rule_list)
+        db.session.commit()
+        started = time.perf_counter()
+        for subtotal, shipping in sample:
+            rows = Voucher.query.filter(Voucher.active == True, Voucher.min_order <= subtotal).all()
+            max([discount_for(row.to_dict(), subtotal, shipping) for row in rows] + [0])
+        db_seconds = time.perf_counter() - started
+
+    cached_rate = carts / cached_seconds
+    db_rate = len(sample) / db_seconds
+    return {
+        'rules': rules,
+        'carts': carts,
+        'mismatches': mismatches,
+        'cached_carts_per_second': round(cached_rate),
+        'db_carts_per_second': round(db_rate),
+        'speedup': round(cached_rate / db_rate, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rules', type=int, default=1000)
+    parser.add_argument('--carts', type=int, default=10000)
+    parser.add_argument('--db-carts', type=int, default=200)
+    args = parser.parse_args()
+    result = run_benchmark(args.rules, args.carts, args.db_carts)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    print("✅ Cached evaluation matches brute force" if result['mismatches'] == 0 else "❌ MISMATCH")
@@ -0,0 +1,146 @@
+"""
+Shared cache for data that many requests read and few requests change
+(home page rails, categories). Values expire after a TTL and write routes
+delete the affected keys explicitly.
+
+Backends (app.config['CACHE_BACKEND']):
+  'memory' - LRU dict inside each worker process (default). Invalidation
+             only reaches the worker that handled the write; the TTL bounds
+             how stale the other workers can be.
+  'redis'  - shared by every worker; CACHE_REDIS_URL points at Redis or any
+             server speaking its protocol. Needs the redis package.
+  'null'   - no caching.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from flask import current_app
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 256
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """Thread-safe LRU with per-entry expiry"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """Values are stored as JSON under a key prefix"""
+
+    def __init__(self, client, prefix='clothing_store:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_backend(config):
+    backend = config.get('CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryCache(config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND='redis' cần cài gói redis (pip install redis)")
+        return RedisCache(redis.Redis.from_url(config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')))
+    if backend == 'null':
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+
+
+def init_cache(app, backend=None, compute_context=None):
+    """Attach a cache backend to the app (built from the config if not given).
+    compute_context, if given, is a context manager factory wrapped around
+    every cache miss computation (e.g. database.primary_reads).
+    """
+    app.config.setdefault('CACHE_DEFAULT_TTL', DEFAULT_TTL)
+    app.extensions['cache'] = backend or create_backend(app.config)
+    app.extensions['cache_compute_context'] = compute_context or nullcontext
+    return app.extensions['cache']
+
+
+def get_cache():
+    return current_app.extensions.get('cache') or NullCache()
+
+
+def cached_value(key, compute, ttl=None):
+    """Return the cached value for key, computing and storing it on a miss.
+    Values must be JSON-serializable so every backend can hold them.
+    compute() runs inside the app's compute_context (see init_cache).
+    """
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        with current_app.extensions.get('cache_compute_context', nullcontext)():
+            value = compute()
+        cache.set(key, value, ttl or current_app.config.get('CACHE_DEFAULT_TTL', DEFAULT_TTL))
+    return value
+
+
+def invalidate(*keys):
+    get_cache().delete(*keys)
@@ -0,0 +1,75 @@
+"""
+Shopping carts stored in the cart_items table, one row per (product, color,
+size) of a user. Each cart change is a single INSERT ... ON CONFLICT /
+UPDATE / DELETE on one line instead of rewriting the whole cart in the
+session cookie, and the cart follows the user to every device.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db, CartItem
+
+
+def parse_qty(value):
+    """Quantity from a form / old cart as an int >= 1, or None if it isn't one"""
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        return None
+    try:
+        qty = int(value)
+    except (TypeError, ValueError):
+        return None
+    return qty if qty >= 1 else None
+
+
+def _line(user_email, product_id, color, size):
+    return CartItem.query.filter_by(user_email=user_email, product_id=str(product_id),
+                                    color=color or '', size=size or '')
+
+
+def load_cart(user_email):
+    """Cart lines as dicts (same shape as the old session cart), oldest first"""
+    if not user_email:
+        return []
+    return [item.to_dict() for item in
+            CartItem.query.filter_by(user_email=user_email).order_by(CartItem.id)]
+
+
+def add_item(user_email, product, color, size, qty=1):
+    """Add qty of a product/color/size, creating the line or increasing it"""
+    if parse_qty(qty) is None:
+        raise ValueError(f'Invalid cart quantity: {qty!r}')
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    table = CartItem.__table__
+    statement = insert(table).values(user_email=user_email, product_id=product.id,
+                                     name=product.name, price=product.price, image=product.image,
+                                     color=color or '', size=size or '', qty=qty)
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_email', 'product_id', 'color', 'size'],
+        set_={'qty': table.c.qty + statement.excluded.qty}
+    )
+    db.session.execute(statement)
+
+
+def change_qty(user_email, product_id, color, size, delta):
+    """Change a line's quantity by delta, never below 1"""
+    (_line(user_email, product_id, color, size)
+     .filter(CartItem.qty + delta >= 1)
+     .update({'qty': CartItem.qty + delta}, synchronize_session=False))
+
+
+def remove_item(user_email, product_id, color, size):
+    _line(user_email, product_id, color, size).delete(synchronize_session=False)
+
+
+def clear_cart(user_email):
+    CartItem.query.filter_by(user_email=user_email).delete(synchronize_session=False)
+
+
+def import_session_cart(user_email, items, products):
+    """Move a cart from the old cookie format into the table.
+    products maps product id -> Product for the ids still in the catalog.
+    """
+    for item in items:
+        product = products.get(item.get('id'))
+        qty = parse_qty(item.get('qty') or 1)
+        if product is not None and qty is not None:
+            add_item(user_email, product, item.get('color'), item.get('size'), qty)
@@ -0,0 +1,151 @@
+"""
+Catalog query engine for the product listing pages.
+Category, price band, search and sort are pushed into one SQL query and
+results are paginated with keyset cursors, so only one page is loaded.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import func, tuple_
+from database import db, Product, read_session
+from search_index import search_available, search_hits
+
+PAGE_SIZE = 24
+TYPEAHEAD_LIMIT = 10
+
+# price param -> (min, max), both inclusive
+PRICE_RANGES = {
+    '0-200000': (None, 200000),
+    '200000-500000': (200000, 500000),
+    '500000-999999999': (500000, None),
+}
+
+# sort param -> (column, descending). Mặc định giữ thứ tự thêm sản phẩm.
+SORT_KEYS = {
+    '': (Product.created_at, False),
+    'newest': (Product.created_at, True),
+    'price_asc': (Product.price, False),
+    'price_desc': (Product.price, True),
+    'popular': (Product.sold, True),
+    'rating': (Product.rating, True),
+}
+
+# Only the columns a product card needs
+SUMMARY_COLUMNS = (
+    Product.id, Product.name, Product.price, Product.old_price, Product.category,
+    Product.image, Product.image_variants, Product.sizes, Product.colors, Product.rating, Product.reviews,
+    Product.sold, Product.created_at,
+)
+
+
+def encode_cursor(value, product_id):
+    """Pack the sort value and id of the last row into an opaque URL-safe token"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, product_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, column):
+    """Reverse of encode_cursor; returns None for a malformed token"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, product_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if column.key == 'created_at' and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, product_id
+    except (ValueError, TypeError):
+        return None
+
+
+def product_summary(row):
+    """Lightweight dict for product cards (no description / images / color map)"""
+    return {
+        'id': row.id,
+        'name': row.name,
+        'price': row.price,
+        'old_price': row.old_price or 0,
+        'category': row.category,
+        'image': row.image,
+        'image_variants': json.loads(row.image_variants) if row.image_variants else {},
+        'sizes': json.loads(row.sizes) if row.sizes else [],
+        'colors': json.loads(row.colors) if row.colors else [],
+        'rating': row.rating,
+        'reviews': row.reviews,
+        'sold': row.sold,
+    }
+
+
+def query_catalog(category='', price_range='', search='', sort='', cursor=None,
+                  limit=PAGE_SIZE, sale_only=False):
+    """Return (products, next_cursor) for one page of the catalog.
+
+    With a search text and no explicit sort, results are ordered by relevance.
+    next_cursor is None on the last page.
+    """
+    column, descending = SORT_KEYS.get(sort, SORT_KEYS[''])
+
+    query = read_session().query(*SUMMARY_COLUMNS)
+
+    if search and search_available():
+        hits = search_hits(search)
+        if hits is None:
+            return [], None
+        query = query.join(hits, hits.c.product_id == Product.id).add_columns(hits.c.rank)
+        if not sort or sort not in SORT_KEYS:
+            column, descending = hits.c.rank, False
+    elif search:
+        query = query.filter(func.lower(Product.name).contains(search.lower(), autoescape=True))
+
+    if category:
+        query = query.filter(Product.category == category)
+
+    if sale_only:
+        query = query.filter(Product.old_price > Product.price)
+
+    min_price, max_price = PRICE_RANGES.get(price_range, (None, None))
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+
+    if cursor:
+        position = decode_cursor(cursor, column)
+        if position:
+            key = tuple_(column, Product.id)
+            query = query.filter(key < position if descending else key > position)
+
+    if descending:
+        query = query.order_by(column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(column.asc(), Product.id.asc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+
+    return [product_summary(row) for row in rows], next_cursor
+
+
+def typeahead_products(search, limit=TYPEAHEAD_LIMIT):
+    """At most `limit` small rows for the admin order form's product picker.
+
+    Matches with the FTS prefix index (name weighted first); an empty text
+    returns the best sellers. Reads the primary so stock is current.
+    """
+    query = db.session.query(Product.id, Product.name, Product.price, Product.image, Product.stock)
+    if not search:
+        query = query.order_by(Product.sold.desc(), Product.id.desc())
+    elif search_available():
+        hits = search_hits(search)
+        if hits is None:
+            return []
+        query = query.join(hits, hits.c.product_id == Product.id).order_by(hits.c.rank, Product.id)
+    else:
+        query = (query.filter(func.lower(Product.name).startswith(search.lower(), autoescape=True))
+                 .order_by(Product.name, Product.id))
+    return [{'id': row.id, 'name': row.name, 'price': row.price, 'image': row.image, 'stock': row.stock}
+            for row in query.limit(limit)]
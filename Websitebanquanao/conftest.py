@@ -0,0 +1,20 @@
+"""
+pytest setup: test_database.py imports the app module, which opens the
+database at import time. Point it at a temporary copy of
+instance/clothing_store.db so a test run never writes to the tracked file.
+"""
+import os
+import shutil
+import tempfile
+
+_folder = tempfile.mkdtemp(prefix='clothing_store_test_')
+_database = os.path.join(_folder, 'clothing_store.db')
+_tracked = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'clothing_store.db')
+if os.path.exists(_tracked):
+    shutil.copy2(_tracked, _database)
+os.environ['DATABASE_URL'] = 'sqlite:///' + _database
+os.environ.pop('DATABASE_READ_URL', None)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_folder, ignore_errors=True)
@@ -1,34 +1,263 @@
 """
 SQLite Database Configuration for Flask Clothing Store
 """
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, session as browser_session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 import json
+import sqlite3
+import time
+import unicodedata
+import uuid
 
 db = SQLAlchemy()
 
+# Pragma cho file SQLite. WAL: người đọc không bị chặn khi có người ghi;
+# synchronous=NORMAL an toàn với WAL và nhanh hơn FULL nhiều khi commit
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms chờ khóa ghi trước khi báo "database is locked"
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+READ_BIND = 'read'
+NIL_UUID = '00000000-0000-0000-0000-000000000000'
+
+
+class UUIDString(TypeDecorator):
+    """UUID stored natively on PostgreSQL and as VARCHAR(36) elsewhere;
+    Python always sees the usual 36-character string.
+    """
+    impl = db.String(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(db.String(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'postgresql':
+            return value
+        try:
+            return str(uuid.UUID(str(value)))
+        except ValueError:
+            # Id sai định dạng (từ URL / form): không khớp dòng nào, giống SQLite
+            return NIL_UUID
+
+
+class JSONText(TypeDecorator):
+    """JSON document stored as JSONB on PostgreSQL and as TEXT elsewhere;
+    Python always sees the JSON string (the app json.loads / json.dumps it).
+    """
+    impl = db.Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.JSONB(none_as_null=True))
+        return dialect.type_descriptor(db.Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'postgresql':
+            return value
+        return json.loads(value) if value.strip() else None
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != 'postgresql':
+            return value
+        return json.dumps(value, ensure_ascii=False)
+
+
+def _unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def fold_text(value):
+    """Case-folded NFC text, for case-insensitive prefix search on an index"""
+    return unicodedata.normalize('NFC', value).casefold() if value else value
+
+
+@event.listens_for(Engine, 'connect')
+def _on_sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        # lower() mặc định của SQLite chỉ xử lý ASCII -> thay bằng bản hỗ trợ tiếng Việt
+        dbapi_connection.create_function('lower', 1, _unicode_lower, deterministic=True)
+
+
+def _is_sqlite_file(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def configure_engines(app):
+    """Fill in the engine options before db.init_app().
+    Server databases and file SQLite databases get a sized connection pool.
+    Reads sent through read_session() use bind 'read': the replica in
+    SQLALCHEMY_READ_URI if set, otherwise for file SQLite a read-only pool
+    on the same file; DB_READ_POOL_SIZE = 0 turns the read pool off.
+    """
+    config = app.config
+    config.setdefault('DB_POOL_SIZE', 5)
+    config.setdefault('DB_MAX_OVERFLOW', 10)
+    config.setdefault('DB_POOL_TIMEOUT', 30)
+    config.setdefault('DB_READ_POOL_SIZE', 10)
+    config.setdefault('READ_AFTER_WRITE_SECONDS', 5)
+    config.setdefault('SQLITE_PRAGMAS', dict(SQLITE_PRAGMAS))
+
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and not _is_sqlite_file(url):
+        return  # In-memory: flask_sqlalchemy dùng StaticPool, một kết nối duy nhất
+    options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    if not _is_sqlite_file(url):
+        # Server có thể khởi động lại / failover: kiểm tra kết nối trước khi dùng
+        options.setdefault('pool_pre_ping', True)
+
+    read_url = config.get('SQLALCHEMY_READ_URI')
+    if not read_url and _is_sqlite_file(url):
+        # Cùng file, mở bằng URI mode=ro: kết nối đọc không bao giờ giữ khóa ghi
+        database = url.database if url.query.get('uri') else f'file:{url.database}'
+        read_url = url.set(database=database, query=dict(url.query, mode='ro', uri='true'))
+    if read_url and config['DB_READ_POOL_SIZE']:
+        config.setdefault('SQLALCHEMY_BINDS', {}).setdefault(READ_BIND, {
+            'url': read_url,
+            'pool_size': config['DB_READ_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_pre_ping': not _is_sqlite_file(make_url(read_url)),
+        })
+
+
+def _install_pragmas(engine, pragmas, read_only=False):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            # journal_mode được lưu trong file, kết nối chỉ đọc không đổi được
+            if not (read_only and name == 'journal_mode'):
+                cursor.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+
+def _reads_from_primary():
+    if g.get('read_primary'):
+        return True
+    # Trình duyệt vừa ghi ở request trước (POST -> redirect -> GET)
+    return has_request_context() and browser_session.get('read_primary_until', 0) > time.time()
+
+
+@contextmanager
+def primary_reads():
+    """read_session() returns db.session inside this block"""
+    previous = g.get('read_primary', False)
+    g.read_primary = True
+    try:
+        yield
+    finally:
+        g.read_primary = previous
+
+
+def read_session():
+    """Session on the read pool (replica / read-only SQLite connections), for
+    queries only; db.session when there is no read pool. A replica may lag a
+    little behind the primary, so once a request has written to the database
+    that request, and the same browser for READ_AFTER_WRITE_SECONDS after it,
+    read from the primary instead.
+    """
+    engine = db.engines.get(READ_BIND)
+    if engine is None or _reads_from_primary():
+        return db.session
+    if 'read_session' not in g:
+        g.read_session = Session(engine, query_cls=db.Query)
+    return g.read_session
+
+
+def _mark_written():
+    g.read_primary = g.wrote = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _on_flush(session, flush_context):
+    _mark_written()
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    # insert()/update()/delete() qua session.execute không đi qua flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_written()
+
+
+def _forget_expired_write():
+    # Bỏ khóa đã hết hạn để session trống lại: cache_page bỏ qua session không trống
+    if browser_session.get('read_primary_until', float('inf')) <= time.time():
+        browser_session.pop('read_primary_until')
+
+
+def _remember_write(response):
+    if g.get('wrote'):
+        seconds = current_app.config['READ_AFTER_WRITE_SECONDS']
+        browser_session['read_primary_until'] = time.time() + seconds
+    return response
+
+
+def _close_read_session(exception=None):
+    session = g.pop('read_session', None)
+    if session is not None:
+        session.close()
+
 # Models
 class Product(db.Model):
     __tablename__ = 'products'
     
-    id = db.Column(db.String(36), primary_key=True)
+    id = db.Column(UUIDString, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     price = db.Column(db.Integer, nullable=False)
     old_price = db.Column(db.Integer, default=0)
     category = db.Column(db.String(100))
     image = db.Column(db.String(500))
-    images = db.Column(db.Text)  # JSON array
+    images = db.Column(JSONText)  # JSON array
     description = db.Column(db.Text)
     stock = db.Column(db.Integer, default=0)
-    sizes = db.Column(db.Text)  # JSON array
-    colors = db.Column(db.Text)  # JSON array
-    color_images = db.Column(db.Text)  # JSON object mapping colors to image URLs
+    sizes = db.Column(JSONText)  # JSON array
+    colors = db.Column(JSONText)  # JSON array
+    color_images = db.Column(JSONText)  # JSON object mapping colors to image URLs
+    image_variants = db.Column(JSONText)  # JSON object: image URL -> {width: WebP variant URL}
     rating = db.Column(db.Float, default=0.0)
     reviews = db.Column(db.Integer, default=0)
+    # Số đánh giá theo từng mức sao - cập nhật cùng transaction khi thêm/xóa review
+    rating_count_1 = db.Column(db.Integer, default=0, server_default='0')
+    rating_count_2 = db.Column(db.Integer, default=0, server_default='0')
+    rating_count_3 = db.Column(db.Integer, default=0, server_default='0')
+    rating_count_4 = db.Column(db.Integer, default=0, server_default='0')
+    rating_count_5 = db.Column(db.Integer, default=0, server_default='0')
     sold = db.Column(db.Integer, default=0)
     featured = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    # Indexes for the catalog listing (filter + keyset sort)
+    __table_args__ = (
+        db.Index('ix_products_category_created', 'category', 'created_at', 'id'),
+        db.Index('ix_products_category_price', 'category', 'price', 'id'),
+        db.Index('ix_products_category_sold', 'category', 'sold', 'id'),
+        db.Index('ix_products_category_rating', 'category', 'rating', 'id'),
+        db.Index('ix_products_created', 'created_at', 'id'),
+        db.Index('ix_products_price', 'price', 'id'),
+        db.Index('ix_products_sold', 'sold', 'id'),
+        db.Index('ix_products_rating', 'rating', 'id'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -43,6 +272,7 @@ class Product(db.Model):
             'sizes': json.loads(self.sizes) if self.sizes else [],
             'colors': json.loads(self.colors) if self.colors else [],
             'color_images': json.loads(self.color_images) if self.color_images else {},
+            'image_variants': json.loads(self.image_variants) if self.image_variants else {},
             'rating': self.rating,
             'reviews': self.reviews,
             'sold': self.sold,
@@ -60,12 +290,23 @@ class User(db.Model):
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20))
     address = db.Column(db.Text)
-    wishlist = db.Column(db.Text)  # JSON array
+    wishlist = db.Column(JSONText)  # JSON array
     created_at = db.Column(db.DateTime, default=datetime.now)
+    # fold_text(email), fold_text(name): tìm khách không phân biệt hoa thường
+    email_folded = db.Column(db.String(120))
+    name_folded = db.Column(db.String(100))
     
     # Relationships
     orders = db.relationship('Order', backref='user', lazy=True)
     
+    # Trang quản lý tài khoản: lọc theo vai trò, sắp theo email; tìm khách theo tiền tố
+    __table_args__ = (
+        db.Index('ix_users_role_email', 'role', 'email'),
+        db.Index('ix_users_email_folded', 'email_folded'),
+        db.Index('ix_users_name_folded', 'name_folded'),
+        db.Index('ix_users_phone', 'phone'),
+    )
+    
     def to_dict(self):
         return {
             'email': self.email,
@@ -80,22 +321,43 @@ class User(db.Model):
         }
 
 
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _fold_user(mapper, connection, user):
+    user.email_folded = fold_text(user.email)
+    user.name_folded = fold_text(user.name)
+
+
 class Order(db.Model):
     __tablename__ = 'orders'
     
-    id = db.Column(db.String(36), primary_key=True)
+    id = db.Column(UUIDString, primary_key=True)
     user_email = db.Column(db.String(120), db.ForeignKey('users.email'), nullable=False)
-    items = db.Column(db.Text, nullable=False)  # JSON array
-    shipping_info = db.Column(db.Text)  # JSON object
+    items = db.Column(JSONText, nullable=False)  # JSON array
+    shipping_info = db.Column(JSONText)  # JSON object
     subtotal = db.Column(db.Integer, nullable=False)
     shipping = db.Column(db.Integer, default=0)
     voucher_discount = db.Column(db.Integer, default=0)
+    voucher_code = db.Column(db.String(50))  # Mã đã dùng, để trả lại lượt khi đơn bị hủy
     total = db.Column(db.Integer, nullable=False)
     payment_method = db.Column(db.String(50))
     payment_status = db.Column(db.String(20), default='pending')
     status = db.Column(db.String(20), default='pending')
     notes = db.Column(db.Text)
-    created_at = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    created_at_raw = db.Column(db.String(50))  # Ngày tạo kiểu cũ không đọc được, created_at để NULL
+    
+    # Bản chuẩn hóa của `items` để tra cứu lịch sử mua theo index
+    line_items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+    
+    # Danh sách đơn: lọc theo trạng thái / khách rồi phân trang theo (created_at, id)
+    __table_args__ = (
+        db.Index('ix_orders_created_id', 'created_at', 'id'),
+        db.Index('ix_orders_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_orders_payment_created', 'payment_status', 'created_at', 'id'),
+        # Lịch sử đơn của khách (my-orders)
+        db.Index('ix_orders_user_created', 'user_email', 'created_at', 'id'),
+    )
     
     def to_dict(self):
         return {
@@ -111,20 +373,194 @@ class Order(db.Model):
             'payment_status': self.payment_status,
             'status': self.status,
             'notes': self.notes,
-            'created_at': self.created_at
+            'created_at': self.created_at.strftime('%d/%m/%Y %H:%M') if self.created_at else None
+        }
+
+
+class OrderItem(db.Model):
+    __tablename__ = 'order_items'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(UUIDString, db.ForeignKey('orders.id'), nullable=False, index=True)
+    user_email = db.Column(db.String(120), nullable=False)
+    product_id = db.Column(UUIDString)
+    name = db.Column(db.String(200))
+    price = db.Column(db.Integer, default=0)
+    quantity = db.Column(db.Integer, default=1)
+    size = db.Column(db.String(20))
+    color = db.Column(db.String(50))
+    image = db.Column(db.String(500))
+    status = db.Column(db.String(20), default='pending')  # Bản sao Order.status
+    
+    __table_args__ = (
+        db.Index('ix_order_items_purchase', 'user_email', 'product_id', 'status'),
+    )
+    
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'name': self.name,
+            'price': self.price,
+            'quantity': self.quantity,
+            'size': self.size,
+            'color': self.color,
+            'image': self.image
+        }
+
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_email = db.Column(db.String(120), nullable=False)
+    product_id = db.Column(UUIDString, nullable=False)
+    name = db.Column(db.String(200))
+    price = db.Column(db.Integer, default=0)
+    image = db.Column(db.String(500))
+    color = db.Column(db.String(50), nullable=False, default='')
+    size = db.Column(db.String(20), nullable=False, default='')
+    qty = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    # Mỗi dòng giỏ hàng = một (sản phẩm, màu, size) của một user
+    __table_args__ = (
+        db.UniqueConstraint('user_email', 'product_id', 'color', 'size', name='unique_cart_line'),
+    )
+    
+    def to_dict(self):
+        # Cùng định dạng với giỏ hàng cũ trong session
+        return {
+            'id': self.product_id,
+            'name': self.name,
+            'price': self.price,
+            'image': self.image,
+            'color': self.color,
+            'size': self.size,
+            'qty': self.qty
+        }
+
+class Inventory(db.Model):
+    __tablename__ = 'inventory'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_id = db.Column(UUIDString, nullable=False)
+    # size = color = '' là kho chung của sản phẩm, dùng cho các biến thể không có dòng riêng
+    size = db.Column(db.String(20), nullable=False, default='')
+    color = db.Column(db.String(50), nullable=False, default='')
+    on_hand = db.Column(db.Integer, default=0, nullable=False)  # Hàng thực có trong kho
+    reserved = db.Column(db.Integer, default=0, nullable=False)  # Đang giữ cho đơn chưa hoàn thành
+    
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'size', 'color', name='unique_inventory_variant'),
+    )
+    
+    @property
+    def available(self):
+        return self.on_hand - self.reserved
+
+
+class StockReservation(db.Model):
+    __tablename__ = 'stock_reservations'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(UUIDString, nullable=False)
+    inventory_id = db.Column(db.Integer, nullable=False)
+    product_id = db.Column(UUIDString, nullable=False)
+    qty = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='held', nullable=False)  # held, committed, released
+    expires_at = db.Column(db.DateTime)  # None = giữ đến khi đơn hoàn thành / bị hủy
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    settled_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_stock_reservations_order', 'order_id'),
+        db.Index('ix_stock_reservations_status_expires', 'status', 'expires_at'),
+    )
+
+
+class RevenueRollup(db.Model):
+    __tablename__ = 'revenue_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    period = db.Column(db.String(10), nullable=False)  # day, month, year
+    period_key = db.Column(db.String(10), nullable=False)  # 2025-12-20, 2025-12, 2025
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    completed_count = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Integer, default=0, nullable=False)  # Tổng tiền đơn completed
+    
+    __table_args__ = (db.UniqueConstraint('period', 'period_key', name='unique_revenue_period'),)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)  # Tên handler, vd. image_variants
+    payload = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.now, nullable=False)  # Không chạy trước thời điểm này
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': json.loads(self.payload) if self.payload else {},
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'locked_by': self.locked_by,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
         }
 
 
+class OutboxMessage(db.Model):
+    __tablename__ = 'mail_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    kind = db.Column(db.String(50))  # Loại mail (password_reset...) để giới hạn tần suất
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_mail_outbox_status_next', 'status', 'next_attempt_at'),
+        db.Index('ix_mail_outbox_recipient_kind', 'recipient', 'kind', 'created_at'),
+    )
+
+
 class Review(db.Model):
     __tablename__ = 'reviews'
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    product_id = db.Column(db.String(36), nullable=False)
+    product_id = db.Column(UUIDString, nullable=False)
     user_email = db.Column(db.String(120), nullable=False)
-    order_id = db.Column(db.String(36))  # Đơn hàng đã mua
+    order_id = db.Column(UUIDString)  # Đơn hàng đã mua
     rating = db.Column(db.Integer, nullable=False)  # 1-5 sao
     comment = db.Column(db.Text)
-    images = db.Column(db.Text)  # JSON array - ảnh đánh giá
+    images = db.Column(JSONText)  # JSON array - ảnh đánh giá
+    image_variants = db.Column(JSONText)  # JSON object - ảnh thu nhỏ WebP của từng ảnh
     size = db.Column(db.String(10))  # Size đã mua
     color = db.Column(db.String(50))  # Màu đã mua
     verified_purchase = db.Column(db.Boolean, default=False)  # Đã mua hàng
@@ -135,54 +571,27 @@ class Review(db.Model):
     replies = db.relationship('ReviewReply', backref='review', lazy=True, cascade='all, delete-orphan')
     likes = db.relationship('ReviewLike', backref='review', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_reviews_product_created', 'product_id', 'created_at'),
+    )
+    
     def to_dict(self, user_email=None):
-        user = User.query.filter_by(email=self.user_email).first()
-        # Đếm số lượt like thực tế từ ReviewLike table
-        actual_helpful_count = ReviewLike.query.filter_by(review_id=self.id).count()
-        # Kiểm tra user hiện tại đã like chưa
-        user_liked = False
-        if user_email:
-            user_liked = ReviewLike.query.filter_by(review_id=self.id, user_email=user_email).first() is not None
-        
-        return {
-            'id': self.id,
-            'product_id': self.product_id,
-            'user_email': self.user_email,
-            'user_name': user.name if user else 'Người dùng',
-            'order_id': self.order_id,
-            'rating': self.rating,
-            'comment': self.comment,
-            'images': json.loads(self.images) if self.images else [],
-            'size': self.size,
-            'color': self.color,
-            'verified_purchase': self.verified_purchase,
-            'helpful_count': actual_helpful_count,
-            'user_liked': user_liked,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'replies': [reply.to_dict() for reply in self.replies]
-        }
+        from reviews import serialize_reviews
+        return serialize_reviews([self], user_email)[0]
 
 
 class ReviewReply(db.Model):
     __tablename__ = 'review_replies'
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    review_id = db.Column(db.Integer, db.ForeignKey('reviews.id'), nullable=False)
+    review_id = db.Column(db.Integer, db.ForeignKey('reviews.id'), nullable=False, index=True)
     user_email = db.Column(db.String(120), nullable=False)  # Admin/Staff
     comment = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
     def to_dict(self):
-        user = User.query.filter_by(email=self.user_email).first()
-        return {
-            'id': self.id,
-            'review_id': self.review_id,
-            'user_email': self.user_email,
-            'user_name': user.name if user else 'Quản trị viên',
-            'user_role': user.role if user else 'admin',
-            'comment': self.comment,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+        from reviews import serialize_replies
+        return serialize_replies([self])[0]
 
 
 class ReviewLike(db.Model):
@@ -205,6 +614,9 @@ class Voucher(db.Model):
     min_order = db.Column(db.Integer, default=0)
     type = db.Column(db.String(20), nullable=False)  # fixed, percent, shipping
     active = db.Column(db.Boolean, default=True)
+    usage_limit = db.Column(db.Integer)  # Tổng số lượt dùng, None = không giới hạn
+    per_user_limit = db.Column(db.Integer)  # Số lượt mỗi user, None = không giới hạn
+    used_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     
     def to_dict(self):
         return {
@@ -212,21 +624,151 @@ class Voucher(db.Model):
             'discount': self.discount,
             'min_order': self.min_order,
             'type': self.type,
-            'active': self.active
+            'active': self.active,
+            'usage_limit': self.usage_limit,
+            'per_user_limit': self.per_user_limit,
+            'used_count': self.used_count
         }
 
 
+class VoucherUsage(db.Model):
+    __tablename__ = 'voucher_usages'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    code = db.Column(db.String(50), nullable=False)
+    user_email = db.Column(db.String(120), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('code', 'user_email', name='unique_voucher_user'),)
+
+
 def init_db(app):
     """Initialize database with Flask app"""
+    configure_engines(app)
     db.init_app(app)
+    app.teardown_appcontext(_close_read_session)
+    if app.config['READ_AFTER_WRITE_SECONDS']:
+        app.before_request(_forget_expired_write)
+        app.after_request(_remember_write)
     
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        for key, engine in db.engines.items():
+            if _is_sqlite_file(engine.url):
+                _install_pragmas(engine, app.config['SQLITE_PRAGMAS'], read_only=key == READ_BIND)
+        
+        # Create missing tables, columns and indexes
+        changes = upgrade_schema()
         
         # Initialize with sample data if empty
+        seeded = False
         if User.query.count() == 0:
             init_sample_data()
+            seeded = True
+        
+        # Backfill data for tables / columns added by upgrade_schema()
+        if seeded or 'products.rating_count_1' in changes:
+            from reviews import rebuild_rating_summaries
+            rebuild_rating_summaries()
+            db.session.commit()
+        
+        if 'ix_orders_created_at' in changes:
+            from orders import normalize_order_dates
+            normalize_order_dates()
+            db.session.commit()
+        
+        if seeded or 'order_items' in changes:
+            from orders import backfill_order_items
+            backfill_order_items()
+            db.session.commit()
+        
+        if 'users.email_folded' in changes:
+            from users import backfill_folded_columns
+            backfill_folded_columns()
+            db.session.commit()
+        
+        if seeded or 'revenue_rollups' in changes:
+            from revenue import rebuild_revenue_rollups
+            rebuild_revenue_rollups()
+            db.session.commit()
+        
+        if seeded or 'inventory' in changes:
+            from inventory import backfill_inventory
+            backfill_inventory()
+            db.session.commit()
+        
+        from search_index import ensure_search_index
+        ensure_search_index()
+
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models.
+    create_all() only creates missing tables, so columns and indexes added
+    later are created here. Returns the names of the tables, indexes and
+    'table.column' names that were added.
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    db.create_all(bind_key=None)  # Bind "read" chỉ là pool đọc của cùng database
+    added = {name for name in db.metadata.tables if name not in existing_tables}
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.execute(db.text(_add_column_sql(table, column)))
+                    added.add(f'{table.name}.{column.name}')
+    
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                added.add(index.name)
+    return added
+
+
+def copy_database(target_url, batch_size=1000):
+    """Copy every table of the app database into an empty database at
+    target_url (e.g. SQLite -> PostgreSQL), creating its tables first.
+    Returns {table name: rows copied}.
+    """
+    target = db.create_engine(target_url)
+    counts = {}
+    try:
+        db.metadata.create_all(target)
+        with target.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                counts[table.name] = 0
+                result = db.session.execute(table.select()).mappings()
+                while rows := [dict(row) for row in result.fetchmany(batch_size)]:
+                    conn.execute(table.insert(), rows)
+                    counts[table.name] += len(rows)
+                if target.dialect.name == 'postgresql':
+                    _reset_sequence(conn, table)
+    finally:
+        target.dispose()
+    return counts
+
+
+def _reset_sequence(conn, table):
+    """Move a serial id sequence past the ids copied in explicitly"""
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1 and isinstance(columns[0].type, db.Integer):
+        conn.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', '{columns[0].name}'), "
+            f"COALESCE(MAX({columns[0].name}), 1), MAX({columns[0].name}) IS NOT NULL) FROM {table.name}"
+        ))
+
+
+def _add_column_sql(table, column):
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    sql = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+    if column.server_default is not None:
+        sql += f" DEFAULT '{column.server_default.arg}'"
+    return sql
 
 
 def init_sample_data():
@@ -266,16 +808,16 @@ def init_sample_data():
             "price": 199000,
             "old_price": 299000,
             "category": "Áo thun",
-            "image": "/Images/thuntrang.png",
-            "images": ["/Images/thuntrang.png", "/Images/thunden.png", "/Images/thunau.png"],
+            "image": "/Images/b74f8c65ee602049.png",
+            "images": ["/Images/b74f8c65ee602049.png", "/Images/fc7b0c67c56679c4.png", "/Images/59e010c3936db295.png"],
             "description": "Áo thun cotton mềm, phù hợp mọi lứa tuổi. Chất liệu thấm hút mồ hôi tốt.",
             "stock": 50,
             "sizes": ["S", "M", "L", "XL"],
             "colors": ["Trắng", "Đen", "Nâu"],
             "color_images": {
-                "Trắng": "/Images/thuntrang.png",
-                "Đen": "/Images/thunden.png",
-                "Nâu": "/Images/thunau.png"
+                "Trắng": "/Images/b74f8c65ee602049.png",
+                "Đen": "/Images/fc7b0c67c56679c4.png",
+                "Nâu": "/Images/59e010c3936db295.png"
             },
             "rating": 4.0,
             "reviews": 1,
@@ -287,16 +829,16 @@ def init_sample_data():
             "price": 399000,
             "old_price": 599000,
             "category": "Áo khoác",
-            "image": "/Images/hoodiexam.png",
-            "images": ["/Images/hoodiexam.png", "/Images/hoodiexanhnavy.png", "/Images/hoodienau.png"],
+            "image": "/Images/41279554625d138f.png",
+            "images": ["/Images/41279554625d138f.png", "/Images/6f54fdfe30976828.png", "/Images/cfc9bcc1d3bcf6ae.png"],
             "description": "Hoodie ấm, thiết kế trẻ trung. Form rộng thoải mái.",
             "stock": 30,
             "sizes": ["M", "L", "XL", "XXL"],
             "colors": ["Xám", "Xanh navy", "Nâu"],
             "color_images": {
-                "Xám": "/Images/hoodiexam.png",
-                "Xanh navy": "/Images/hoodiexanhnavy.png",
-                "Nâu": "/Images/hoodienau.png"
+                "Xám": "/Images/41279554625d138f.png",
+                "Xanh navy": "/Images/6f54fdfe30976828.png",
+                "Nâu": "/Images/cfc9bcc1d3bcf6ae.png"
             },
             "rating": 4.5,
             "reviews": 2,
@@ -308,16 +850,16 @@ def init_sample_data():
             "price": 549000,
             "old_price": 749000,
             "category": "Quần",
-            "image": "/Images/jeanxanhdam.png",
-            "images": ["/Images/jeanxanhdam.png", "/Images/jeanxanhnhat.png", "/Images/jeanden.png"],
+            "image": "/Images/b0877193d319f784.png",
+            "images": ["/Images/b0877193d319f784.png", "/Images/300fa32275511d10.png", "/Images/d251970e1d8e146c.png"],
             "description": "Quần jeans co giãn, ôm vừa. Chất liệu denim cao cấp.",
             "stock": 20,
             "sizes": ["28", "29", "30", "31", "32"],
             "colors": ["Xanh đậm", "Xanh nhạt", "Đen"],
             "color_images": {
-                "Xanh đậm": "/Images/jeanxanhdam.png",
-                "Xanh nhạt": "/Images/jeanxanhnhat.png",
-                "Đen": "/Images/jeanden.png"
+                "Xanh đậm": "/Images/b0877193d319f784.png",
+                "Xanh nhạt": "/Images/300fa32275511d10.png",
+                "Đen": "/Images/d251970e1d8e146c.png"
             },
             "rating": 4.5,
             "reviews": 2,
@@ -329,16 +871,16 @@ def init_sample_data():
             "price": 279000,
             "old_price": 399000,
             "category": "Áo sơ mi",
-            "image": "/Images/somitrang.png",
-            "images": ["/Images/somitrang.png", "/Images/somixanh.png", "/Images/sominau.png"],
+            "image": "/Images/d4f9858a3b047ea3.png",
+            "images": ["/Images/d4f9858a3b047ea3.png", "/Images/9f9d1111655a3848.png", "/Images/4b277ec334f49e52.png"],
             "description": "Áo sơ mi lịch sự, phù hợp văn phòng.",
             "stock": 45,
             "sizes": ["S", "M", "L", "XL"],
             "colors": ["Trắng", "Xanh nhạt", "Nâu"],
             "color_images": {
-                "Trắng": "/Images/somitrang.png",
-                "Xanh nhạt": "/Images/somixanh.png",
-                "Nâu": "/Images/sominau.png"
+                "Trắng": "/Images/d4f9858a3b047ea3.png",
+                "Xanh nhạt": "/Images/9f9d1111655a3848.png",
+                "Nâu": "/Images/4b277ec334f49e52.png"
             },
             "rating": 4.5,
             "reviews": 2,
@@ -350,15 +892,15 @@ def init_sample_data():
             "price": 459000,
             "old_price": 599000,
             "category": "Váy",
-            "image": "/Images/vaybe.png",
-            "images": ["/Images/vaybe.png", "/Images/vayxanh.png"],
+            "image": "/Images/aaccff29627e2f5f.png",
+            "images": ["/Images/aaccff29627e2f5f.png", "/Images/52f56ea2b2909c4f.png"],
             "description": "Váy dài phong cách vintage, sang trọng.",
             "stock": 15,
             "sizes": ["S", "M", "L"],
             "colors": ["Be", "Xanh"],
             "color_images": {
-                "Be": "/Images/vaybe.png",
-                "Xanh": "/Images/vayxanh.png"
+                "Be": "/Images/aaccff29627e2f5f.png",
+                "Xanh": "/Images/52f56ea2b2909c4f.png"
             },
             "rating": 0.0,
             "reviews": 0,
@@ -370,15 +912,15 @@ def init_sample_data():
             "price": 189000,
             "old_price": 259000,
             "category": "Quần",
-            "image": "/Images/shortden.png",
-            "images": ["/Images/shortden.png", "/Images/shortxanh.png"],
+            "image": "/Images/cf16d42182a078ad.png",
+            "images": ["/Images/cf16d42182a078ad.png", "/Images/b001aa432d35332c.png"],
             "description": "Quần short thoáng mát, phù hợp tập luyện.",
             "stock": 60,
             "sizes": ["M", "L", "XL"],
             "colors": ["Đen", "Xanh"],
             "color_images": {
-                "Đen": "/Images/shortden.png",
-                "Xanh": "/Images/shortxanh.png"
+                "Đen": "/Images/cf16d42182a078ad.png",
+                "Xanh": "/Images/b001aa432d35332c.png"
             },
             "rating": 0.0,
             "reviews": 0,
@@ -390,16 +932,16 @@ def init_sample_data():
             "price": 789000,
             "old_price": 999000,
             "category": "Áo len",
-            "image": "/Images/lenxam.png",
-            "images": ["/Images/lenxam.png", "/Images/lenden.png", "/Images/lennavy.png"],
+            "image": "/Images/23a450ffb070da20.png",
+            "images": ["/Images/23a450ffb070da20.png", "/Images/60d4786d4cd97126.png", "/Images/b643a86032b9d616.png"],
             "description": "Áo len cashmere cao cấp, giữ ấm tốt.",
             "stock": 25,
             "sizes": ["S", "M", "L"],
             "colors": ["Xám", "Đen", "Navy"],
             "color_images": {
-                "Xám": "/Images/lenxam.png",
-                "Đen": "/Images/lenden.png",
-                "Navy": "/Images/lennavy.png"
+                "Xám": "/Images/23a450ffb070da20.png",
+                "Đen": "/Images/60d4786d4cd97126.png",
+                "Navy": "/Images/b643a86032b9d616.png"
             },
             "rating": 0.0,
             "reviews": 0,
@@ -411,15 +953,15 @@ def init_sample_data():
             "price": 329000,
             "old_price": 429000,
             "category": "Áo body",
-            "image": "/Images/bodytrang.png",
-            "images": ["/Images/bodytrang.png", "/Images/bodyden.png"],
+            "image": "/Images/ce3d82e94201fb02.png",
+            "images": ["/Images/ce3d82e94201fb02.png", "/Images/1f79b49b0ee6f804.png"],
             "description": "Áo Body Giữ Nhiệt Bamboo Cổ Tròn thanh lịch, dễ phối đồ.",
             "stock": 35,
             "sizes": ["S", "M", "L"],
             "colors": ["Trắng", "Đen"],
             "color_images": {
-                "Trắng": "/Images/bodytrang.png",
-                "Đen": "/Images/bodyden.png"
+                "Trắng": "/Images/ce3d82e94201fb02.png",
+                "Đen": "/Images/1f79b49b0ee6f804.png"
             },
             "rating": 0.0,
             "reviews": 0,
@@ -481,8 +1023,8 @@ def init_sample_data():
             id=str(uuid4()),
             user_email='nguyen.van.a@gmail.com',
             items=json.dumps([
-                {"product_id": product_ao_thun.id, "name": "Áo thun Basic", "price": 199000, "quantity": 2, "size": "M", "color": "Trắng", "image": "/Images/thuntrang.png"},
-                {"product_id": product_jeans.id, "name": "Quần Jeans Nam", "price": 549000, "quantity": 1, "size": "30", "color": "Xanh đậm", "image": "/Images/jeanxanhdam.png"}
+                {"product_id": product_ao_thun.id, "name": "Áo thun Basic", "price": 199000, "quantity": 2, "size": "M", "color": "Trắng", "image": "/Images/b74f8c65ee602049.png"},
+                {"product_id": product_jeans.id, "name": "Quần Jeans Nam", "price": 549000, "quantity": 1, "size": "30", "color": "Xanh đậm", "image": "/Images/b0877193d319f784.png"}
             ]),
             shipping_info=json.dumps({
                 "name": "Nguyễn Văn A",
@@ -497,13 +1039,13 @@ def init_sample_data():
             payment_status='completed',
             status='completed',
             notes='Giao hàng nhanh',
-            created_at='2024-11-10 10:00:00'
+            created_at=datetime(2024, 11, 10, 10, 0)
         ),
         Order(
             id=str(uuid4()),
             user_email='tran.thi.b@gmail.com',
             items=json.dumps([
-                {"product_id": product_ao_thun.id, "name": "Áo thun Basic", "price": 199000, "quantity": 1, "size": "L", "color": "Đen", "image": "/Images/thunden.png"}
+                {"product_id": product_ao_thun.id, "name": "Áo thun Basic", "price": 199000, "quantity": 1, "size": "L", "color": "Đen", "image": "/Images/fc7b0c67c56679c4.png"}
             ]),
             shipping_info=json.dumps({
                 "name": "Trần Thị B",
@@ -518,14 +1060,14 @@ def init_sample_data():
             payment_status='completed',
             status='completed',
             notes='',
-            created_at='2024-11-08 14:30:00'
+            created_at=datetime(2024, 11, 8, 14, 30)
         ),
         Order(
             id=str(uuid4()),
             user_email='le.van.c@gmail.com',
             items=json.dumps([
-                {"product_id": product_ao_thun.id, "name": "Áo thun Basic", "price": 199000, "quantity": 1, "size": "XL", "color": "Nâu", "image": "/Images/thunau.png"},
-                {"product_id": product_jeans.id, "name": "Quần Jeans Nam", "price": 549000, "quantity": 1, "size": "31", "color": "Xanh đậm", "image": "/Images/jeanxanhdam.png"}
+                {"product_id": product_ao_thun.id, "name": "Áo thun Basic", "price": 199000, "quantity": 1, "size": "XL", "color": "Nâu", "image": "/Images/59e010c3936db295.png"},
+                {"product_id": product_jeans.id, "name": "Quần Jeans Nam", "price": 549000, "quantity": 1, "size": "31", "color": "Xanh đậm", "image": "/Images/b0877193d319f784.png"}
             ]),
             shipping_info=json.dumps({
                 "name": "Lê Văn C",
@@ -540,13 +1082,13 @@ def init_sample_data():
             payment_status='completed',
             status='completed',
             notes='Dùng mã GIAM50K',
-            created_at='2024-11-12 09:15:00'
+            created_at=datetime(2024, 11, 12, 9, 15)
         ),
         Order(
             id=str(uuid4()),
             user_email='pham.thi.d@gmail.com',
             items=json.dumps([
-                {"product_id": product_somi.id, "name": "Áo sơ mi Công sở", "price": 279000, "quantity": 2, "size": "M", "color": "Trắng", "image": "/Images/somitrang.png"}
+                {"product_id": product_somi.id, "name": "Áo sơ mi Công sở", "price": 279000, "quantity": 2, "size": "M", "color": "Trắng", "image": "/Images/d4f9858a3b047ea3.png"}
             ]),
             shipping_info=json.dumps({
                 "name": "Phạm Thị D",
@@ -561,13 +1103,13 @@ def init_sample_data():
             payment_status='completed',
             status='completed',
             notes='',
-            created_at='2024-10-25 16:45:00'
+            created_at=datetime(2024, 10, 25, 16, 45)
         ),
         Order(
             id=str(uuid4()),
             user_email='hoang.van.e@gmail.com',
             items=json.dumps([
-                {"product_id": product_hoodie.id, "name": "Áo khoác Hoodie", "price": 399000, "quantity": 1, "size": "L", "color": "Xám", "image": "/Images/hoodiexam.png"}
+                {"product_id": product_hoodie.id, "name": "Áo khoác Hoodie", "price": 399000, "quantity": 1, "size": "L", "color": "Xám", "image": "/Images/41279554625d138f.png"}
             ]),
             shipping_info=json.dumps({
                 "name": "Hoàng Văn E",
@@ -582,7 +1124,7 @@ def init_sample_data():
             payment_status='completed',
             status='completed',
             notes='Dùng mã FREESHIP',
-            created_at='2024-11-05 11:20:00'
+            created_at=datetime(2024, 11, 5, 11, 20)
         )
     ]
     
@@ -6,15 +6,47 @@ Run:
   python flask_clothing_store.py
 Open http://127.0.0.1:5000
 """
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory,
+                   abort, Response, stream_with_context)
 from uuid import uuid4
+import csv
 import datetime
+import io
+import sys
+import tempfile
 from functools import wraps
 import json
 import os
-from werkzeug.utils import secure_filename
-from database import db, init_db, Product, User, Order, Review, ReviewReply, ReviewLike, Voucher
-from flask_mail import Mail, Message
+from werkzeug.security import safe_join
+from database import db, init_db, read_session, primary_reads, copy_database, Product, User, Order, Review, ReviewReply, ReviewLike, Job
+from catalog import query_catalog, typeahead_products, TYPEAHEAD_LIMIT
+from search_index import index_product, remove_product, rebuild_search_index
+from reviews import load_review_page, apply_rating, rating_summary, rebuild_rating_summaries
+from orders import (set_order_items, sync_order_status, count_purchases, last_purchased_item, backfill_order_items,
+                    ORDER_PAGE_SIZE, ORDER_FILTERS, parse_order_filters, query_admin_orders, count_admin_orders,
+                    query_user_orders, order_line_items, cancel_expired_order, normalize_order_dates,
+                    hold_order_items, replace_order_items)
+from users import role_counts, query_users, typeahead_customers
+from product_io import (FORMATS as PRODUCT_FORMATS, IMPORT_BATCH_SIZE, detect_format, read_rows, import_batches,
+                        import_products, export_products)
+from revenue import order_rollup_key, record_order_change, rebuild_revenue_rollups, dashboard_stats
+from request_cache import request_memo, install_query_counter
+from cache import init_cache, cached_value, invalidate
+from page_cache import cache_page, bump_catalog_version
+from images import (save_upload, srcset_attrs, add_image_variants, build_image_variants, is_immutable,
+                    IMMUTABLE_MAX_AGE, ARCHIVE_FOLDER, hash_existing_images, rewrite_image_urls, archive_images,
+                    write_image_manifest)
+from jobs import job_handler, enqueue, run_worker_pool, job_counts
+from outbox import queue_mail, allow_mail, run_mail_sender, outbox_counts
+from cart_store import load_cart, add_item, change_qty, remove_item, clear_cart, import_session_cart, parse_qty
+from pricing import price_cart
+from inventory import (HOLD_TTL, hold_stock, hold_expiry, settle_order_stock, release_stock,
+                       expired_order_ids, set_stock, adjust_shared_stock, delete_inventory)
+from vouchers import (VoucherError, TYPES as VOUCHER_TYPES, voucher_discount, check_voucher, redeem,
+                      save_voucher, invalidate_vouchers, settle_order_voucher,
+                      release_order_voucher)
+from flask_mail import Mail
+import click
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 
 app = Flask(__name__)
@@ -26,6 +58,8 @@ app.config['MAIL_USERNAME'] = 'shopquanao.demo.2025@gmail.com'
 app.config['MAIL_PASSWORD'] = 'txfn wypd shsc lmtl'
 app.config['MAIL_DEFAULT_SENDER'] = app.config['MAIL_USERNAME']
 
+app.config['MAIL_SEND_RATE'] = 30  # Tối đa số mail/phút mà run-mail-sender gửi
+app.config['MAIL_RESET_LIMIT'] = 3  # Số mail đặt lại mật khẩu tối đa mỗi giờ cho một email
 mail = Mail(app)
 s = URLSafeTimedSerializer(app.secret_key)
 
@@ -36,7 +70,11 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32MB max
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///clothing_store.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///clothing_store.db')
+# Replica cho các truy vấn đọc (danh mục, đánh giá), vd. postgresql://.../shop trên máy replica
+app.config['SQLALCHEMY_READ_URI'] = os.environ.get('DATABASE_READ_URL') or None
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_READ_POOL_SIZE'] = int(os.environ.get('DB_READ_POOL_SIZE', 10))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Create upload folder if it doesn't exist
@@ -45,15 +83,46 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 # Initialize database
 init_db(app)
+install_query_counter(app)
+
+# Cache cho các danh sách trang chủ ('memory', 'redis' hoặc 'null')
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+app.config['CACHE_DEFAULT_TTL'] = 300
+app.config['PAGE_CACHE_TTL'] = 120
+# Cache miss đọc từ primary: replica trễ sẽ giữ dữ liệu cũ trong cache suốt TTL
+init_cache(app, compute_context=primary_reads)
 
 # Helper function to check allowed file
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Ảnh do front proxy phục vụ: None, 'x-accel' (nginx) hoặc 'x-sendfile' (Apache/lighttpd)
+app.config['IMAGE_SENDFILE'] = os.environ.get('IMAGE_SENDFILE') or None
+app.config['IMAGE_ACCEL_PREFIX'] = '/protected-images/'  # internal location của nginx
+app.config['USE_X_SENDFILE'] = app.config['IMAGE_SENDFILE'] == 'x-sendfile'
+
 # Route to serve uploaded images
 @app.route('/Images/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    folder = app.config['UPLOAD_FOLDER']
+    # Tên theo hash nội dung không bao giờ đổi nội dung -> cache 1 năm
+    max_age = IMMUTABLE_MAX_AGE if is_immutable(filename) else None
+    if app.config['IMAGE_SENDFILE'] == 'x-accel':
+        path = safe_join(folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = app.response_class()
+        response.headers['X-Accel-Redirect'] = app.config['IMAGE_ACCEL_PREFIX'] + filename
+        response.headers.pop('Content-Type', None)
+        if max_age:
+            response.cache_control.max_age = max_age
+            response.cache_control.public = True
+    else:
+        response = send_from_directory(folder, filename, max_age=max_age)
+    if max_age:
+        response.cache_control.immutable = True
+    return response
 
 # ---------- Helper Functions ----------
 def login_required(f):
@@ -86,41 +155,71 @@ def staff_required(f):
 def format_price(price):
     return f"{price:,.0f}đ".replace(',', '.')
 
+@request_memo
 def get_cart():
-    return session.get('cart', [])
+    return load_cart(session.get('user', {}).get('email'))
+
+@app.before_request
+def migrate_session_cart():
+    """Move a cart left in the session cookie by an older version into cart_items"""
+    if 'cart' in session and 'user' in session:
+        items = session.pop('cart') or []
+        ids = [item.get('id') for item in items]
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))}
+        import_session_cart(session['user']['email'], items, products)
+        db.session.commit()
 
+@request_memo
 def get_wishlist():
+    """Product ids in the user's wishlist, as a set for `product.id in get_wishlist()`"""
     user_email = session.get('user', {}).get('email')
     if user_email:
-        user = User.query.get(user_email)
-        if user:
-            return json.loads(user.wishlist) if user.wishlist else []
-    return []
-
-def calculate_cart_totals():
-    cart = get_cart()
+        wishlist = db.session.query(User.wishlist).filter_by(email=user_email).scalar()
+        if wishlist:
+            return frozenset(json.loads(wishlist))
+    return frozenset()
+
+def calculate_cart_totals(cart=None):
+    if cart is None:
+        cart = get_cart()
     subtotal = sum(item['price'] * item['qty'] for item in cart)
     
     # Calculate shipping
     shipping = 0 if subtotal >= 500000 else 30000
     
-    # Calculate voucher discount
-    voucher_discount = session.get('voucher_discount', 0)
+    # Giảm giá tính lại từ giỏ hàng hiện tại mỗi lần, session chỉ lưu mã
+    discount = voucher_discount(session.get('voucher_code'), subtotal, shipping)
     
-    total = subtotal - voucher_discount + shipping
-    return subtotal, shipping, voucher_discount, total
+    total = subtotal - discount + shipping
+    return subtotal, shipping, discount, total
+
+HOME_RAILS = ('featured_products', 'best_sellers', 'categories')
 
+def invalidate_home_rails():
+    """Call after committing a change to products, ratings or completed orders"""
+    invalidate(*HOME_RAILS)
+    bump_catalog_version()
+
+@request_memo
 def get_featured_products():
-    products = Product.query.filter_by(featured=True).all()
-    return [p.to_dict() for p in products]
+    def load():
+        products = read_session().query(Product).filter_by(featured=True).all()
+        return [p.to_dict() for p in products]
+    return cached_value('featured_products', load)
 
+@request_memo
 def get_best_sellers():
-    products = Product.query.order_by(Product.sold.desc()).limit(8).all()
-    return [p.to_dict() for p in products]
+    def load():
+        products = read_session().query(Product).order_by(Product.sold.desc()).limit(8).all()
+        return [p.to_dict() for p in products]
+    return cached_value('best_sellers', load)
 
+@request_memo
 def get_categories():
-    categories = db.session.query(Product.category).distinct().all()
-    return [c[0] for c in categories]
+    def load():
+        categories = read_session().query(Product.category).distinct().all()
+        return [c[0] for c in categories]
+    return cached_value('categories', load)
 
 # ---------- Context Processors ----------
 @app.context_processor
@@ -133,87 +232,56 @@ def utility_processor():
         'get_featured_products': get_featured_products,
         'get_best_sellers': get_best_sellers,
         'get_categories': get_categories,
-        'get_wishlist': get_wishlist
+        'get_wishlist': get_wishlist,
+        'srcset_attrs': srcset_attrs
     }
 
 # ---------- Routes ----------
 @app.route('/')
+@cache_page()
 def home():
     return render_template('home.html')
 
 @app.route('/products')
+@cache_page()
 def products():
     category = request.args.get('category', '')
     search = request.args.get('q', '')
     price_range = request.args.get('price', '')
     sort = request.args.get('sort', '')
+    cursor = request.args.get('cursor')
     
-    # Filter products
-    query = Product.query
-    
-    if category:
-        query = query.filter_by(category=category)
-    
-    results = query.all()
-    
-    # 2. Lọc tìm kiếm bằng Python (Hỗ trợ tốt tiếng Việt "Á" và "á")
-    if search:
-        search_lower = search.lower() # Đổi từ khóa tìm kiếm về chữ thường
-        # Chỉ giữ lại sản phẩm nào mà tên (đã đổi về chữ thường) có chứa từ khóa
-        results = [p for p in results if search_lower in p.name.lower()]
-    
-    # 3. Chuyển đổi sang dictionary để hiển thị
-    filtered_products = [p.to_dict() for p in results]
+    # Lọc, tìm kiếm, sắp xếp và phân trang đều chạy trong SQL
+    page_products, next_cursor = query_catalog(category=category,
+                                               price_range=price_range,
+                                               search=search,
+                                               sort=sort,
+                                               cursor=cursor)
     
     return render_template('products.html', 
-                         products=filtered_products,
+                         products=page_products,
                          category=category,
                          search=search,
                          price_range=price_range,
-                         sort=sort)
-    
-    if price_range:
-        if price_range == '0-200000':
-            query = query.filter(Product.price <= 200000)
-        elif price_range == '200000-500000':
-            query = query.filter(Product.price >= 200000, Product.price <= 500000)
-        elif price_range == '500000-999999999':
-            query = query.filter(Product.price >= 500000)
-    
-    # Sort products
-    if sort == 'price_asc':
-        query = query.order_by(Product.price.asc())
-    elif sort == 'price_desc':
-        query = query.order_by(Product.price.desc())
-    elif sort == 'popular':
-        query = query.order_by(Product.sold.desc())
-    elif sort == 'rating':
-        query = query.order_by(Product.rating.desc())
-    elif sort == 'newest':
-        query = query.order_by(Product.created_at.desc())
-    
-    filtered_products = [p.to_dict() for p in query.all()]
-    
-    return render_template('products.html', 
-                         products=filtered_products,
-                         category=category,
-                         search=search,
-                         price_range=price_range,
-                         sort=sort)
+                         sort=sort,
+                         next_cursor=next_cursor)
 
 @app.route('/sale')
+@cache_page()
 def sale_products():
-    products = Product.query.filter(Product.old_price > Product.price).all()
-    sale_products = [p.to_dict() for p in products]
+    cursor = request.args.get('cursor')
+    sale_products, next_cursor = query_catalog(sale_only=True, cursor=cursor)
     return render_template('products.html', 
                          products=sale_products,
                          category='',
                          search='',
                          price_range='',
                          sort='',
+                         next_cursor=next_cursor,
                          page_title='Sản phẩm khuyến mãi')
 
 @app.route('/product/<pid>')
+@cache_page()
 def product_detail(pid):
     purchased_item = None
     product = Product.query.get(pid)
@@ -230,66 +298,31 @@ def product_detail(pid):
     per_page = 5
     
     user_email = session.get('user', {}).get('email')
-    reviews_query = Review.query.filter_by(product_id=pid).order_by(Review.created_at.desc())
-    reviews_pagination = reviews_query.paginate(page=page, per_page=per_page, error_out=False)
-    
-    # Calculate rating statistics
-    all_reviews = Review.query.filter_by(product_id=pid).all()
-    total_reviews = len(all_reviews)
-    avg_rating = sum([r.rating for r in all_reviews]) / total_reviews if total_reviews > 0 else 0
-    
-    rating_stats = {
-        '5': len([r for r in all_reviews if r.rating == 5]),
-        '4': len([r for r in all_reviews if r.rating == 4]),
-        '3': len([r for r in all_reviews if r.rating == 3]),
-        '2': len([r for r in all_reviews if r.rating == 2]),
-        '1': len([r for r in all_reviews if r.rating == 1]),
-    }
+    reviews_pagination, page_reviews = load_review_page(pid, page=page, per_page=per_page,
+                                                        user_email=user_email)
+    
+    # Rating statistics from the stored aggregates
+    total_reviews, avg_rating, rating_stats = rating_summary(product)
     
     # Kiểm tra user đã mua sản phẩm này chưa
     can_review = False
     user_reviewed = False
     if user_email:
         reviews_count = Review.query.filter_by(product_id=pid, user_email=user_email).count()
+        purchased_count = count_purchases(user_email, pid)
+        if purchased_count:
+            can_review = True
+            purchased_item = last_purchased_item(user_email, pid)
         
-        purchased_count = 0
-        user_orders = Order.query.filter_by(user_email=user_email, status='completed').all()
-        # Update code
-        for order in user_orders:
-                order_items = json.loads(order.items) if order.items else []
-                for item in order_items:
-                    if str(item.get('product_id')) == str(pid) or str(item.get('id')) == str(pid):
-                        can_review = True
-                        purchased_item = item
-                        purchased_count += 1  
-                        break
-        
-
         user_reviewed = reviews_count >= purchased_count
-        
-        if not user_reviewed:
-            user_orders = Order.query.filter_by(
-                user_email=user_email,
-                status='completed'
-            ).all()
-
-            for order in user_orders:
-                order_items = json.loads(order.items) if order.items else []
-                for item in order_items:
-                    if str(item.get('product_id')) == str(pid):
-                        can_review = True
-                        purchased_item = item
-                        break
-                    if can_review:
-                        break
     
     return render_template('product_detail.html', 
                          product=product.to_dict(), 
                          related_products=related_products,
-                         reviews=[r.to_dict(user_email) for r in reviews_pagination.items],
+                         reviews=page_reviews,
                          reviews_pagination=reviews_pagination,
                          total_reviews=total_reviews,
-                         avg_rating=round(avg_rating, 1),
+                         avg_rating=avg_rating,
                          rating_stats=rating_stats,
                          can_review=can_review,
                          user_reviewed=user_reviewed if user_email else False,
@@ -305,33 +338,20 @@ def add_to_cart():
     pid = request.form.get('pid')
     color = request.form.get('color', 'Trắng')
     size = request.form.get('size', 'M')
-    qty = int(request.form.get('qty', 1))
+    qty = parse_qty(request.form.get('qty', 1))
+    if qty is None:
+        flash('Số lượng không hợp lệ', 'error')
+        return redirect(request.referrer or '/products')
     
     product = Product.query.get(pid)
     if not product:
         flash('Sản phẩm không tồn tại', 'error')
         return redirect('/products')
     
-    cart = get_cart()
-    
-    # Check if product already in cart with same color and size
-    existing_item = next((item for item in cart if item['id'] == pid and 
-                         item.get('color') == color and item.get('size') == size), None)
-    
-    if existing_item:
-        existing_item['qty'] += qty
-    else:
-        cart.append({
-            'id': pid,
-            'name': product.name,
-            'price': product.price,
-            'image': product.image,
-            'color': color,
-            'size': size,
-            'qty': qty
-        })
-    
-    session['cart'] = cart
+    # Cộng dồn nếu đã có cùng sản phẩm, màu và size trong giỏ
+    add_item(session['user']['email'], product, color, size, qty)
+    db.session.commit()
+    get_cart.invalidate()
     flash('Đã thêm vào giỏ hàng', 'success')
     
     if request.referrer:
@@ -345,19 +365,13 @@ def update_cart():
     size = request.form.get('size')   # <--- Lấy thêm size
     action = request.form.get('action')
     
-    cart = get_cart()
-    
-    # Tìm sản phẩm khớp cả ID, Màu và Size
-    item = next((item for item in cart if item['id'] == pid and 
-                 item.get('color') == color and item.get('size') == size), None)
-    
-    if item:
-        if action == 'increase':
-            item['qty'] += 1
-        elif action == 'decrease' and item['qty'] > 1:
-            item['qty'] -= 1
+    # Dòng giỏ hàng khớp cả ID, Màu và Size
+    user_email = session.get('user', {}).get('email')
+    if user_email and action in ('increase', 'decrease'):
+        change_qty(user_email, pid, color, size, 1 if action == 'increase' else -1)
+        db.session.commit()
+        get_cart.invalidate()
     
-    session['cart'] = cart
     return redirect('/cart')
 
 @app.route('/remove-from-cart', methods=['POST'])
@@ -366,14 +380,12 @@ def remove_from_cart():
     color = request.form.get('color') # <--- Lấy thêm màu
     size = request.form.get('size')   # <--- Lấy thêm size
     
-    cart = get_cart()
-    
-    # Giữ lại những sản phẩm KHÔNG trùng khớp (Xóa sản phẩm trùng khớp cả 3 yếu tố)
-    cart = [item for item in cart if not (item['id'] == pid and 
-                                        item.get('color') == color and 
-                                        item.get('size') == size)]
-    
-    session['cart'] = cart
+    # Xóa dòng trùng khớp cả 3 yếu tố
+    user_email = session.get('user', {}).get('email')
+    if user_email:
+        remove_item(user_email, pid, color, size)
+        db.session.commit()
+        get_cart.invalidate()
     flash('Đã xóa sản phẩm khỏi giỏ hàng', 'success')
     return redirect('/cart')
 
@@ -396,29 +408,15 @@ def cart():
 @login_required
 def apply_voucher():
     code = request.form.get('voucher', '').upper().strip()
-    voucher = Voucher.query.filter_by(code=code, active=True).first()
-    
-    if not voucher:
-        flash('Mã giảm giá không hợp lệ', 'error')
-        return redirect('/cart')
+    subtotal, shipping, _, _ = calculate_cart_totals()
     
-    subtotal, _, _, _ = calculate_cart_totals()
-    
-    if subtotal < voucher.min_order:
-        flash(f'Đơn hàng tối thiểu {format_price(voucher.min_order)} để sử dụng mã này', 'error')
+    try:
+        check_voucher(code, session['user']['email'], subtotal, shipping)
+    except VoucherError as e:
+        flash(str(e), 'error')
         return redirect('/cart')
     
-    if voucher.type == 'percent':
-        discount = subtotal * voucher.discount / 100
-    elif voucher.type == 'shipping':
-        discount = voucher.discount
-        # Set shipping to 0
-        session['free_shipping'] = True
-    else:
-        discount = voucher.discount
-    
     session['voucher_code'] = code
-    session['voucher_discount'] = discount
     
     flash(f'Áp dụng mã giảm giá thành công', 'success')
     return redirect('/cart')
@@ -427,8 +425,6 @@ def apply_voucher():
 @login_required
 def remove_voucher():
     session.pop('voucher_code', None)
-    session.pop('voucher_discount', None)
-    session.pop('free_shipping', None)
     flash('Đã xóa mã giảm giá', 'success')
     return redirect('/cart')
 
@@ -446,6 +442,7 @@ def add_to_wishlist():
             wishlist.append(pid)
             user.wishlist = json.dumps(wishlist)
             db.session.commit()
+            get_wishlist.invalidate()
     
     return jsonify({'success': True})
 
@@ -463,6 +460,7 @@ def remove_from_wishlist():
             wishlist.remove(pid)
             user.wishlist = json.dumps(wishlist)
             db.session.commit()
+            get_wishlist.invalidate()
     
     return jsonify({'success': True})
 
@@ -485,39 +483,17 @@ def product_reviews(pid):
     per_page = 10
     sort = request.args.get('sort', 'recent')  # recent, helpful, rating_high, rating_low
     
-    query = Review.query.filter_by(product_id=pid)
-    
-    # Apply sorting
-    if sort == 'helpful':
-        query = query.order_by(Review.helpful_count.desc())
-    elif sort == 'rating_high':
-        query = query.order_by(Review.rating.desc())
-    elif sort == 'rating_low':
-        query = query.order_by(Review.rating.asc())
-    else:  # recent
-        query = query.order_by(Review.created_at.desc())
-    
-    reviews = query.paginate(page=page, per_page=per_page, error_out=False)
-    
-    # Calculate rating statistics
-    all_reviews = Review.query.filter_by(product_id=pid).all()
-    total_reviews = len(all_reviews)
-    avg_rating = sum([r.rating for r in all_reviews]) / total_reviews if total_reviews > 0 else 0
-    
-    rating_stats = {
-        '5': len([r for r in all_reviews if r.rating == 5]),
-        '4': len([r for r in all_reviews if r.rating == 4]),
-        '3': len([r for r in all_reviews if r.rating == 3]),
-        '2': len([r for r in all_reviews if r.rating == 2]),
-        '1': len([r for r in all_reviews if r.rating == 1]),
-    }
-    
     user_email = session.get('user', {}).get('email')
+    reviews, page_reviews = load_review_page(pid, page=page, per_page=per_page,
+                                             sort=sort, user_email=user_email)
+    
+    # Rating statistics from the stored aggregates
+    total_reviews, avg_rating, rating_stats = rating_summary(product)
     
     return jsonify({
-        'reviews': [r.to_dict(user_email) for r in reviews.items],
+        'reviews': page_reviews,
         'total': total_reviews,
-        'avg_rating': round(avg_rating, 1),
+        'avg_rating': avg_rating,
         'rating_stats': rating_stats,
         'has_next': reviews.has_next,
         'has_prev': reviews.has_prev,
@@ -541,27 +517,14 @@ def add_review(pid):
     current_reviews = Review.query.filter_by(product_id=pid, user_email=user_email).count()
     
     # 2. Đếm số lần mua thực tế
-    purchased_count = 0
-    user_orders = Order.query.filter_by(user_email=user_email, status='completed').all()
-    for order in user_orders:
-        order_items = json.loads(order.items)
-        if any(str(item.get('product_id')) == str(pid) or str(item.get('id')) == str(pid) for item in order_items):
-            purchased_count += 1
+    purchased_count = count_purchases(user_email, pid)
             
     # 3. Nếu số review đã bằng hoặc hơn số lần mua -> Chặn
     if current_reviews >= purchased_count:
         flash('Bạn đã đánh giá hết các lượt mua. Hãy mua thêm để tiếp tục!', 'warning')
         return redirect(url_for('product_detail', pid=pid))
     
-    # Check if user has purchased this product
-    user_orders = Order.query.filter_by(user_email=user_email, status='completed').all()
-    has_purchased = False
-    for order in user_orders:
-        order_items = json.loads(order.items)
-        # Check both 'product_id' and 'id' keys for compatibility
-        if any(item.get('product_id') == pid or item.get('id') == pid for item in order_items):
-            has_purchased = True
-            break
+    has_purchased = purchased_count > 0
     
     rating = request.form.get('rating', type=int)
     comment = request.form.get('comment', '')
@@ -577,10 +540,7 @@ def add_review(pid):
         files = request.files.getlist('images')
         for file in files[:5]:  # Maximum 5 images
             if file and allowed_file(file.filename):
-                filename = f"review_{uuid4()}_{secure_filename(file.filename)}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                review_images.append(f"/Images/{filename}")
+                review_images.append(save_upload(file, app.config['UPLOAD_FOLDER']))
     
     review = Review(
         product_id=pid,
@@ -596,14 +556,15 @@ def add_review(pid):
     
     db.session.add(review)
     
-    # Update product rating
-    all_reviews = Review.query.filter_by(product_id=pid).all()
-    all_reviews.append(review)
-    new_avg_rating = sum([r.rating for r in all_reviews]) / len(all_reviews)
-    product.rating = round(new_avg_rating, 1)
-    product.reviews = len(all_reviews)
+    # Update product rating aggregates in the same transaction
+    apply_rating(pid, rating, 1)
+    
+    if review_images:
+        db.session.flush()
+        enqueue('image_variants', {'model': 'review', 'id': review.id, 'urls': review_images})
     
     db.session.commit()
+    invalidate_home_rails()
     
     flash('Đánh giá của bạn đã được gửi thành công!', 'success')
     return redirect(url_for('product_detail', pid=pid))
@@ -630,6 +591,7 @@ def reply_review(review_id):
     
     db.session.add(reply)
     db.session.commit()
+    bump_catalog_version()
     
     flash('Phản hồi đã được gửi thành công!', 'success')
     return jsonify({'success': True, 'reply': reply.to_dict()})
@@ -651,12 +613,14 @@ def mark_helpful(review_id):
         # Unlike: xóa like
         db.session.delete(existing_like)
         db.session.commit()
+        bump_catalog_version()
         liked = False
     else:
         # Like: thêm like mới
         new_like = ReviewLike(review_id=review_id, user_email=user_email)
         db.session.add(new_like)
         db.session.commit()
+        bump_catalog_version()
         liked = True
     
     # Đếm tổng số like
@@ -682,20 +646,12 @@ def delete_review(review_id):
     if review.user_email != user_email and user_role != 'admin':
         return jsonify({'error': 'Bạn không có quyền xóa đánh giá này'}), 403
     
-    # Update product rating before deleting
-    product = Product.query.get(review.product_id)
-    if product:
-        remaining_reviews = Review.query.filter_by(product_id=review.product_id).filter(Review.id != review_id).all()
-        if remaining_reviews:
-            new_avg_rating = sum([r.rating for r in remaining_reviews]) / len(remaining_reviews)
-            product.rating = round(new_avg_rating, 1)
-            product.reviews = len(remaining_reviews)
-        else:
-            product.rating = 0
-            product.reviews = 0
+    # Update product rating aggregates in the same transaction
+    apply_rating(review.product_id, review.rating, -1)
     
     db.session.delete(review)
     db.session.commit()
+    invalidate_home_rails()
     
     flash('Đánh giá đã được xóa', 'success')
     return jsonify({'success': True})
@@ -721,6 +677,7 @@ def edit_reply(reply_id):
     
     reply.comment = comment
     db.session.commit()
+    bump_catalog_version()
     
     return jsonify({'success': True, 'reply': reply.to_dict()})
 
@@ -741,6 +698,7 @@ def delete_reply(reply_id):
     
     db.session.delete(reply)
     db.session.commit()
+    bump_catalog_version()
     
     return jsonify({'success': True})
 
@@ -762,12 +720,18 @@ def checkout():
         
         print(f"DEBUG: payment_method from form = {payment_method}")
         
-        subtotal, shipping, voucher_discount, total = calculate_cart_totals()
+        # Giá và tồn kho lấy từ bảng products, không tin giá lưu trong giỏ
+        lines, problems = price_cart(cart)
+        if problems:
+            for problem in problems:
+                flash(problem, 'error')
+            return redirect('/cart')
+        
+        subtotal, shipping, voucher_discount, total = calculate_cart_totals(lines)
         
         order = Order(
             id=str(uuid4()),
             user_email=session['user']['email'],
-            items=json.dumps(cart),
             shipping_info=json.dumps({
                 'name': name,
                 'phone': phone,
@@ -776,28 +740,52 @@ def checkout():
             subtotal=subtotal,
             shipping=shipping,
             voucher_discount=voucher_discount,
+            voucher_code=session.get('voucher_code') if voucher_discount else None,
             total=total,
             payment_method=payment_method,
             payment_status='pending' if payment_method in ['banking', 'momo', 'qr'] else 'cod',
             status='pending',
             notes=notes,
-            created_at=datetime.datetime.now().strftime('%d/%m/%Y %H:%M')
+            created_at=datetime.datetime.now()
         )
+        set_order_items(order, lines)
+        
+        # Giữ hàng theo từng biến thể; nếu đơn khác vừa mua hết thì hủy cả giao dịch
+        expires_at = hold_expiry(payment_method)
+        if hold_stock(order.id, lines, expires_at):
+            db.session.rollback()
+            flash('Một số sản phẩm vừa hết hàng, vui lòng kiểm tra lại giỏ hàng', 'error')
+            return redirect('/cart')
+        if expires_at:
+            enqueue('expire_stock_hold', {'order_id': order.id}, delay=HOLD_TTL.total_seconds())
+        
+        # Đếm lượt dùng voucher trong cùng giao dịch với đơn hàng
+        if voucher_discount:
+            try:
+                redeem(session['voucher_code'], order.user_email)
+            except VoucherError as e:
+                db.session.rollback()
+                session.pop('voucher_code', None)
+                flash(str(e), 'error')
+                return redirect('/cart')
         
         db.session.add(order)
+        record_order_change(None, order_rollup_key(order))
+        clear_cart(order.user_email)
         db.session.commit()
+        get_cart.invalidate()
         
-        # Clear cart and voucher
-        session.pop('cart', None)
+        # Clear voucher
         session.pop('voucher_code', None)
-        session.pop('voucher_discount', None)
-        session.pop('free_shipping', None)
         
         # Redirect to confirmation page for all payment methods
         flash('Đặt hàng thành công!', 'success')
         return redirect(f'/payment-confirmation/{order.id}')
     
-    subtotal, shipping, voucher_discount, total = calculate_cart_totals()
+    cart, problems = price_cart(cart)
+    for problem in problems:
+        flash(problem, 'warning')
+    subtotal, shipping, voucher_discount, total = calculate_cart_totals(cart)
     
     # Get user info for pre-filling form
     user_email = session['user']['email']
@@ -890,14 +878,24 @@ def order_detail(order_id):
 @app.route('/my-orders')
 @login_required
 def my_orders():
-    user_email = session['user']['email']
-    # Sort by created_at in descending order (newest first)
-    orders = Order.query.filter_by(user_email=user_email).all()
-    # Sort manually since created_at is a string
-    user_orders = [o.to_dict() for o in orders]
-    user_orders.sort(key=lambda x: x['created_at'], reverse=True)
-    
-    return render_template('my_orders.html', orders=user_orders)
+    # Chỉ lấy thông tin đơn theo trang; sản phẩm tải khi mở từng đơn
+    cursor = request.args.get('cursor')
+    user_orders, next_cursor = query_user_orders(session['user']['email'], cursor=cursor)
+    return render_template('my_orders.html', orders=user_orders, next_cursor=next_cursor, paged=bool(cursor))
+
+@app.route('/api/my-orders')
+@login_required
+def my_orders_api():
+    user_orders, next_cursor = query_user_orders(session['user']['email'], cursor=request.args.get('cursor'))
+    return jsonify({'orders': user_orders, 'next_cursor': next_cursor})
+
+@app.route('/my-orders/<order_id>/items')
+@login_required
+def my_order_items(order_id):
+    result = order_line_items(order_id, session['user']['email'])
+    if result is None:
+        return jsonify({'error': 'Đơn hàng không tồn tại'}), 404
+    return jsonify(result)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -976,22 +974,19 @@ def forgot_password():
         user = User.query.get(email)
         
         if user:
-            # 1. Tạo token hết hạn trong 10 phút (600 giây)
-            token = s.dumps(email, salt='email-recover-key')
-            
-            # 2. Tạo link đặt lại mật khẩu
-            link = url_for('reset_with_token', token=token, _external=True)
-            
-            # 3. Soạn nội dung email
-            msg = Message('Đặt lại mật khẩu - Fashion Store', recipients=[email])
-            msg.body = f'Chào bạn,\n\nBạn đã yêu cầu đặt lại mật khẩu. Vui lòng bấm vào link sau để đổi mật khẩu (Link hết hạn sau 10 phút):\n\n{link}\n\nNếu bạn không yêu cầu, hãy bỏ qua email này.'
-            
-            # 4. Gửi mail
-            try:
-                mail.send(msg)
-                flash('Đã gửi hướng dẫn vào email. Vui lòng kiểm tra hộp thư (cả mục Spam).', 'success')
-            except Exception as e:
-                flash(f'Lỗi khi gửi mail: {str(e)}', 'error')
+            # Giới hạn số mail mỗi giờ để tránh bị spam yêu cầu đặt lại
+            if allow_mail(email, 'password_reset', app.config['MAIL_RESET_LIMIT'], datetime.timedelta(hours=1)):
+                # 1. Tạo token hết hạn trong 10 phút (600 giây)
+                token = s.dumps(email, salt='email-recover-key')
+                
+                # 2. Tạo link đặt lại mật khẩu
+                link = url_for('reset_with_token', token=token, _external=True)
+                
+                # 3. Soạn nội dung email và đưa vào hàng đợi (run-mail-sender sẽ gửi)
+                body = f'Chào bạn,\n\nBạn đã yêu cầu đặt lại mật khẩu. Vui lòng bấm vào link sau để đổi mật khẩu (Link hết hạn sau 10 phút):\n\n{link}\n\nNếu bạn không yêu cầu, hãy bỏ qua email này.'
+                queue_mail(email, 'Đặt lại mật khẩu - Fashion Store', body=body, kind='password_reset')
+                db.session.commit()
+            flash('Đã gửi hướng dẫn vào email. Vui lòng kiểm tra hộp thư (cả mục Spam).', 'success')
         else:
             # Bảo mật: Vẫn báo thành công dù email không tồn tại
             flash('Nếu email tồn tại trong hệ thống, chúng tôi đã gửi hướng dẫn.', 'success')
@@ -1083,79 +1078,55 @@ def change_password():
 @app.route('/admin')
 @staff_required
 def admin_dashboard():
-    total_orders = Order.query.count()
     total_products = Product.query.count()
     total_users = User.query.count()
     
-    # Calculate revenue
-    completed_orders = Order.query.filter_by(status='completed').all()
-    revenue = sum(order.total for order in completed_orders)
-    
-    # Calculate revenue by month and year
-    from collections import defaultdict
-    revenue_by_month = defaultdict(float)
-    revenue_by_year = defaultdict(float)
-    orders_by_month = defaultdict(int)
-    orders_by_year = defaultdict(int)
-    
-    all_orders = Order.query.all()
-    for order in all_orders:
-        if order.created_at:
-            try:
-                # Parse date format: DD/MM/YYYY HH:MM
-                date_parts = order.created_at.split(' ')[0].split('/')
-                if len(date_parts) == 3:
-                    day, month, year = date_parts
-                    month_key = f"{month}/{year}"
-                    year_key = year
-                    
-                    if order.status == 'completed':
-                        revenue_by_month[month_key] += order.total
-                        revenue_by_year[year_key] += order.total
-                    
-                    orders_by_month[month_key] += 1
-                    orders_by_year[year_key] += 1
-            except:
-                pass
+    # Doanh thu và số đơn theo tháng/năm đọc từ bảng revenue_rollups
+    stats = dashboard_stats()
     
-    # Sort by date (most recent first)
-    sorted_months = sorted(revenue_by_month.items(), key=lambda x: (x[0].split('/')[1], x[0].split('/')[0]), reverse=True)[:12]
-    sorted_years = sorted(revenue_by_year.items(), key=lambda x: x[0], reverse=True)
-    
-    print(f"DEBUG: Revenue by month: {dict(revenue_by_month)}")
-    print(f"DEBUG: Revenue by year: {dict(revenue_by_year)}")
-    print(f"DEBUG: Orders by year: {dict(orders_by_year)}")
-    print(f"DEBUG: Sorted years: {sorted_years}")
-    
-    recent_orders = [o.to_dict() for o in Order.query.limit(5).all()]
-    recent_orders.sort(key=lambda x: x['created_at'], reverse=True)
+    recent_orders = [o.to_dict() for o in Order.query.order_by(Order.created_at.desc()).limit(5).all()]
     
     return render_template('admin/dashboard.html',
-                         total_orders=total_orders,
+                         total_orders=stats['total_orders'],
                          total_products=total_products,
                          total_users=total_users,
-                         revenue=revenue,
-                         revenue_by_month=sorted_months,
-                         revenue_by_year=sorted_years,
-                         orders_by_month=orders_by_month,
-                         orders_by_year=orders_by_year,
+                         revenue=stats['revenue'],
+                         revenue_by_month=stats['revenue_by_month'],
+                         revenue_by_year=stats['revenue_by_year'],
+                         orders_by_month=stats['orders_by_month'],
+                         orders_by_year=stats['orders_by_year'],
                          recent_orders=recent_orders)
 
 @app.route('/admin/orders')
 @staff_required
 def admin_orders():
-    orders = [o.to_dict() for o in Order.query.all()]
-    orders.sort(key=lambda x: x['created_at'], reverse=True)
-    return render_template('admin/orders.html', orders=orders)
+    # Lọc và phân trang trong SQL, chỉ lấy các cột bảng hiển thị
+    filters = parse_order_filters(request.args)
+    orders, next_cursor = query_admin_orders(filters, cursor=request.args.get('cursor'))
+    total, exact = count_admin_orders(filters)
+    filter_args = {key: request.args[key] for key in ORDER_FILTERS if request.args.get(key)}
+    return render_template('admin/orders.html', orders=orders, next_cursor=next_cursor,
+                           total=total, total_exact=exact, filter_args=filter_args,
+                           paged=bool(request.args.get('cursor')))
+
+@app.route('/admin/api/orders')
+@staff_required
+def admin_orders_api():
+    filters = parse_order_filters(request.args)
+    try:
+        limit = min(max(int(request.args.get('limit', ORDER_PAGE_SIZE)), 1), 200)
+    except ValueError:
+        limit = ORDER_PAGE_SIZE
+    orders, next_cursor = query_admin_orders(filters, cursor=request.args.get('cursor'), limit=limit)
+    total, exact = count_admin_orders(filters)
+    return jsonify({'orders': orders, 'next_cursor': next_cursor, 'total': total, 'total_exact': exact})
 
 @app.route('/admin/create-order', methods=['GET', 'POST'])
 @admin_required
 def admin_create_order():
     if request.method == 'GET':
-        # Get all customers for dropdown
-        customers = User.query.filter_by(role='user').all()
-        products = Product.query.all()
-        return render_template('admin/create_order.html', customers=customers, products=products)
+        # Khách hàng và sản phẩm được tìm qua /admin/api/*/search khi gõ
+        return render_template('admin/create_order.html')
     
     if request.method == 'POST':
         # Get form data
@@ -1189,7 +1160,6 @@ def admin_create_order():
         order = Order(
             id=str(uuid4()),
             user_email=customer_email,
-            items=json.dumps(cart_items),
             shipping_info=json.dumps({
                 'name': customer_name,
                 'phone': customer_phone,
@@ -1203,10 +1173,16 @@ def admin_create_order():
             payment_status=payment_status,
             status='pending',
             notes=notes,
-            created_at=datetime.datetime.now().strftime('%d/%m/%Y %H:%M')
+            created_at=datetime.datetime.now()
         )
+        # Đơn do nhân viên tạo cũng giữ hàng như checkout (không tự hết hạn)
+        if hold_order_items(order, cart_items):
+            db.session.rollback()
+            flash('Không đủ hàng hoặc số lượng không hợp lệ cho một số sản phẩm', 'error')
+            return redirect('/admin/create-order')
         
         db.session.add(order)
+        record_order_change(None, order_rollup_key(order))
         db.session.commit()
         
         flash(f'Đã tạo đơn hàng #{order.id[:8]} thành công', 'success')
@@ -1223,6 +1199,54 @@ def admin_products():
     products = [p.to_dict() for p in Product.query.all()]
     return render_template('admin/products.html', products=products)
 
+@app.route('/admin/products/export')
+@staff_required
+def admin_export_products():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in PRODUCT_FORMATS:
+        abort(400)
+    # Ghi từng dòng ra response, không nạp cả danh mục vào bộ nhớ
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"products-{datetime.datetime.now():%Y%m%d-%H%M}.{fmt}"
+    return Response(stream_with_context(export_products(fmt)), mimetype=f'{mimetype}; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/admin/products/import', methods=['POST'])
+@admin_required
+def admin_import_products():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'error': 'Vui lòng chọn file CSV hoặc JSONL'}), 400
+    fmt = request.form.get('format') or detect_format(file.filename)
+    if fmt not in PRODUCT_FORMATS:
+        return jsonify({'error': 'Định dạng không hỗ trợ'}), 400
+    # File upload bị đóng khi view trả về, nên chép ra file tạm (theo từng khối) rồi đọc dần
+    spooled = tempfile.TemporaryFile()
+    file.save(spooled)
+    spooled.seek(0)
+
+    def progress():
+        # Mỗi batch đã commit -> một dòng JSON tiến độ
+        summary = {'rows': 0, 'created': 0, 'updated': 0, 'invalid': 0, 'errors': [], 'warnings': []}
+        failure = None
+        with io.TextIOWrapper(spooled, encoding='utf-8-sig', newline='') as stream:
+            try:
+                for summary in import_batches(read_rows(stream, fmt)):
+                    yield json.dumps({key: value for key, value in summary.items()
+                                      if key not in ('errors', 'warnings')}) + '\n'
+            except UnicodeDecodeError:
+                failure = 'File không phải UTF-8'
+            except csv.Error as exc:
+                failure = f'File CSV lỗi: {exc}'
+        # Các batch trước lỗi đã được commit
+        invalidate_home_rails()
+        if failure:
+            db.session.rollback()
+            summary = dict(summary, error=failure)
+        yield json.dumps(dict(summary, done=True), ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(progress()), mimetype='application/x-ndjson')
+
 @app.route('/admin/update-order-status', methods=['POST'])
 @staff_required
 def update_order_status():
@@ -1231,8 +1255,15 @@ def update_order_status():
     
     order = Order.query.get(order_id)
     if order:
+        before = order_rollup_key(order)
+        previous_status = order.status
         order.status = status
+        sync_order_status(order)
+        settle_order_stock(order)
+        settle_order_voucher(order, previous_status)
+        record_order_change(before, order_rollup_key(order))
         db.session.commit()
+        invalidate_home_rails()
         flash('Cập nhật trạng thái đơn hàng thành công', 'success')
     
     return redirect('/admin/orders')
@@ -1255,9 +1286,14 @@ def payment_complete(order_id):
     order = Order.query.get(order_id)
     if not order:
         return jsonify({'success':False}),404
+    before = order_rollup_key(order)
     order.payment_status = 'paid'
     order.status = 'completed'
+    sync_order_status(order)
+    settle_order_stock(order)
+    record_order_change(before, order_rollup_key(order))
     db.session.commit()
+    invalidate_home_rails()
     return jsonify({'success':True, 'redirect': url_for('home')})
 
 @app.route('/admin/add-product', methods=['GET', 'POST'])
@@ -1266,18 +1302,13 @@ def admin_add_product():
     if request.method == 'POST':
         # Handle image upload
         image_url = ''
+        uploaded = False
         if 'image_file' in request.files:
             file = request.files['image_file']
             if file and file.filename and allowed_file(file.filename):
-                # Generate unique filename
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                unique_filename = f"{name}_{uuid4().hex[:8]}{ext}"
-                
-                # Save file
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                file.save(filepath)
-                image_url = f"/Images/{unique_filename}"
+                # Saved under the hash of its content; resized variants are made by the worker
+                image_url = save_upload(file, app.config['UPLOAD_FOLDER'])
+                uploaded = True
         
         # If no file uploaded, use URL from input
         if not image_url:
@@ -1311,7 +1342,12 @@ def admin_add_product():
             featured=bool(request.form.get('featured'))
         )
         db.session.add(product)
+        set_stock(product.id, stock)
+        index_product(product)
+        if uploaded:
+            enqueue('image_variants', {'model': 'product', 'id': product.id, 'urls': [image_url]})
         db.session.commit()
+        invalidate_home_rails()
         flash('Đã thêm sản phẩm', 'success')
         return redirect(url_for('admin_products'))
     return render_template('admin/add_product.html')
@@ -1321,24 +1357,23 @@ def admin_add_product():
 @admin_required
 def admin_users():
     role_filter = request.args.get('role', 'all')
+    search = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
     
-    if role_filter == 'all':
-        users = User.query.all()
-    else:
-        users = User.query.filter_by(role=role_filter).all()
-    
-    all_count = User.query.count()
-    admin_count = User.query.filter_by(role='admin').count()
-    staff_count = User.query.filter_by(role='staff').count()
-    user_count = User.query.filter_by(role='user').count()
+    # Một truy vấn GROUP BY cho số lượng theo vai trò, danh sách phân trang
+    counts = role_counts()
+    users, next_cursor = query_users(role=role_filter, search=search, cursor=cursor)
     
     return render_template('admin/users.html', 
-                         users=[u.to_dict() for u in users],
+                         users=users,
                          role=role_filter,
-                         all_count=all_count,
-                         admin_count=admin_count,
-                         staff_count=staff_count,
-                         user_count=user_count)
+                         search=search,
+                         next_cursor=next_cursor,
+                         paged=bool(cursor),
+                         all_count=counts['all'],
+                         admin_count=counts['admin'],
+                         staff_count=counts['staff'],
+                         user_count=counts['user'])
 
 @app.route('/admin/add-user', methods=['GET', 'POST'])
 @admin_required
@@ -1421,18 +1456,13 @@ def admin_edit_product(product_id):
     if request.method == 'POST':
         # Handle image upload
         image_url = product.image  # Keep existing image by default
+        uploaded = False
         if 'image_file' in request.files:
             file = request.files['image_file']
             if file and file.filename and allowed_file(file.filename):
-                # Generate unique filename
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                unique_filename = f"{name}_{uuid4().hex[:8]}{ext}"
-                
-                # Save file
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                file.save(filepath)
-                image_url = f"/Images/{unique_filename}"
+                # Saved under the hash of its content; resized variants are made by the worker
+                image_url = save_upload(file, app.config['UPLOAD_FOLDER'])
+                uploaded = True
         
         # If no file uploaded, check if URL was changed
         if image_url == product.image:
@@ -1456,14 +1486,19 @@ def admin_edit_product(product_id):
         product.image = image_url
         product.images = json.dumps([image_url])
         product.description = request.form.get('description', '')
-        product.stock = stock
+        # Tồn kho nằm ở bảng inventory; phần thay đổi áp vào kho chung của sản phẩm
+        adjust_shared_stock(product.id, stock - (product.stock or 0))
         product.sizes = json.dumps([s.strip() for s in request.form.get('sizes', '').split(',') if s.strip()])
         product.colors = json.dumps([c.strip() for c in request.form.get('colors', '').split(',') if c.strip()])
         if not product.color_images:
             product.color_images = json.dumps({})
         product.featured = bool(request.form.get('featured'))
         
+        index_product(product)
+        if uploaded:
+            enqueue('image_variants', {'model': 'product', 'id': product.id, 'urls': [image_url]})
         db.session.commit()
+        invalidate_home_rails()
         flash('Đã cập nhật sản phẩm', 'success')
         return redirect('/admin/products')
     
@@ -1477,7 +1512,10 @@ def admin_delete_product():
     
     if product:
         db.session.delete(product)
+        remove_product(product_id)
+        delete_inventory(product_id)
         db.session.commit()
+        invalidate_home_rails()
         flash('Đã xóa sản phẩm', 'success')
     
     return redirect('/admin/products')
@@ -1489,6 +1527,9 @@ def admin_delete_order():
     order = Order.query.get(order_id)
     
     if order:
+        record_order_change(order_rollup_key(order), None)
+        release_stock(order.id)
+        release_order_voucher(order)
         db.session.delete(order)
         db.session.commit()
         flash(f'Đã xóa đơn hàng #{order_id[:8]}', 'success')
@@ -1506,6 +1547,8 @@ def admin_edit_order(order_id):
         return redirect('/admin/orders')
     
     if request.method == 'POST':
+        before = order_rollup_key(order)
+        previous_status = order.status
         # Update shipping info
         shipping_info = json.loads(order.shipping_info) if order.shipping_info else {}
         shipping_info['name'] = request.form.get('customer_name')
@@ -1515,7 +1558,6 @@ def admin_edit_order(order_id):
         order.shipping_info = json.dumps(shipping_info)
         order.payment_method = request.form.get('payment_method')
         order.payment_status = request.form.get('payment_status')
-        order.status = request.form.get('status')
         order.notes = request.form.get('notes', '')
         
         # Update products if provided
@@ -1523,7 +1565,11 @@ def admin_edit_order(order_id):
         if products_json:
             try:
                 cart_items = json.loads(products_json)
-                order.items = products_json
+                # Trạng thái cũ quyết định đơn có đang giữ hàng hay không
+                if replace_order_items(order, cart_items):
+                    db.session.rollback()
+                    flash('Không đủ hàng hoặc số lượng không hợp lệ cho một số sản phẩm', 'error')
+                    return redirect(f'/admin/edit-order/{order_id}')
                 
                 # Recalculate totals
                 subtotal = sum(item['price'] * item['qty'] for item in cart_items)
@@ -1534,17 +1580,236 @@ def admin_edit_order(order_id):
                 order.shipping = shipping
                 order.total = total
             except:
+                db.session.rollback()
                 flash('Dữ liệu sản phẩm không hợp lệ', 'error')
                 return redirect(f'/admin/edit-order/{order_id}')
         
+        order.status = request.form.get('status')
+        sync_order_status(order)
+        settle_order_stock(order)
+        settle_order_voucher(order, previous_status)
+        record_order_change(before, order_rollup_key(order))
         db.session.commit()
+        invalidate_home_rails()
         flash(f'Đã cập nhật đơn hàng #{order_id[:8]}', 'success')
         return redirect('/admin/orders')
     
     # GET request
     order_dict = order.to_dict()
-    products = [p.to_dict() for p in Product.query.all()]
-    return render_template('admin/edit_order.html', order=order_dict, products=products)
+    return render_template('admin/edit_order.html', order=order_dict)
+
+def _typeahead_limit():
+    try:
+        return min(max(int(request.args.get('limit', TYPEAHEAD_LIMIT)), 1), 50)
+    except ValueError:
+        return TYPEAHEAD_LIMIT
+
+@app.route('/admin/api/products/search')
+@staff_required
+def admin_search_products():
+    return jsonify({'products': typeahead_products(request.args.get('q', '').strip(), _typeahead_limit())})
+
+@app.route('/admin/api/customers/search')
+@staff_required
+def admin_search_customers():
+    return jsonify({'customers': typeahead_customers(request.args.get('q', ''), _typeahead_limit())})
+
+# ---------- Background Jobs ----------
+@job_handler('image_variants')
+def image_variants_job(payload):
+    if add_image_variants(payload['model'], payload['id'], payload['urls'], app.config['UPLOAD_FOLDER']):
+        db.session.commit()
+        invalidate_home_rails()
+
+@job_handler('expire_stock_hold')
+def expire_stock_hold_job(payload):
+    cancel_expired_order(payload['order_id'])
+    db.session.commit()
+
+# ---------- CLI Commands ----------
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Re-index every product for full-text search"""
+    count = rebuild_search_index()
+    db.session.commit()
+    print(f"Đã đánh chỉ mục {count} sản phẩm")
+
+@app.cli.command('import-products')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(PRODUCT_FORMATS), help='Default: from the file extension')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per transaction')
+def import_products_command(path, fmt, batch_size):
+    """Create or update products from a CSV or JSONL file"""
+    fmt = fmt or detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        try:
+            summary = import_products(read_rows(stream, fmt), batch_size=batch_size,
+                                      progress=lambda s: print(f"... {s['created'] + s['updated']} dòng đã ghi, "
+                                                               f"{s['invalid']} dòng lỗi", flush=True))
+        except (UnicodeDecodeError, csv.Error) as exc:
+            db.session.rollback()
+            invalidate_home_rails()
+            raise click.ClickException(f"Không đọc được file: {exc}")
+    invalidate_home_rails()
+    for error in summary['errors']:
+        print(f"Dòng {error['line']}: {error['error']}")
+    for warning in summary['warnings']:
+        print(f"Dòng {warning['line']}: {warning['warning']}")
+    print(f"Đã thêm {summary['created']}, cập nhật {summary['updated']} sản phẩm; bỏ qua {summary['invalid']} dòng lỗi")
+
+@app.cli.command('export-products')
+@click.argument('path', default='-')
+@click.option('--format', 'fmt', type=click.Choice(PRODUCT_FORMATS), help='Default: from the file extension')
+def export_products_command(path, fmt):
+    """Write every product to a CSV or JSONL file ('-' for stdout)"""
+    fmt = fmt or detect_format(path)
+    stream = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+    try:
+        for chunk in export_products(fmt):
+            stream.write(chunk)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    """Recompute rating histograms and averages from the reviews table"""
+    count = rebuild_rating_summaries()
+    db.session.commit()
+    print(f"Đã cập nhật điểm đánh giá cho {count} sản phẩm")
+
+@app.cli.command('backfill-order-items')
+def backfill_order_items_command():
+    """Rebuild the order_items table from the JSON stored in orders.items"""
+    count = backfill_order_items()
+    db.session.commit()
+    print(f"Đã tạo {count} dòng order_items")
+
+@app.cli.command('normalize-order-dates')
+def normalize_order_dates_command():
+    """Convert created_at strings left from the old string column to datetimes"""
+    count, unparsed = normalize_order_dates()
+    db.session.commit()
+    print(f"Đã chuyển ngày tạo của {count} đơn hàng")
+    for order_id in unparsed:
+        print(f"Không đọc được ngày tạo của đơn {order_id}, đã lưu giá trị cũ vào created_at_raw")
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """Generate resized WebP variants for existing product and review images"""
+    count = build_image_variants(app.config['UPLOAD_FOLDER'])
+    db.session.commit()
+    invalidate_home_rails()
+    print(f"Đã tạo ảnh thu nhỏ cho {count} sản phẩm/đánh giá")
+
+@app.cli.command('run-worker')
+@click.option('--threads', default=2, show_default=True, help='Number of worker threads')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty')
+def run_worker_command(threads, once):
+    """Process background jobs (image variants...)"""
+    count = run_worker_pool(app, threads=threads, once=once)
+    print(f"Đã xử lý {count} job")
+
+@app.cli.command('jobs-status')
+@click.option('--failed', is_flag=True, help='List failed jobs with their last error')
+def jobs_status_command(failed):
+    """Show the number of background jobs per status"""
+    for status, count in sorted(job_counts().items()):
+        print(f"{status}: {count}")
+    if failed:
+        for job in Job.query.filter_by(status='failed').order_by(Job.id).all():
+            print(f"#{job.id} {job.kind} {job.payload} ({job.attempts} lần)\n{job.last_error}")
+
+@app.cli.command('hash-images')
+def hash_images_command():
+    """Rename existing images to content-hashed names, update the database and archive the originals"""
+    folder = app.config['UPLOAD_FOLDER']
+    mapping = hash_existing_images(folder)
+    count = rewrite_image_urls(mapping)
+    db.session.commit()
+    invalidate_home_rails()
+    # Chỉ chuyển ảnh gốc đi sau khi database đã trỏ sang tên mới
+    archived = archive_images(mapping, folder)
+    print(f"{len(mapping)} ảnh -> {len(set(mapping.values()))} file theo hash, cập nhật {count} dòng, "
+          f"chuyển {archived} ảnh gốc vào {os.path.join(folder, ARCHIVE_FOLDER)}")
+
+@app.cli.command('write-image-manifest')
+@click.argument('path', default=os.path.join(app.instance_path, 'images_manifest.json'))
+def write_image_manifest_command(path):
+    """Write the image manifest used by a front proxy (X-Accel-Redirect / X-Sendfile)"""
+    count = write_image_manifest(app.config['UPLOAD_FOLDER'], path)
+    print(f"Đã ghi {count} ảnh vào {path}")
+
+@app.cli.command('run-mail-sender')
+@click.option('--once', is_flag=True, help='Exit when the outbox is empty')
+def run_mail_sender_command(once):
+    """Deliver queued mail from the outbox over pooled SMTP connections"""
+    count = run_mail_sender(app, mail, once=once)
+    print(f"Đã gửi {count} email")
+
+@app.cli.command('mail-status')
+def mail_status_command():
+    """Show the number of outbox messages per status"""
+    for status, count in sorted(outbox_counts().items()):
+        print(f"{status}: {count}")
+
+@app.cli.command('rebuild-revenue')
+def rebuild_revenue_command():
+    """Recompute the revenue_rollups table from the orders table"""
+    count = rebuild_revenue_rollups()
+    db.session.commit()
+    print(f"Đã tính lại {count} dòng thống kê doanh thu")
+
+@app.cli.command('set-stock')
+@click.argument('product_id')
+@click.argument('on_hand', type=int)
+@click.option('--size', default='', help='Size của biến thể (bỏ trống = kho chung)')
+@click.option('--color', default='', help='Màu của biến thể (bỏ trống = kho chung)')
+def set_stock_command(product_id, on_hand, size, color):
+    """Set the stock on hand of a product variant"""
+    if db.session.get(Product, product_id) is None:
+        raise click.ClickException(f"Không tìm thấy sản phẩm {product_id}")
+    set_stock(product_id, on_hand, size, color)
+    db.session.commit()
+    print(f"Tồn kho {product_id} ({size or '*'} / {color or '*'}): {on_hand}")
+
+@app.cli.command('copy-database')
+@click.argument('target_url')
+def copy_database_command(target_url):
+    """Copy all data into an empty database, e.g. postgresql://user@host/shop"""
+    for table, count in copy_database(target_url).items():
+        print(f"{table}: {count}")
+    print("Đặt DATABASE_URL thành database mới rồi khởi động lại ứng dụng")
+
+@app.cli.command('set-voucher')
+@click.argument('code')
+@click.option('--type', 'voucher_type', type=click.Choice(VOUCHER_TYPES))
+@click.option('--discount', type=int, help='Số tiền, hoặc % với type=percent')
+@click.option('--min-order', type=int)
+@click.option('--usage-limit', type=int, help='Tổng số lượt dùng (0 = không giới hạn)')
+@click.option('--per-user-limit', type=int, help='Số lượt mỗi user (0 = không giới hạn)')
+@click.option('--active/--inactive', default=None)
+def set_voucher_command(code, voucher_type, discount, min_order, usage_limit, per_user_limit, active):
+    """Create or update a voucher"""
+    fields = {'type': voucher_type, 'discount': discount, 'min_order': min_order, 'active': active}
+    fields = {field: value for field, value in fields.items() if value is not None}
+    if usage_limit is not None:
+        fields['usage_limit'] = usage_limit or None
+    if per_user_limit is not None:
+        fields['per_user_limit'] = per_user_limit or None
+    voucher = save_voucher(code.upper().strip(), **fields)
+    db.session.commit()
+    invalidate_vouchers()
+    print(voucher.to_dict())
+
+@app.cli.command('release-expired-stock')
+def release_expired_stock_command():
+    """Cancel unpaid online orders whose stock hold has expired"""
+    order_ids = expired_order_ids()
+    for order_id in order_ids:
+        cancel_expired_order(order_id)
+    db.session.commit()
+    print(f"Đã xử lý {len(order_ids)} đơn hết hạn giữ hàng")
 
 if __name__ == '__main__':
     print("=" * 50)
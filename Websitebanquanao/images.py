@@ -0,0 +1,279 @@
+"""
+Resized WebP variants of uploaded product and review images.
+Each upload is kept as-is; a background job (jobs.py) then saves it at the
+widths in VARIANT_WIDTHS (never upscaled) as <name>_w<width>.webp next to
+the original. The URLs are recorded in the image_variants JSON column of
+the product / review, keyed by the original URL, and templates turn them
+into srcset.
+
+Uploads are stored under the hash of their bytes (<sha256[:16]>.<ext>), so
+the same picture uploaded twice is stored once and a URL never changes
+content; uploaded_file() serves such names with a one-year immutable
+Cache-Control. Files stored before that are renamed by the hash-images
+command, which archives the originals under ARCHIVE_FOLDER.
+
+Pillow is optional: without it uploads are stored unchanged and the pages
+fall back to the original image.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+from markupsafe import Markup, escape
+from database import db, Product, Review, Order, OrderItem
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow chưa được cài
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = {
+    'thumb': 160,
+    'card': 400,
+    'detail': 800,
+    'zoom': 1600,
+}
+WEBP_QUALITY = 80
+# Ảnh lớn hơn chừng này điểm ảnh bị bỏ qua: file PNG vài KB có thể giải nén ra hàng GB
+MAX_IMAGE_PIXELS = 40_000_000
+URL_PREFIX = '/Images/'
+HASH_LENGTH = 16
+# <hash>.<ext> hoặc biến thể <hash>_w<width>.webp
+HASHED_NAME = re.compile(r'^[0-9a-f]{%d}(_w\d+)?\.[a-z0-9]+$' % HASH_LENGTH)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Logo và ảnh banner được viết thẳng trong template, giữ nguyên tên
+SITE_IMAGES = {'F_icon.png', 'FashionModel.jpg'}
+# Ảnh gốc đã đổi sang tên theo hash được chuyển vào đây (route /Images/<filename> không phục vụ thư mục con)
+ARCHIVE_FOLDER = 'originals'
+ROWS_PER_BATCH = 500
+
+
+def variants_available():
+    return Image is not None
+
+
+def generate_variants(path):
+    """Write the WebP variants of the image at path; return {width: url} ({} on failure)"""
+    if Image is None:
+        return {}
+    stem = os.path.splitext(os.path.basename(path))[0]
+    folder = os.path.dirname(path)
+    variants = {}
+    try:
+        with Image.open(path) as original:
+            # open() chỉ đọc header; kiểm tra kích thước trước khi giải nén
+            if original.width * original.height > MAX_IMAGE_PIXELS:
+                raise ValueError(f"ảnh {original.width}x{original.height} quá lớn")
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+            widths = [w for w in sorted(VARIANT_WIDTHS.values()) if w < image.width] or [image.width]
+            for width in widths:
+                height = max(1, round(image.height * width / image.width))
+                filename = f"{stem}_w{width}.webp"
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                resized.save(os.path.join(folder, filename), 'WEBP', quality=WEBP_QUALITY, method=4)
+                variants[str(width)] = URL_PREFIX + filename
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Không tạo được ảnh thu nhỏ cho %s: %s", path, e)
+        return {}
+    return variants
+
+
+def is_immutable(filename):
+    """True for content-hashed names, whose bytes never change"""
+    return bool(HASHED_NAME.match(filename))
+
+
+def content_name(data, ext):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH] + ext.lower()
+
+
+def save_upload(file, folder):
+    """Store an uploaded file under the hash of its content and return its URL.
+    An identical file that is already stored is reused.
+    Variants are made later by the image_variants job (see add_image_variants).
+    """
+    data = file.read()
+    filename = content_name(data, os.path.splitext(file.filename)[1])
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        # Ghi file tạm rồi đổi tên để không ai đọc được file ghi dở
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return URL_PREFIX + filename
+
+
+def srcset(variants):
+    """'url 160w, url 400w, ...' for a {width: url} map"""
+    return ', '.join(f"{url} {width}w" for width, url in
+                     sorted(variants.items(), key=lambda item: int(item[0])))
+
+
+def srcset_attrs(image_variants, url, sizes):
+    """srcset/sizes attributes for an <img>, or nothing if url has no variants"""
+    variants = (image_variants or {}).get(url)
+    if not variants:
+        return Markup('')
+    return Markup(' srcset="%s" sizes="%s"') % (srcset(variants), escape(sizes))
+
+
+def _local_path(url, folder):
+    if not isinstance(url, str) or not url.startswith(URL_PREFIX):
+        return None
+    path = os.path.join(folder, os.path.basename(url))
+    return path if os.path.isfile(path) else None
+
+
+def _missing_variants(urls, existing, folder):
+    variants = dict(existing)
+    changed = False
+    for url in urls:
+        path = _local_path(url, folder)
+        if url in variants or not path:
+            continue
+        generated = generate_variants(path)
+        if generated:
+            variants[url] = generated
+            changed = True
+    return variants, changed
+
+
+IMAGE_MODELS = {'product': Product, 'review': Review}
+
+
+def add_image_variants(model, row_id, urls, folder):
+    """Generate variants for urls of one product/review row and record them.
+    Returns False if the row no longer exists. The caller commits.
+    """
+    row = db.session.get(IMAGE_MODELS[model], row_id)
+    if row is None:
+        return False
+    existing = json.loads(row.image_variants) if row.image_variants else {}
+    variants, changed = _missing_variants(urls, existing, folder)
+    if changed:
+        row.image_variants = json.dumps(variants)
+    return True
+
+
+def build_image_variants(folder):
+    """Generate missing variants for every product and review image stored under folder.
+    The caller commits. Returns the number of rows updated.
+    """
+    if Image is None:
+        return 0
+    count = 0
+    for product in Product.query.yield_per(ROWS_PER_BATCH):
+        urls = [product.image]
+        urls += json.loads(product.images) if product.images else []
+        urls += list(json.loads(product.color_images).values()) if product.color_images else []
+        existing = json.loads(product.image_variants) if product.image_variants else {}
+        variants, changed = _missing_variants(urls, existing, folder)
+        if changed:
+            product.image_variants = json.dumps(variants)
+            count += 1
+    for review in Review.query.filter(Review.images.isnot(None)).yield_per(ROWS_PER_BATCH):
+        existing = json.loads(review.image_variants) if review.image_variants else {}
+        variants, changed = _missing_variants(json.loads(review.images or '[]'), existing, folder)
+        if changed:
+            review.image_variants = json.dumps(variants)
+            count += 1
+    db.session.flush()
+    return count
+
+
+def hash_existing_images(folder):
+    """Copy every non-hashed file in folder (except SITE_IMAGES) to its content-hashed name.
+    Returns {old_url: new_url}; identical files map to the same new URL.
+    The old files stay until archive_images() runs, after the new URLs are committed.
+    """
+    mapping = {}
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if not os.path.isfile(path) or is_immutable(filename) or filename in SITE_IMAGES:
+            continue
+        with open(path, 'rb') as f:
+            new_name = content_name(f.read(), os.path.splitext(filename)[1])
+        new_path = os.path.join(folder, new_name)
+        if not os.path.exists(new_path):
+            shutil.copy2(path, new_path)
+        mapping[URL_PREFIX + filename] = URL_PREFIX + new_name
+    return mapping
+
+
+def archive_images(mapping, folder):
+    """Move the originals named in mapping into folder/ARCHIVE_FOLDER.
+    Returns the number of files moved.
+    """
+    archive = os.path.join(folder, ARCHIVE_FOLDER)
+    os.makedirs(archive, exist_ok=True)
+    count = 0
+    for old in mapping:
+        path = _local_path(old, folder)
+        if path:
+            os.replace(path, os.path.join(archive, os.path.basename(path)))
+            count += 1
+    return count
+
+
+def _replace_urls(text, mapping):
+    """Replace quoted URLs inside a JSON string"""
+    if not text:
+        return text
+    for old, new in mapping.items():
+        text = text.replace(json.dumps(old), json.dumps(new))
+    return text
+
+
+def rewrite_image_urls(mapping):
+    """Point products, reviews and orders at the new URLs. The caller commits.
+    Returns the number of rows changed.
+    """
+    count = 0
+    json_columns = (
+        (Product, ('images', 'color_images', 'image_variants')),
+        (Review, ('images', 'image_variants')),
+        (Order, ('items',)),
+    )
+    for model, columns in json_columns:
+        # Đọc từng lô thay vì nạp cả bảng orders vào bộ nhớ
+        for row in model.query.yield_per(ROWS_PER_BATCH):
+            changed = False
+            for column in columns:
+                value = getattr(row, column)
+                new_value = _replace_urls(value, mapping)
+                if new_value != value:
+                    setattr(row, column, new_value)
+                    changed = True
+            if model is Product and row.image in mapping:
+                row.image = mapping[row.image]
+                changed = True
+            count += changed
+    for old, new in mapping.items():
+        count += OrderItem.query.filter_by(image=old).update({'image': new}, synchronize_session=False)
+    db.session.flush()
+    return count
+
+
+def write_image_manifest(folder, path):
+    """Write a JSON manifest of every stored image for a front proxy / CDN sync:
+    {url: {"file": absolute path, "bytes": size, "immutable": bool}}
+    """
+    manifest = {}
+    for filename in sorted(os.listdir(folder)):
+        file_path = os.path.abspath(os.path.join(folder, filename))
+        if os.path.isfile(file_path):
+            manifest[URL_PREFIX + filename] = {
+                'file': file_path,
+                'bytes': os.path.getsize(file_path),
+                'immutable': is_immutable(filename),
+            }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return len(manifest)
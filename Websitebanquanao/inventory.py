@@ -0,0 +1,257 @@
+"""
+Per-variant inventory and the stock reservation ledger.
+Stock lives in the inventory table, one row per (product, size, color); a
+product without per-variant rows sells from its shared row (size = color
+= ''). Checkout holds stock with one conditional UPDATE per variant row
+(on_hand - reserved >= qty) and writes a 'held' row in stock_reservations;
+the hold is committed when the order completes (stock leaves the shelf and
+products.sold goes up) or released when the order is cancelled or an
+unpaid online payment times out. Only the variant rows being bought are
+written at checkout, so a hot SKU doesn't block the rest of the catalog.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db, Product, Inventory, StockReservation
+
+# Đơn thanh toán online chưa trả tiền sau thời gian này sẽ được trả hàng về kho
+HOLD_TTL = timedelta(minutes=30)
+ONLINE_PAYMENTS = ('banking', 'momo', 'qr')
+SHARED = ('', '')
+
+
+def _variant(line):
+    return (line.get('size') or '', line.get('color') or '')
+
+
+def load_rows(product_ids):
+    """Inventory rows of the products, keyed by (product_id, size, color)"""
+    if not product_ids:
+        return {}
+    return {(row.product_id, row.size, row.color): row
+            for row in Inventory.query.filter(Inventory.product_id.in_(product_ids))}
+
+
+def resolve_lines(lines, rows=None):
+    """Return (needed, rows, missing): quantity per inventory row id, the
+    inventory rows by id, and product ids with no inventory row at all.
+    """
+    if rows is None:
+        rows = load_rows({line['id'] for line in lines})
+    needed = {}
+    by_id = {}
+    missing = []
+    for line in lines:
+        row = rows.get((line['id'],) + _variant(line)) or rows.get((line['id'],) + SHARED)
+        if row is None:
+            missing.append(line['id'])
+            continue
+        needed[row.id] = needed.get(row.id, 0) + line['qty']
+        by_id[row.id] = row
+    return needed, by_id, missing
+
+
+def hold_stock(order_id, lines, expires_at=None):
+    """Reserve stock for the order's lines inside the caller's transaction.
+    Returns the ids of products that don't have enough stock (or a quantity
+    below 1); if it is not empty the caller must roll back.
+    """
+    # Số lượng âm sẽ làm giảm reserved và giải phóng hàng đơn khác đang giữ
+    invalid = [line['id'] for line in lines
+               if isinstance(line['qty'], bool) or not isinstance(line['qty'], int) or line['qty'] < 1]
+    if invalid:
+        return invalid
+    needed, rows, failed = resolve_lines(lines)
+    # Thứ tự cố định để các giao dịch song song khóa dòng theo cùng thứ tự
+    for inventory_id, qty in sorted(needed.items()):
+        result = db.session.execute(
+            update(Inventory)
+            .where(Inventory.id == inventory_id, Inventory.on_hand - Inventory.reserved >= qty)
+            .values(reserved=Inventory.reserved + qty)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            failed.append(rows[inventory_id].product_id)
+            continue
+        db.session.add(StockReservation(order_id=order_id, inventory_id=inventory_id,
+                                        product_id=rows[inventory_id].product_id, qty=qty,
+                                        status='held', expires_at=expires_at))
+    return failed
+
+
+def hold_expiry(payment_method, now=None):
+    """When an order's hold times out: only unpaid online payments expire"""
+    if payment_method in ONLINE_PAYMENTS:
+        return (now or datetime.now()) + HOLD_TTL
+    return None
+
+
+def _settle(reservation, status, now):
+    """Move one held reservation to status; False if someone else already did"""
+    result = db.session.execute(
+        update(StockReservation)
+        .where(StockReservation.id == reservation.id, StockReservation.status == 'held')
+        .values(status=status, settled_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _held(order_id):
+    return (StockReservation.query
+            .filter_by(order_id=order_id, status='held')
+            .order_by(StockReservation.inventory_id)
+            .all())
+
+
+def commit_stock(order_id, now=None):
+    """Take the order's held stock off the shelf and count it as sold"""
+    now = now or datetime.now()
+    count = 0
+    for reservation in _held(order_id):
+        if not _settle(reservation, 'committed', now):
+            continue
+        db.session.execute(
+            update(Inventory)
+            .where(Inventory.id == reservation.inventory_id)
+            .values(on_hand=Inventory.on_hand - reservation.qty,
+                    reserved=Inventory.reserved - reservation.qty)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(Product)
+            .where(Product.id == reservation.product_id)
+            .values(stock=Product.stock - reservation.qty, sold=Product.sold + reservation.qty)
+            .execution_options(synchronize_session=False)
+        )
+        count += reservation.qty
+    return count
+
+
+def release_stock(order_id, now=None):
+    """Return the order's held stock to the available pool"""
+    now = now or datetime.now()
+    count = 0
+    for reservation in _held(order_id):
+        if not _settle(reservation, 'released', now):
+            continue
+        db.session.execute(
+            update(Inventory)
+            .where(Inventory.id == reservation.inventory_id)
+            .values(reserved=Inventory.reserved - reservation.qty)
+            .execution_options(synchronize_session=False)
+        )
+        count += reservation.qty
+    return count
+
+
+def settle_order_stock(order):
+    """Commit or release the order's holds after a status change"""
+    if order.status == 'completed':
+        return commit_stock(order.id)
+    if order.status == 'cancelled':
+        return release_stock(order.id)
+    if order.status != 'pending' or order.payment_status == 'paid':
+        # Đơn đã được xác nhận / thanh toán: giữ hàng đến khi hoàn thành, không hết hạn nữa
+        (StockReservation.query
+         .filter_by(order_id=order.id, status='held')
+         .update({'expires_at': None}, synchronize_session=False))
+    return 0
+
+
+def expired_order_ids(now=None):
+    """Orders that still have held stock past its expiry"""
+    now = now or datetime.now()
+    rows = (db.session.query(StockReservation.order_id).distinct()
+            .filter(StockReservation.status == 'held', StockReservation.expires_at <= now))
+    return [row.order_id for row in rows]
+
+
+def sync_product_stock(product_id):
+    """products.stock = total on hand over the product's variants"""
+    total = (db.session.query(func.coalesce(func.sum(Inventory.on_hand), 0))
+             .filter(Inventory.product_id == product_id)
+             .scalar_subquery())
+    db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(stock=total)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def set_stock(product_id, on_hand, size='', color=''):
+    """Set the stock on hand of one variant (creating its row)"""
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    statement = insert(Inventory.__table__).values(product_id=product_id, size=size or '',
+                                                    color=color or '', on_hand=on_hand, reserved=0)
+    statement = statement.on_conflict_do_update(
+        index_elements=['product_id', 'size', 'color'],
+        set_={'on_hand': statement.excluded.on_hand}
+    )
+    db.session.execute(statement)
+    sync_product_stock(product_id)
+
+
+def adjust_shared_stock(product_id, delta):
+    """Apply a change of the product's total stock (admin form) to its shared row"""
+    if delta:
+        shared = Inventory.query.filter_by(product_id=product_id, size='', color='').first()
+        set_stock(product_id, max(0, (shared.on_hand if shared else 0) + delta))
+
+
+def set_total_stock_many(totals, current):
+    """Bulk adjust_shared_stock for imports.
+
+    totals maps product id -> new total stock, current maps product id ->
+    products.stock before the import (missing = new product). Each shared
+    row moves by the difference, then products.stock is recomputed from
+    the inventory rows of the whole batch. A product with per-variant rows
+    may not reach its total through the shared row alone; returns
+    {product id: resulting stock} for those products.
+    """
+    if not totals:
+        return {}
+    ids = list(totals)
+    shared = dict(db.session.query(Inventory.product_id, Inventory.on_hand)
+                  .filter(Inventory.product_id.in_(ids), Inventory.size == '', Inventory.color == ''))
+    params = []
+    for product_id, total in totals.items():
+        delta = total - (current.get(product_id) or 0)
+        params.append({'product_id': product_id, 'size': '', 'color': '', 'reserved': 0,
+                       'on_hand': max(0, shared.get(product_id, 0) + delta)})
+
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    statement = insert(Inventory.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['product_id', 'size', 'color'],
+        set_={'on_hand': statement.excluded.on_hand}
+    )
+    db.session.execute(statement, params)
+
+    total = (db.session.query(func.coalesce(func.sum(Inventory.on_hand), 0))
+             .filter(Inventory.product_id == Product.id)
+             .scalar_subquery())
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(ids))
+        .values(stock=total)
+        .execution_options(synchronize_session=False)
+    )
+    stocks = db.session.query(Product.id, Product.stock).filter(Product.id.in_(ids))
+    return {product_id: stock for product_id, stock in stocks if stock != totals[product_id]}
+
+
+def delete_inventory(product_id):
+    Inventory.query.filter_by(product_id=product_id).delete(synchronize_session=False)
+
+
+def backfill_inventory():
+    """Give every product without inventory rows a shared row with its current stock"""
+    stocked = db.session.query(Inventory.product_id).distinct()
+    rows = (db.session.query(Product.id, Product.stock)
+            .filter(Product.id.not_in(stocked)))
+    for product_id, stock in rows.all():
+        db.session.add(Inventory(product_id=product_id, size='', color='', on_hand=max(0, stock or 0)))
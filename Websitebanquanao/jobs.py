@@ -0,0 +1,158 @@
+"""
+Background jobs stored in the jobs table.
+Routes enqueue() work that does not need to finish before the response
+(image variants...) in the same transaction as the row it belongs to; a
+worker process (`flask run-worker`) claims queued jobs, runs the handler
+registered for their kind and retries failures with exponential backoff.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import func, update
+from database import db, Job
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+RETRY_BASE_SECONDS = 10
+# Job 'running' lâu hơn mức này coi như worker đã chết -> trả lại hàng đợi
+STALE_AFTER = timedelta(minutes=10)
+
+
+def job_handler(kind):
+    """Register func(payload) as the handler for jobs of this kind"""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, max_attempts=3, delay=0):
+    """Add a job to the caller's transaction; it becomes visible on commit"""
+    job = Job(kind=kind,
+              payload=json.dumps(payload or {}),
+              max_attempts=max_attempts,
+              run_at=datetime.now() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+
+def requeue_stale_jobs(now=None):
+    now = now or datetime.now()
+    result = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < now - STALE_AFTER)
+        .values(status='queued', locked_by=None, locked_at=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_next_job(worker_id):
+    """Mark the oldest due job as running for this worker and return it (or None).
+    The conditional UPDATE makes the claim safe when several workers poll at once.
+    """
+    while True:
+        now = datetime.now()
+        candidate = (db.session.query(Job.id)
+                     .filter(Job.status == 'queued', Job.run_at <= now)
+                     .order_by(Job.run_at, Job.id)
+                     .limit(1)
+                     .scalar())
+        if candidate is None:
+            db.session.commit()
+            return None
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == candidate, Job.status == 'queued')
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, candidate)
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome"""
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        handler(json.loads(job.payload) if job.payload else {})
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = traceback.format_exc(limit=5)
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.now()
+            logger.error("Job %s (%s) failed after %d attempts", job.id, job.kind, job.attempts)
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.now() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            logger.warning("Job %s (%s) failed, retry %d/%d", job.id, job.kind, job.attempts, job.max_attempts)
+        db.session.commit()
+        return False
+    job.status = 'done'
+    job.finished_at = datetime.now()
+    job.locked_by = None
+    job.locked_at = None
+    job.last_error = None
+    db.session.commit()
+    return True
+
+
+def work(worker_id, stop=None, once=False, poll_interval=1.0):
+    """Process jobs until stop is set (or the queue is empty when once=True).
+    Must run inside an app context. Returns the number of jobs processed.
+    """
+    processed = 0
+    while not (stop and stop.is_set()):
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+    return processed
+
+
+def run_worker_pool(app, threads=2, once=False, poll_interval=1.0):
+    """Run `threads` workers, each with its own app context / DB session"""
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    stop = threading.Event()
+    counts = []
+
+    with app.app_context():
+        requeue_stale_jobs()
+
+    def target(index):
+        with app.app_context():
+            counts.append(work(f"{prefix}:{index}", stop, once, poll_interval))
+
+    workers = [threading.Thread(target=target, args=(i,), daemon=True) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    return sum(counts)
+
+
+def job_counts():
+    """{status: number of jobs}"""
+    return dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
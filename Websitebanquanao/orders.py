@@ -0,0 +1,364 @@
+"""
+Order line items stored in the indexed order_items table.
+Order.items keeps the JSON copy used by the templates; order_items answers
+"has this user bought this product, and how many times" with one indexed
+COUNT instead of decoding every order of the user.
+
+The admin order list (query_admin_orders) and the customer order history
+(query_user_orders) filter in SQL and page with keyset cursors on
+(created_at, id), like the catalog.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, distinct, func, select, text, tuple_
+from database import db, Order, OrderItem, RevenueRollup, StockReservation
+from catalog import encode_cursor, decode_cursor
+from inventory import hold_stock, release_stock, settle_order_stock
+from revenue import order_rollup_key, record_order_change
+from vouchers import settle_order_voucher
+
+logger = logging.getLogger(__name__)
+
+ORDER_PAGE_SIZE = 50
+ORDER_HISTORY_PAGE_SIZE = 20
+# Đếm chính xác tối đa chừng này đơn, nhiều hơn thì báo "hơn N đơn"
+ORDER_COUNT_LIMIT = 10000
+ORDER_STATUSES = ('pending', 'confirmed', 'shipping', 'completed', 'cancelled')
+PAYMENT_STATUSES = ('pending', 'paid', 'cod')
+ORDER_FILTERS = ('status', 'payment_status', 'date_from', 'date_to', 'customer')
+
+# Formats of Order.created_at while it was a string column:
+# seed data used ISO, checkout() wrote dd/mm/YYYY
+LEGACY_DATE_FORMATS = (
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+)
+
+
+def _line_item_values(item, user_email, status):
+    """Column values for one cart/order JSON item.
+    Old orders use product_id/quantity, the session cart uses id/qty.
+    """
+    product_id = item.get('product_id') or item.get('id')
+    return {
+        'user_email': user_email,
+        'product_id': str(product_id) if product_id else None,
+        'name': item.get('name'),
+        'price': item.get('price') or 0,
+        'quantity': item.get('quantity') or item.get('qty') or 1,
+        'size': item.get('size'),
+        'color': item.get('color'),
+        'image': item.get('image'),
+        'status': status or 'pending',
+    }
+
+
+def set_order_items(order, items):
+    """Store the order's items as JSON and as order_items rows"""
+    order.items = json.dumps(items)
+    order.line_items = [OrderItem(**_line_item_values(item, order.user_email, order.status))
+                        for item in items]
+
+
+def hold_order_items(order, items, expires_at=None):
+    """set_order_items plus stock holds for a new order. Returns the ids of
+    products without enough stock; if it is not empty the caller must roll back.
+    """
+    set_order_items(order, items)
+    return hold_stock(order.id, items, expires_at)
+
+
+def _stock_lines(items):
+    return sorted((str(item.get('id')), item.get('size') or '', item.get('color') or '', item.get('qty'))
+                  for item in items)
+
+
+def replace_order_items(order, items):
+    """Replace the items of an order edited by staff and move its stock holds
+    with them: the old holds are released and the new items held, keeping
+    the old expiry. Completed and cancelled orders hold nothing, so only
+    their items change. Returns the ids of products without enough stock;
+    if it is not empty the caller must roll back.
+    """
+    old_items = json.loads(order.items) if order.items else []
+    changed = _stock_lines(old_items) != _stock_lines(items)
+    set_order_items(order, items)
+    if not changed or order.status in ('completed', 'cancelled'):
+        return []
+    expires_at = (db.session.query(StockReservation.expires_at)
+                  .filter_by(order_id=order.id, status='held')
+                  .limit(1).scalar())
+    release_stock(order.id)
+    return hold_stock(order.id, items, expires_at)
+
+
+def sync_order_status(order):
+    """Copy the order status onto its line items after a status change"""
+    for line_item in order.line_items:
+        line_item.status = order.status
+
+
+def cancel_expired_order(order_id):
+    """Cancel an online-payment order that was not paid in time, returning
+    its stock and its voucher use. Runs inside the caller's transaction.
+    """
+    order = db.session.get(Order, order_id)
+    if order is None:
+        release_stock(order_id)
+        return
+    if order.status != 'pending' or order.payment_status != 'pending':
+        return
+    before = order_rollup_key(order)
+    order.status = 'cancelled'
+    sync_order_status(order)
+    settle_order_stock(order)
+    settle_order_voucher(order, 'pending')
+    record_order_change(before, order_rollup_key(order))
+
+
+def count_purchases(user_email, product_id, status='completed'):
+    """Number of orders of the user containing the product"""
+    return (db.session.query(func.count(distinct(OrderItem.order_id)))
+            .filter(OrderItem.user_email == user_email,
+                    OrderItem.product_id == str(product_id),
+                    OrderItem.status == status)
+            .scalar())
+
+
+def last_purchased_item(user_email, product_id, status='completed'):
+    """Most recent line item of the product bought by the user, or None"""
+    return (OrderItem.query
+            .filter_by(user_email=user_email, product_id=str(product_id), status=status)
+            .order_by(OrderItem.id.desc())
+            .first())
+
+
+def backfill_order_items(batch_size=500):
+    """Rebuild order_items from the JSON in orders.items. The caller commits."""
+    OrderItem.query.delete()
+    count = 0
+    query = db.session.query(Order.id, Order.user_email, Order.items, Order.status).order_by(Order.id)
+    rows = []
+    for order in query.yield_per(batch_size):
+        try:
+            items = json.loads(order.items) if order.items else []
+        except ValueError:
+            items = []
+        for item in items:
+            values = _line_item_values(item, order.user_email, order.status)
+            values['order_id'] = order.id
+            rows.append(values)
+        if len(rows) >= batch_size:
+            db.session.execute(OrderItem.__table__.insert(), rows)
+            count += len(rows)
+            rows = []
+    if rows:
+        db.session.execute(OrderItem.__table__.insert(), rows)
+        count += len(rows)
+    return count
+
+
+def parse_legacy_date(value):
+    """Parse a created_at string in any of the legacy formats; None if unknown"""
+    for date_format in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_order_dates():
+    """Rewrite created_at strings from before the column became a DateTime.
+    Reads the raw values (the ORM can't parse dd/mm/YYYY) and stores real datetimes.
+    Values the ORM already reads (ISO format, which is how SQLite stores every
+    DateTime) are skipped. A value in no known format is moved to
+    created_at_raw and created_at becomes NULL, so loading the order can't fail.
+    The caller commits. Returns (number of orders rewritten, ids of the orders
+    whose date could not be read).
+    """
+    rows = db.session.execute(text("SELECT id, created_at FROM orders WHERE created_at IS NOT NULL")).fetchall()
+    params, unparsed = [], []
+    for order_id, value in rows:
+        if not isinstance(value, str):
+            continue
+        try:
+            datetime.fromisoformat(value)
+            continue
+        except ValueError:
+            pass
+        parsed = parse_legacy_date(value)
+        if parsed is None:
+            unparsed.append(order_id)
+        params.append({'order_id': order_id, 'parsed': parsed, 'raw': None if parsed else value[:50]})
+    if unparsed:
+        logger.warning("created_at của %d đơn không đúng định dạng nào, chuyển sang created_at_raw: %s",
+                       len(unparsed), ', '.join(unparsed))
+    if params:
+        orders = Order.__table__
+        db.session.execute(
+            orders.update()
+            .where(orders.c.id == bindparam('order_id'))
+            .values(created_at=bindparam('parsed'), created_at_raw=bindparam('raw')),
+            params
+        )
+    return len(params) - len(unparsed), unparsed
+
+
+def parse_order_filters(args):
+    """Validated admin list filters from request.args; unknown values are dropped"""
+    filters = {}
+    if args.get('status') in ORDER_STATUSES:
+        filters['status'] = args['status']
+    if args.get('payment_status') in PAYMENT_STATUSES:
+        filters['payment_status'] = args['payment_status']
+    for key in ('date_from', 'date_to'):
+        try:
+            filters[key] = datetime.strptime(args.get(key, ''), '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    customer = args.get('customer', '').strip()
+    if customer:
+        filters['customer'] = customer
+    return filters
+
+
+def _filter_orders(query, filters):
+    if 'status' in filters:
+        query = query.filter(Order.status == filters['status'])
+    if 'payment_status' in filters:
+        query = query.filter(Order.payment_status == filters['payment_status'])
+    if 'date_from' in filters:
+        query = query.filter(Order.created_at >= datetime.combine(filters['date_from'], datetime.min.time()))
+    if 'date_to' in filters:
+        end = datetime.combine(filters['date_to'] + timedelta(days=1), datetime.min.time())
+        query = query.filter(Order.created_at < end)
+    if 'customer' in filters:
+        # Tiền tố email: dùng được index của users.email / user_email
+        pattern = filters['customer'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Order.user_email.like(pattern + '%', escape='\\'))
+    return query
+
+
+def order_row(row):
+    """Dict for one row of the admin order table"""
+    return {
+        'id': row.id,
+        'user_email': row.user_email,
+        'total': row.total,
+        'payment_method': row.payment_method,
+        'payment_status': row.payment_status,
+        'status': row.status,
+        'created_at': row.created_at.strftime('%d/%m/%Y %H:%M') if row.created_at else None,
+    }
+
+
+def _newest_first(query, cursor, limit):
+    """Up to limit + 1 rows of query after cursor, newest first.
+    Orders without a created_at (unreadable legacy dates) come after all
+    the others, newest id first. Each part is read in index order; only the
+    page where the dated orders run out needs a second query.
+    """
+    position = decode_cursor(cursor, Order.created_at) if cursor else None
+    rows = []
+    if position is None or position[0] is not None:
+        dated = query.filter(Order.created_at.isnot(None))
+        if position:
+            dated = dated.filter(tuple_(Order.created_at, Order.id) < position)
+        rows = dated.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        undated = query.filter(Order.created_at.is_(None))
+        if position and position[0] is None:
+            undated = undated.filter(Order.id < position[1])
+        rows += undated.order_by(Order.id.desc()).limit(limit + 1 - len(rows)).all()
+    return rows
+
+
+def query_admin_orders(filters=None, cursor=None, limit=ORDER_PAGE_SIZE):
+    """One page of the admin order list, newest first.
+
+    Only the columns the table shows are loaded (not items / shipping_info).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    query = db.session.query(Order.id, Order.user_email, Order.total, Order.payment_method,
+                             Order.payment_status, Order.status, Order.created_at)
+    query = _filter_orders(query, filters or {})
+    rows = _newest_first(query, cursor, limit)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [order_row(row) for row in rows], next_cursor
+
+
+def count_admin_orders(filters=None):
+    """Total for the admin order list as (count, exact).
+
+    With no filters, or only a date range (optionally status=completed), the
+    total is summed from revenue_rollups. Otherwise the matching rows are
+    counted up to ORDER_COUNT_LIMIT; past that exact is False. Orders without
+    a created_at are in no rollup and are counted directly when no date range
+    is set.
+    """
+    filters = filters or {}
+    rest = set(filters) - {'date_from', 'date_to'}
+    if not rest or rest == {'status'} and filters['status'] == 'completed':
+        column = RevenueRollup.completed_count if rest else RevenueRollup.order_count
+        query = db.session.query(func.coalesce(func.sum(column), 0))
+        if 'date_from' in filters or 'date_to' in filters:
+            query = query.filter(RevenueRollup.period == 'day')
+            if 'date_from' in filters:
+                query = query.filter(RevenueRollup.period_key >= filters['date_from'].isoformat())
+            if 'date_to' in filters:
+                query = query.filter(RevenueRollup.period_key <= filters['date_to'].isoformat())
+            return int(query.scalar()), True
+        query = query.filter(RevenueRollup.period == 'year')
+        undated = db.session.query(func.count(Order.id)).filter(Order.created_at.is_(None))
+        if rest:
+            undated = undated.filter(Order.status == 'completed')
+        return int(query.scalar()) + undated.scalar(), True
+
+    matching = _filter_orders(db.session.query(Order.id), filters).limit(ORDER_COUNT_LIMIT + 1).subquery()
+    count = db.session.execute(select(func.count()).select_from(matching)).scalar()
+    if count > ORDER_COUNT_LIMIT:
+        return ORDER_COUNT_LIMIT, False
+    return count, True
+
+
+def query_user_orders(user_email, cursor=None, limit=ORDER_HISTORY_PAGE_SIZE):
+    """One page of a customer's orders, newest first: headers only.
+
+    Uses the (user_email, created_at, id) index; line items are counted from
+    order_items instead of decoding the JSON. Returns (rows, next_cursor).
+    """
+    item_count = (select(func.count(OrderItem.id))
+                  .where(OrderItem.order_id == Order.id)
+                  .correlate(Order)
+                  .scalar_subquery())
+    query = (db.session.query(Order.id, Order.user_email, Order.total, Order.payment_method,
+                              Order.payment_status, Order.status, Order.created_at,
+                              item_count.label('item_count'))
+             .filter(Order.user_email == user_email))
+    rows = _newest_first(query, cursor, limit)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [dict(order_row(row), item_count=row.item_count) for row in rows], next_cursor
+
+
+def order_line_items(order_id, user_email):
+    """Line items of one of the user's orders, or None if it isn't theirs"""
+    status = (db.session.query(Order.status)
+              .filter(Order.id == order_id, Order.user_email == user_email)
+              .scalar())
+    if status is None:
+        return None
+    items = OrderItem.query.filter_by(order_id=order_id).order_by(OrderItem.id).all()
+    return {'status': status, 'items': [item.to_dict() for item in items]}
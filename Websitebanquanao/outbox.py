@@ -0,0 +1,176 @@
+"""
+Outbound mail through the mail_outbox table.
+Routes call queue_mail() inside their transaction and return immediately;
+the sender (`flask run-mail-sender`) claims queued messages in batches and
+delivers each batch over one SMTP connection (Flask-Mail reconnects after
+MAIL_MAX_EMAILS messages). Failed messages are retried with exponential
+backoff. allow_mail() limits how many mails of one kind a recipient can
+trigger per time window, and MAIL_SEND_RATE caps messages per minute so
+the SMTP provider doesn't throttle the account.
+"""
+import logging
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import func, update
+from database import db, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+RETRY_BASE_SECONDS = 30
+# Mail 'sending' lâu hơn mức này coi như sender đã chết -> gửi lại
+STALE_AFTER = timedelta(minutes=10)
+
+
+def queue_mail(recipient, subject, body=None, html=None, kind=None, max_attempts=5):
+    """Add a message to the outbox in the caller's transaction"""
+    message = OutboxMessage(recipient=recipient, subject=subject, body=body, html=html,
+                            kind=kind, max_attempts=max_attempts)
+    db.session.add(message)
+    return message
+
+
+def allow_mail(recipient, kind, limit, window):
+    """True if fewer than `limit` mails of this kind were queued for recipient within window"""
+    since = datetime.now() - window
+    count = (db.session.query(func.count(OutboxMessage.id))
+             .filter(OutboxMessage.recipient == recipient,
+                     OutboxMessage.kind == kind,
+                     OutboxMessage.created_at >= since)
+             .scalar())
+    return count < limit
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """Mark up to batch_size due messages as 'sending' and return them"""
+    now = datetime.now()
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.status == 'sending', OutboxMessage.next_attempt_at < now - STALE_AFTER)
+        .values(status='queued')
+    )
+    ids = [row.id for row in
+           db.session.query(OutboxMessage.id)
+           .filter(OutboxMessage.status == 'queued', OutboxMessage.next_attempt_at <= now)
+           .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+           .limit(batch_size)]
+    if ids:
+        # next_attempt_at = lúc nhận, để phát hiện sender chết giữa chừng
+        db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(ids), OutboxMessage.status == 'queued')
+            .values(status='sending', next_attempt_at=now, attempts=OutboxMessage.attempts + 1)
+        )
+    db.session.commit()
+    if not ids:
+        return []
+    return (OutboxMessage.query
+            .filter(OutboxMessage.id.in_(ids), OutboxMessage.status == 'sending',
+                    OutboxMessage.next_attempt_at == now)
+            .order_by(OutboxMessage.id)
+            .all())
+
+
+def _mark_failed(message, error):
+    message.last_error = str(error)[:1000]
+    if message.attempts >= message.max_attempts:
+        message.status = 'failed'
+        logger.error("Mail %s to %s failed after %d attempts: %s",
+                     message.id, message.recipient, message.attempts, error)
+    else:
+        message.status = 'queued'
+        message.next_attempt_at = datetime.now() + timedelta(
+            seconds=RETRY_BASE_SECONDS * 2 ** (message.attempts - 1))
+
+
+class Throttle:
+    """At most `per_minute` calls to wait() per minute (None = no limit)"""
+
+    def __init__(self, per_minute=None, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = self.clock()
+        if now < self.next_at:
+            self.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def send_pending(mail, batch_size=BATCH_SIZE, throttle=None):
+    """Deliver queued messages, reusing one SMTP connection while batches keep coming.
+    Must run inside an app context. Returns the number of messages sent.
+    """
+    throttle = throttle or Throttle(current_app.config.get('MAIL_SEND_RATE'))
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0
+    sent = 0
+    pending = list(batch)
+    try:
+        with mail.connect() as connection:
+            while pending:
+                while pending:
+                    message = pending[0]
+                    throttle.wait()
+                    try:
+                        connection.send(Message(message.subject, recipients=[message.recipient],
+                                                body=message.body, html=message.html))
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                        # Lỗi của riêng mail này, kết nối vẫn dùng được
+                        _mark_failed(message, e)
+                    else:
+                        message.status = 'sent'
+                        message.sent_at = datetime.now()
+                        message.last_error = None
+                        sent += 1
+                    pending.pop(0)
+                    db.session.commit()
+                if len(batch) < batch_size:
+                    break
+                batch = claim_batch(batch_size)
+                pending = list(batch)
+    except (smtplib.SMTPException, OSError) as e:
+        # Mất kết nối / không đăng nhập được: trả các mail chưa gửi về hàng đợi
+        logger.warning("SMTP connection failed: %s", e)
+        for message in pending:
+            _mark_failed(message, e)
+        db.session.commit()
+    return sent
+
+
+def run_mail_sender(app, mail, once=False, poll_interval=2.0, stop=None):
+    """Send mail until stopped (or until the outbox is empty when once=True)"""
+    stop = stop or threading.Event()
+    total = 0
+    with app.app_context():
+        throttle = Throttle(app.config.get('MAIL_SEND_RATE'))
+        while not stop.is_set():
+            sent = send_pending(mail, throttle=throttle)
+            total += sent
+            if not sent:
+                if once and not _has_due_messages():
+                    break
+                stop.wait(poll_interval)
+    return total
+
+
+def _has_due_messages():
+    return db.session.query(OutboxMessage.id).filter(
+        OutboxMessage.status == 'queued', OutboxMessage.next_attempt_at <= datetime.now()
+    ).first() is not None
+
+
+def outbox_counts():
+    """{status: number of messages}"""
+    return dict(db.session.query(OutboxMessage.status, func.count(OutboxMessage.id))
+                .group_by(OutboxMessage.status).all())
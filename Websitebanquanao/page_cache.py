@@ -0,0 +1,81 @@
+"""
+Whole-page cache for anonymous catalog traffic (home, product list, sale,
+product detail). A page is keyed on its path, the normalized query string
+and the catalog version; bump_catalog_version() after a catalog write makes
+every cached page stale at once. Responses carry a strong ETag so repeat
+visitors and crawlers get 304 Not Modified.
+
+Requests with anything in the session (logged-in user, cart, voucher,
+flash messages) always render normally: the header badges and flashes are
+per-visitor.
+"""
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+from uuid import uuid4
+from flask import current_app, make_response, request, session
+from cache import get_cache
+
+VERSION_KEY = 'catalog_version'
+# Phiên bản chỉ mất khi bị bump hoặc bị LRU loại; một ngày là đủ dài
+VERSION_TTL = 24 * 3600
+DEFAULT_PAGE_TTL = 120
+
+
+def catalog_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.set(VERSION_KEY, version, VERSION_TTL)
+    return version
+
+
+def bump_catalog_version():
+    """Call after committing anything that shows up on a catalog page"""
+    get_cache().delete(VERSION_KEY)
+
+
+def page_key():
+    """Path + sorted non-empty query args, so ?b=&a=1 and ?a=1 share an entry"""
+    args = sorted((k, v) for k, values in request.args.lists() for v in values if v)
+    return f"page:{catalog_version()}:{request.path}?{urlencode(args)}"
+
+
+def _conditional_response(entry):
+    response = make_response(entry['body'])
+    response.mimetype = entry['mimetype']
+    response.set_etag(entry['etag'])
+    response.headers['Vary'] = 'Cookie'
+    response.cache_control.no_cache = True
+    response.headers['X-Page-Cache'] = entry.get('status', 'HIT')
+    return response.make_conditional(request)
+
+
+def cache_page(ttl=None):
+    """Serve the view from the page cache for anonymous GET requests"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session:
+                return view(*args, **kwargs)
+
+            cache = get_cache()
+            key = page_key()
+            entry = cache.get(key)
+            if entry is not None:
+                return _conditional_response(entry)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or session.modified or response.direct_passthrough:
+                return response
+            body = response.get_data(as_text=True)
+            entry = {
+                'body': body,
+                'mimetype': response.mimetype,
+                'etag': hashlib.sha256(body.encode('utf-8')).hexdigest(),
+            }
+            cache.set(key, entry, ttl or current_app.config.get('PAGE_CACHE_TTL', DEFAULT_PAGE_TTL))
+            return _conditional_response(dict(entry, status='MISS'))
+        return wrapper
+    return decorator
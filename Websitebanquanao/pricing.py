@@ -0,0 +1,48 @@
+"""
+Checkout pricing.
+price_cart() reprices every cart line from the products table with one IN
+query (the cart keeps the price from when the item was added) and reports
+lines that can't be sold, checking availability against the per-variant
+inventory (inventory.py). The stock itself is held by inventory.hold_stock()
+inside the checkout transaction.
+"""
+from database import db, Product
+from inventory import resolve_lines
+
+
+def price_cart(cart):
+    """Return (lines, problems): cart lines with current name/price/image,
+    and messages for products that are gone, don't have enough stock or
+    have a quantity below 1.
+    """
+    ids = {item['id'] for item in cart}
+    products = {}
+    if ids:
+        rows = (db.session.query(Product.id, Product.name, Product.price, Product.image)
+                .filter(Product.id.in_(ids)))
+        products = {row.id: row for row in rows}
+
+    lines = []
+    problems = []
+    for item in cart:
+        product = products.get(item['id'])
+        if product is None:
+            problems.append(f"Sản phẩm {item.get('name') or item['id']} không còn bán")
+            continue
+        qty = item.get('qty')
+        if isinstance(qty, bool) or not isinstance(qty, int) or qty < 1:
+            problems.append(f"Số lượng của {product.name} không hợp lệ")
+            continue
+        lines.append(dict(item, name=product.name, price=product.price, image=product.image))
+
+    needed, rows, missing = resolve_lines(lines)
+    for product_id in dict.fromkeys(missing):
+        problems.append(f"{products[product_id].name} đã hết hàng")
+    for inventory_id, qty in needed.items():
+        row = rows[inventory_id]
+        if row.available < qty:
+            name = products[row.product_id].name
+            if row.size or row.color:
+                name = f"{name} ({' / '.join(part for part in (row.size, row.color) if part)})"
+            problems.append(f"{name} chỉ còn {max(0, row.available)} sản phẩm")
+    return lines, problems
@@ -0,0 +1,288 @@
+"""
+Bulk product import / export in CSV or JSONL.
+Imports read the file as a stream, validate each row and upsert products in
+batches (one executemany INSERT ... ON CONFLICT per batch, one commit per
+batch), then move stock and the search index for the whole batch at once.
+Exports walk the table with yield_per and yield one line at a time, so
+neither side holds the catalog in memory.
+"""
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from database import db, Product
+from inventory import set_total_stock_many
+from search_index import index_products
+
+IMPORT_BATCH_SIZE = 2000
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+FORMATS = ('csv', 'jsonl')
+
+# Cột của file import/export, theo thứ tự cột CSV
+FIELDS = ('id', 'name', 'price', 'old_price', 'category', 'image', 'images', 'description',
+          'stock', 'sizes', 'colors', 'color_images', 'featured')
+LIST_FIELDS = ('images', 'sizes', 'colors')
+# Import ghi đè các cột này; rating, sold, ảnh thu nhỏ... được giữ nguyên
+UPDATE_COLUMNS = ('name', 'price', 'old_price', 'category', 'image', 'images', 'description',
+                  'stock', 'sizes', 'colors', 'color_images', 'featured')
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'x', 'có')
+
+
+class RowError(ValueError):
+    """An import row that fails validation"""
+
+
+def detect_format(filename, default='csv'):
+    """'csv' or 'jsonl' from a file name"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return default
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, raw dict) from a text stream, one row at a time"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else RowError('Dòng không phải JSON object')
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+
+
+def _integer(row, key, default=0):
+    value = row.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{key} phải là số nguyên')
+    if number < 0:
+        raise RowError(f'{key} không được âm')
+    return number
+
+
+def _list(value, key):
+    """JSON array, or comma-separated text as typed in the admin form"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        if value.lstrip().startswith('['):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise RowError(f'{key} không phải JSON hợp lệ')
+        else:
+            return [item.strip() for item in value.split(',') if item.strip()]
+    if not isinstance(value, list):
+        raise RowError(f'{key} phải là danh sách')
+    return [str(item) for item in value]
+
+
+def _mapping(value, key):
+    if value is None or value == '':
+        return {}
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise RowError(f'{key} không phải JSON hợp lệ')
+    if not isinstance(value, dict):
+        raise RowError(f'{key} phải là JSON object')
+    return value
+
+
+def clean_row(row):
+    """Validate one raw row and return products column values"""
+    if isinstance(row, Exception):
+        raise row
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise RowError('Thiếu tên sản phẩm')
+    if len(name) > 200:
+        raise RowError('Tên sản phẩm dài quá 200 ký tự')
+    product_id = str(row.get('id') or '').strip()
+    if product_id:
+        try:
+            product_id = str(uuid.UUID(product_id))
+        except ValueError:
+            raise RowError('id không phải UUID')
+    else:
+        product_id = str(uuid.uuid4())
+
+    image = str(row.get('image') or '').strip()
+    images = _list(row.get('images'), 'images') or ([image] if image else [])
+    featured = row.get('featured')
+    if isinstance(featured, str):
+        featured = featured.strip().lower() in TRUE_VALUES
+    if row.get('price') in (None, ''):
+        raise RowError('Thiếu giá')
+    return {
+        'id': product_id,
+        'name': name,
+        'price': _integer(row, 'price'),
+        'old_price': _integer(row, 'old_price'),
+        'category': str(row.get('category') or '').strip(),
+        'image': image or (images[0] if images else ''),
+        'images': json.dumps(images),
+        'description': str(row.get('description') or ''),
+        'stock': _integer(row, 'stock'),
+        'sizes': json.dumps(_list(row.get('sizes'), 'sizes')),
+        'colors': json.dumps(_list(row.get('colors'), 'colors')),
+        'color_images': json.dumps(_mapping(row.get('color_images'), 'color_images')),
+        'featured': bool(featured),
+    }
+
+
+def _upsert_batch(batch):
+    """Write one batch of cleaned rows. Returns (number of new products,
+    {product id: stock} for products whose stock column couldn't be applied).
+    """
+    current = dict(db.session.query(Product.id, Product.stock).filter(Product.id.in_(list(batch))))
+
+    now = datetime.now()
+    params = [dict(row, rating=0, reviews=0, sold=0, created_at=now) for row in batch.values()]
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    statement = insert(Product.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['id'],
+        set_={column: statement.excluded[column] for column in UPDATE_COLUMNS}
+    )
+    db.session.execute(statement, params)
+
+    unmatched = set_total_stock_many({product_id: row['stock'] for product_id, row in batch.items()}, current)
+    index_products(list(batch.values()))
+    return len(batch) - len(current), unmatched
+
+
+def import_batches(rows, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and upsert (line number, raw row) pairs, committing every batch_size rows.
+
+    Rows with an id update that product, rows without one are created.
+    Invalid rows are skipped and listed in 'errors' (the first
+    MAX_REPORTED_ERRORS of them). Rows written without their stock (the
+    product keeps per-size/color stock the total can't be spread over) are
+    listed in 'warnings'. Yields the running summary dict after each batch;
+    the last one yielded is the final result.
+    """
+    summary = {'rows': 0, 'created': 0, 'updated': 0, 'invalid': 0, 'errors': [], 'warnings': []}
+
+    def error(line_number, message):
+        summary['invalid'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': message})
+
+    def flush(batch):
+        try:
+            created, unmatched = _upsert_batch({product_id: row for product_id, (_, row) in batch.items()})
+            db.session.commit()
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            for line_number, _ in batch.values():
+                error(line_number, f'Lỗi ghi cơ sở dữ liệu: {exc.__class__.__name__}')
+            return
+        summary['created'] += created
+        summary['updated'] += len(batch) - created
+        for product_id, stock in unmatched.items():
+            if len(summary['warnings']) < MAX_REPORTED_ERRORS:
+                line_number, row = batch[product_id]
+                summary['warnings'].append({
+                    'line': line_number,
+                    'warning': f"Tồn kho theo size/màu: không đặt được {row['stock']}, tồn kho hiện là {stock}"
+                })
+
+    batch = {}
+    flushed = False
+    for line_number, raw in rows:
+        summary['rows'] += 1
+        try:
+            row = clean_row(raw)
+        except RowError as exc:
+            error(line_number, str(exc))
+            continue
+        # Cùng id xuất hiện hai lần trong một batch: dòng sau thắng
+        batch[row['id']] = (line_number, row)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = {}
+            flushed = True
+            yield summary
+    if batch or not flushed:
+        if batch:
+            flush(batch)
+        yield summary
+
+
+def import_products(rows, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """import_batches run to the end; progress(summary) is called after each batch"""
+    summary = None
+    for summary in import_batches(rows, batch_size):
+        if progress:
+            progress(summary)
+    return summary
+
+
+def _export_row(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'price': row.price,
+        'old_price': row.old_price or 0,
+        'category': row.category or '',
+        'image': row.image or '',
+        'images': json.loads(row.images) if row.images else [],
+        'description': row.description or '',
+        'stock': row.stock or 0,
+        'sizes': json.loads(row.sizes) if row.sizes else [],
+        'colors': json.loads(row.colors) if row.colors else [],
+        'color_images': json.loads(row.color_images) if row.color_images else {},
+        'featured': bool(row.featured),
+    }
+
+
+def export_products(fmt, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the catalog as CSV or JSONL text, one line per product"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+
+    def take():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    if fmt == 'csv':
+        writer.writeheader()
+        yield take()
+    columns = [getattr(Product, field) for field in FIELDS]
+    query = db.session.query(*columns).order_by(Product.id).execution_options(yield_per=batch_size)
+    for row in query:
+        values = _export_row(row)
+        if fmt == 'jsonl':
+            yield json.dumps(values, ensure_ascii=False) + '\n'
+            continue
+        for key in LIST_FIELDS:
+            values[key] = ', '.join(values[key])
+        values['color_images'] = json.dumps(values['color_images'], ensure_ascii=False) if values['color_images'] else ''
+        values['featured'] = 'true' if values['featured'] else ''
+        writer.writerow(values)
+        yield take()
@@ -0,0 +1,63 @@
+"""
+Request-scoped memoization for the template helpers.
+Templates call get_wishlist(), get_categories()... inside loops and in
+several blocks of base.html; with @request_memo each helper hits the
+database once per request and the result is kept on flask.g.
+install_query_counter() counts the SQL statements run by each request
+for debugging (X-DB-Hits header + log line).
+"""
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from database import db
+
+
+def request_memo(func):
+    """Cache func's result on flask.g for the rest of the current request.
+    Outside a request (CLI, tests) the function is simply called.
+    """
+    @wraps(func)
+    def wrapper(*args):
+        if not has_request_context():
+            return func(*args)
+        cache = g.setdefault('_request_memo', {})
+        key = (func.__name__, args)
+        if key not in cache:
+            cache[key] = func(*args)
+        return cache[key]
+
+    def invalidate():
+        """Forget the cached values, e.g. after the route changed the data"""
+        if has_request_context():
+            cache = g.get('_request_memo', {})
+            for key in [k for k in cache if k[0] == func.__name__]:
+                del cache[key]
+
+    wrapper.invalidate = invalidate
+    return wrapper
+
+
+def db_hits():
+    """Number of SQL statements executed so far in this request"""
+    return g.get('_db_hits', 0) if has_request_context() else 0
+
+
+def install_query_counter(app):
+    """Count SQL statements per request; report them when DEBUG_DB_HITS is on"""
+    app.config.setdefault('DEBUG_DB_HITS', False)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g._db_hits = g.get('_db_hits', 0) + 1
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+    @app.after_request
+    def report_db_hits(response):
+        if app.debug or app.config['DEBUG_DB_HITS']:
+            hits = db_hits()
+            response.headers['X-DB-Hits'] = str(hits)
+            app.logger.debug("%s %s: %d DB hits", request.method, request.path, hits)
+        return response
@@ -0,0 +1,119 @@
+"""
+Revenue / order-count rollups by day, month and year for the admin dashboard.
+Each order contributes (1 order, +total revenue if completed) to the buckets
+of its created_at date. Write routes move that contribution with
+record_order_change(), so the dashboard reads a few hundred rows instead of
+every order. Orders without a created_at (unreadable legacy dates) are in
+no bucket; dashboard_stats counts them separately.
+"""
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db, Order, RevenueRollup
+
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+
+def order_rollup_key(order):
+    """Snapshot of what an order contributes: (created_at, status, total)"""
+    return (order.created_at, order.status, order.total or 0)
+
+
+def _add_to_buckets(buckets, key, sign):
+    """Add (+1) or subtract (-1) the contribution of one order snapshot"""
+    created_at, status, total = key
+    if created_at is None:
+        return
+    completed = status == 'completed'
+    for period, date_format in PERIOD_FORMATS.items():
+        bucket = buckets.setdefault((period, created_at.strftime(date_format)),
+                                    {'order_count': 0, 'completed_count': 0, 'revenue': 0})
+        bucket['order_count'] += sign
+        if completed:
+            bucket['completed_count'] += sign
+            bucket['revenue'] += sign * total
+
+
+def _upsert(period, period_key, delta):
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    table = RevenueRollup.__table__
+    statement = insert(table).values(period=period, period_key=period_key, **delta)
+    statement = statement.on_conflict_do_update(
+        index_elements=['period', 'period_key'],
+        set_={column: table.c[column] + statement.excluded[column] for column in delta}
+    )
+    db.session.execute(statement)
+
+
+def record_order_change(before, after):
+    """Move an order's contribution from `before` to `after`.
+
+    Pass before=None for a new order and after=None for a deleted one.
+    Runs inside the caller's transaction.
+    """
+    if before == after:
+        return
+    deltas = {}
+    if before is not None:
+        _add_to_buckets(deltas, before, -1)
+    if after is not None:
+        _add_to_buckets(deltas, after, 1)
+    for (period, period_key), delta in deltas.items():
+        if any(delta.values()):
+            _upsert(period, period_key, delta)
+
+
+def rebuild_revenue_rollups(batch_size=1000):
+    """Recompute every bucket from the orders table. The caller commits."""
+    buckets = {}
+    rows = db.session.query(Order.created_at, Order.status, Order.total)
+    for row in rows.yield_per(batch_size):
+        _add_to_buckets(buckets, (row.created_at, row.status, row.total or 0), 1)
+
+    RevenueRollup.query.delete()
+    params = [dict(period=period, period_key=period_key, **values)
+              for (period, period_key), values in buckets.items()]
+    if params:
+        db.session.execute(RevenueRollup.__table__.insert(), params)
+    return len(params)
+
+
+def _display_key(period, period_key):
+    """'2025-12' -> '12/2025' like the dashboard always showed"""
+    if period == 'month':
+        year, month = period_key.split('-')
+        return f"{month}/{year}"
+    return period_key
+
+
+def dashboard_stats(months=12):
+    """Totals and per-month / per-year figures for admin/dashboard.html.
+    The totals include orders without a created_at, the per-period figures can't.
+    """
+    years = (RevenueRollup.query
+             .filter_by(period='year')
+             .order_by(RevenueRollup.period_key.desc())
+             .all())
+    recent_months = (RevenueRollup.query
+                     .filter(RevenueRollup.period == 'month', RevenueRollup.completed_count > 0)
+                     .order_by(RevenueRollup.period_key.desc())
+                     .limit(months)
+                     .all())
+    undated_orders, undated_revenue = (
+        db.session.query(func.count(Order.id),
+                         func.coalesce(func.sum(case((Order.status == 'completed', Order.total), else_=0)), 0))
+        .filter(Order.created_at.is_(None))
+        .one()
+    )
+    return {
+        'total_orders': sum(row.order_count for row in years) + undated_orders,
+        'revenue': sum(row.revenue for row in years) + undated_revenue,
+        'revenue_by_month': [(_display_key('month', row.period_key), row.revenue) for row in recent_months],
+        'revenue_by_year': [(row.period_key, row.revenue) for row in years if row.completed_count],
+        'orders_by_month': {_display_key('month', row.period_key): row.order_count for row in recent_months},
+        'orders_by_year': {row.period_key: row.order_count for row in years},
+    }
@@ -0,0 +1,185 @@
+"""
+Batched loading of review pages and per-product rating aggregates.
+A page of reviews is serialized with a fixed number of queries (authors,
+like counts, the viewer's likes and replies are fetched with IN-batches)
+instead of several queries per review. Rating histograms live on the
+product row and are updated incrementally, so no route scans all reviews.
+"""
+import json
+from sqlalchemy import case, func, update
+from database import db, read_session, Product, User, Review, ReviewReply, ReviewLike
+
+REVIEW_SORTS = {
+    'recent': Review.created_at.desc(),
+    'helpful': Review.helpful_count.desc(),
+    'rating_high': Review.rating.desc(),
+    'rating_low': Review.rating.asc(),
+}
+
+
+def _load_users(emails, session=None):
+    if not emails:
+        return {}
+    session = session or db.session
+    rows = session.query(User.email, User.name, User.role).filter(User.email.in_(emails)).all()
+    return {row.email: row for row in rows}
+
+
+def _reply_dict(reply, user):
+    return {
+        'id': reply.id,
+        'review_id': reply.review_id,
+        'user_email': reply.user_email,
+        'user_name': user.name if user else 'Quản trị viên',
+        'user_role': user.role if user else 'admin',
+        'comment': reply.comment,
+        'created_at': reply.created_at.isoformat() if reply.created_at else None
+    }
+
+
+def serialize_replies(replies):
+    """Serialize replies with a single author lookup"""
+    users = _load_users({reply.user_email for reply in replies})
+    return [_reply_dict(reply, users.get(reply.user_email)) for reply in replies]
+
+
+def serialize_reviews(reviews, user_email=None, session=None):
+    """Serialize a list of reviews (with replies) for the given viewer.
+
+    Uses at most 4 queries whatever the number of reviews.
+    """
+    if not reviews:
+        return []
+    session = session or db.session
+    review_ids = [review.id for review in reviews]
+
+    like_counts = dict(
+        session.query(ReviewLike.review_id, func.count(ReviewLike.id))
+        .filter(ReviewLike.review_id.in_(review_ids))
+        .group_by(ReviewLike.review_id)
+        .all()
+    )
+
+    liked_ids = set()
+    if user_email:
+        liked_ids = {row.review_id for row in
+                     session.query(ReviewLike.review_id)
+                     .filter(ReviewLike.review_id.in_(review_ids), ReviewLike.user_email == user_email)}
+
+    replies_by_review = {}
+    replies = (session.query(ReviewReply)
+               .filter(ReviewReply.review_id.in_(review_ids))
+               .order_by(ReviewReply.created_at, ReviewReply.id)
+               .all())
+    for reply in replies:
+        replies_by_review.setdefault(reply.review_id, []).append(reply)
+
+    # Một truy vấn cho cả người viết đánh giá và người phản hồi
+    users = _load_users({review.user_email for review in reviews} |
+                        {reply.user_email for reply in replies}, session)
+
+    result = []
+    for review in reviews:
+        user = users.get(review.user_email)
+        result.append({
+            'id': review.id,
+            'product_id': review.product_id,
+            'user_email': review.user_email,
+            'user_name': user.name if user else 'Người dùng',
+            'order_id': review.order_id,
+            'rating': review.rating,
+            'comment': review.comment,
+            'images': json.loads(review.images) if review.images else [],
+            'image_variants': json.loads(review.image_variants) if review.image_variants else {},
+            'size': review.size,
+            'color': review.color,
+            'verified_purchase': review.verified_purchase,
+            'helpful_count': like_counts.get(review.id, 0),
+            'user_liked': review.id in liked_ids,
+            'created_at': review.created_at.isoformat() if review.created_at else None,
+            'replies': [_reply_dict(reply, users.get(reply.user_email))
+                        for reply in replies_by_review.get(review.id, [])]
+        })
+    return result
+
+
+def load_review_page(product_id, page=1, per_page=10, sort='recent', user_email=None):
+    """Return (pagination, serialized reviews) for one page of a product's reviews.
+    Read from the read pool / replica.
+    """
+    session = read_session()
+    order = REVIEW_SORTS.get(sort, REVIEW_SORTS['recent'])
+    pagination = (session.query(Review)
+                  .filter_by(product_id=product_id)
+                  .order_by(order, Review.id.desc())
+                  .paginate(page=page, per_page=per_page, error_out=False))
+    return pagination, serialize_reviews(pagination.items, user_email, session)
+
+
+RATING_COLUMNS = {
+    1: Product.rating_count_1,
+    2: Product.rating_count_2,
+    3: Product.rating_count_3,
+    4: Product.rating_count_4,
+    5: Product.rating_count_5,
+}
+
+
+def apply_rating(product_id, rating, delta=1):
+    """Add (delta=1) or remove (delta=-1) one rating from a product's aggregates.
+
+    One atomic UPDATE inside the caller's transaction; the average and the
+    review count are derived from the new histogram in the same statement.
+    """
+    counts = {stars: func.coalesce(column, 0) + (delta if stars == rating else 0)
+              for stars, column in RATING_COLUMNS.items()}
+    total = sum(counts.values())
+    weighted = sum(stars * count for stars, count in counts.items())
+    db.session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values({
+            RATING_COLUMNS[rating]: counts[rating],
+            Product.reviews: total,
+            Product.rating: case((total > 0, func.round(weighted * 1.0 / total, 1)), else_=0),
+        })
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rating_summary(product):
+    """Return (total_reviews, avg_rating, rating_stats) from the stored aggregates"""
+    rating_stats = {str(stars): getattr(product, column.key) or 0
+                    for stars, column in sorted(RATING_COLUMNS.items(), reverse=True)}
+    total_reviews = sum(rating_stats.values())
+    weighted = sum(int(stars) * count for stars, count in rating_stats.items())
+    avg_rating = round(weighted / total_reviews, 1) if total_reviews else 0
+    return total_reviews, avg_rating, rating_stats
+
+
+def rebuild_rating_summaries():
+    """Recompute every product's aggregates from the reviews table (repair command).
+    The caller commits. Returns the number of products updated.
+    """
+    histograms = {}
+    rows = (db.session.query(Review.product_id, Review.rating, func.count(Review.id))
+            .group_by(Review.product_id, Review.rating))
+    for product_id, stars, count in rows:
+        if stars in RATING_COLUMNS:
+            histograms.setdefault(product_id, {})[stars] = count
+
+    params = []
+    for (product_id,) in db.session.query(Product.id):
+        histogram = histograms.get(product_id, {})
+        total = sum(histogram.values())
+        weighted = sum(stars * count for stars, count in histogram.items())
+        values = {'id': product_id,
+                  'reviews': total,
+                  'rating': round(weighted / total, 1) if total else 0}
+        for stars, column in RATING_COLUMNS.items():
+            values[column.key] = histogram.get(stars, 0)
+        params.append(values)
+
+    if params:
+        db.session.execute(update(Product), params)
+    return len(params)
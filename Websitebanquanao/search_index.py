@@ -0,0 +1,161 @@
+"""
+Full-text product search on SQLite FTS5.
+Text is folded before indexing (lower case, Vietnamese diacritics removed,
+đ -> d) so "ao thun" finds "Áo thun". Every token is matched as a prefix
+and results are ranked with bm25, name matches weighing the most.
+
+product_id is an UNINDEXED column, so rows are never looked up by it: each
+product gets a stable integer in product_search_keys and its FTS row uses
+that integer as rowid, which FTS5 finds directly.
+"""
+import re
+import unicodedata
+from sqlalchemy import Float, String, bindparam, column, text
+from database import db, Product
+
+SEARCH_TABLE = 'product_search'
+KEYS_TABLE = 'product_search_keys'
+
+# bm25 weights for (product_id, name, category, description)
+RANK_EXPRESSION = f"bm25({SEARCH_TABLE}, 0.0, 10.0, 4.0, 1.0)"
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold_text(value):
+    """Lower-case and strip diacritics: 'Áo Đầm' -> 'ao dam'"""
+    if not value:
+        return ''
+    value = value.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', value)
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+    return stripped.lower()
+
+
+def search_available():
+    """FTS5 only exists on SQLite; other backends fall back to LIKE search"""
+    return db.engine.dialect.name == 'sqlite'
+
+
+def build_match_query(search):
+    """Turn user input into an FTS5 query where every token is a prefix match"""
+    tokens = _TOKEN_RE.findall(fold_text(search))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def ensure_search_index():
+    """Create the FTS table if needed and fill it the first time"""
+    if not search_available():
+        return
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "product_id UNINDEXED, name, category, description, "
+        "tokenize = 'unicode61', prefix = '2 3')"
+    ))
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {KEYS_TABLE} ("
+        "id INTEGER PRIMARY KEY, product_id VARCHAR(36) NOT NULL UNIQUE)"
+    ))
+    # Chưa có khóa: lần đầu, hoặc bảng FTS cũ có rowid tùy ý -> đánh chỉ mục lại
+    keyed = db.session.execute(text(f"SELECT count(*) FROM {KEYS_TABLE}")).scalar()
+    if not keyed and Product.query.count():
+        rebuild_search_index()
+    db.session.commit()
+
+
+def _row_keys(product_ids):
+    """{product id: FTS rowid}, creating keys for products that have none"""
+    if not product_ids:
+        return {}
+    db.session.execute(text(f"INSERT OR IGNORE INTO {KEYS_TABLE} (product_id) VALUES (:product_id)"),
+                       [{'product_id': product_id} for product_id in product_ids])
+    rows = db.session.execute(
+        text(f"SELECT product_id, id FROM {KEYS_TABLE} WHERE product_id IN :product_ids")
+        .bindparams(bindparam('product_ids', expanding=True)),
+        {'product_ids': list(product_ids)}
+    )
+    return dict(rows.fetchall())
+
+
+def _delete_rows(rowids):
+    db.session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"),
+                       [{'rowid': rowid} for rowid in rowids])
+
+
+def index_product(product):
+    """Insert or refresh one product; runs inside the caller's transaction"""
+    if not search_available():
+        return
+    index_products([{'id': product.id, 'name': product.name, 'category': product.category,
+                     'description': product.description}])
+
+
+def remove_product(product_id):
+    if not search_available():
+        return
+    rowid = db.session.execute(text(f"SELECT id FROM {KEYS_TABLE} WHERE product_id = :product_id"),
+                               {'product_id': product_id}).scalar()
+    if rowid is not None:
+        _delete_rows([rowid])
+        db.session.execute(text(f"DELETE FROM {KEYS_TABLE} WHERE id = :rowid"), {'rowid': rowid})
+
+
+def index_products(rows):
+    """Insert or refresh many products at once; rows need id, name, category,
+    description. Runs inside the caller's transaction.
+    """
+    if not search_available() or not rows:
+        return
+    keys = _row_keys([row['id'] for row in rows])
+    _delete_rows(keys.values())
+    _insert_batch([{
+        'rowid': keys[row['id']],
+        'product_id': row['id'],
+        'name': fold_text(row['name']),
+        'category': fold_text(row['category']),
+        'description': fold_text(row['description']),
+    } for row in rows])
+
+
+def rebuild_search_index(batch_size=1000):
+    """Re-index the whole catalog (used on first start and by `flask rebuild-search`)"""
+    if not search_available():
+        return 0
+    db.session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    db.session.execute(text(f"DELETE FROM {KEYS_TABLE}"))
+    rows = db.session.query(Product.id, Product.name, Product.category, Product.description)
+    batch = []
+    count = 0
+    for row in rows.yield_per(batch_size):
+        batch.append({'id': row.id, 'name': row.name, 'category': row.category, 'description': row.description})
+        if len(batch) >= batch_size:
+            index_products(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        index_products(batch)
+        count += len(batch)
+    return count
+
+
+def _insert_batch(batch):
+    db.session.execute(
+        text(f"INSERT INTO {SEARCH_TABLE} (rowid, product_id, name, category, description) "
+             "VALUES (:rowid, :product_id, :name, :category, :description)"),
+        batch
+    )
+
+
+def search_hits(search):
+    """Subquery of (product_id, rank) for the search text, or None if the text has no tokens.
+    Lower rank = better match.
+    """
+    match = build_match_query(search)
+    if not match:
+        return None
+    return text(
+        f"SELECT product_id, {RANK_EXPRESSION} AS rank FROM {SEARCH_TABLE} "
+        f"WHERE {SEARCH_TABLE} MATCH :match"
+    ).bindparams(match=match).columns(
+        column('product_id', String), column('rank', Float)
+    ).subquery('search_hits')
@@ -0,0 +1,64 @@
+"""
+Tests for the shared TTL cache (cache.py)
+"""
+from flask import Flask
+from cache import MemoryCache, NullCache, init_cache, cached_value, invalidate
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_cache_expires_and_evicts():
+    clock = FakeClock()
+    cache = MemoryCache(max_entries=2, clock=clock)
+    cache.set('a', [1], ttl=10)
+    cache.set('b', [2], ttl=10)
+    assert cache.get('a') == [1]
+
+    # 'b' là mục ít dùng nhất nên bị loại khi thêm 'c'
+    cache.set('c', [3], ttl=10)
+    assert cache.get('b') is None
+    assert cache.get('a') == [1] and cache.get('c') == [3]
+
+    clock.now = 11
+    assert cache.get('a') is None
+
+    cache.set('d', [4], ttl=10)
+    cache.delete('d')
+    assert cache.get('d') is None
+
+
+def test_cached_value_and_invalidate():
+    app = Flask(__name__)
+    init_cache(app, MemoryCache())
+    calls = []
+
+    def load():
+        calls.append(1)
+        return ['Áo', 'Quần']
+
+    with app.app_context():
+        assert cached_value('categories', load) == ['Áo', 'Quần']
+        assert cached_value('categories', load) == ['Áo', 'Quần']
+        assert len(calls) == 1
+
+        invalidate('categories')
+        cached_value('categories', load)
+        assert len(calls) == 2
+
+    init_cache(app, NullCache())
+    with app.app_context():
+        cached_value('categories', load)
+        cached_value('categories', load)
+        assert len(calls) == 4
+
+
+if __name__ == '__main__':
+    test_memory_cache_expires_and_evicts()
+    test_cached_value_and_invalidate()
+    print("✅ All cache tests passed!")
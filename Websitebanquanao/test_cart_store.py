@@ -0,0 +1,52 @@
+"""
+Tests for the server-side cart (cart_store.py)
+"""
+from database import db, Product, CartItem
+from testing import make_app
+from cart_store import load_cart, add_item, change_qty, remove_item, clear_cart, import_session_cart
+
+
+def test_cart_lines_are_merged_and_updated_in_place():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        jeans = Product.query.filter_by(name='Quần Jeans Nam').first()
+        user = 'le.van.c@gmail.com'
+
+        add_item(user, shirt, 'Đen', 'L', 2)
+        add_item(user, shirt, 'Đen', 'L', 1)
+        add_item(user, shirt, 'Trắng', 'L', 1)
+        add_item(user, jeans, 'Xanh', '30', 1)
+        db.session.commit()
+        cart = load_cart(user)
+        assert [(item['id'], item['color'], item['qty']) for item in cart] == [
+            (shirt.id, 'Đen', 3), (shirt.id, 'Trắng', 1), (jeans.id, 'Xanh', 1)]
+        assert cart[0]['price'] == shirt.price and cart[0]['name'] == shirt.name
+
+        change_qty(user, jeans.id, 'Xanh', '30', -1)  # Không giảm xuống dưới 1
+        change_qty(user, shirt.id, 'Trắng', 'L', 1)
+        remove_item(user, shirt.id, 'Đen', 'L')
+        db.session.commit()
+        assert [(item['color'], item['qty']) for item in load_cart(user)] == [('Trắng', 2), ('Xanh', 1)]
+        assert load_cart('tran.thi.b@gmail.com') == [] and load_cart(None) == []
+
+        clear_cart(user)
+        db.session.commit()
+        assert CartItem.query.count() == 0
+
+
+def test_import_old_session_cart():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        items = [{'id': shirt.id, 'name': shirt.name, 'price': shirt.price, 'color': 'Đen', 'size': 'M', 'qty': 2},
+                 {'id': 'deleted-product', 'color': 'Đen', 'size': 'M', 'qty': 1}]
+        import_session_cart('le.van.c@gmail.com', items, {shirt.id: shirt})
+        db.session.commit()
+        assert [(item['id'], item['qty']) for item in load_cart('le.van.c@gmail.com')] == [(shirt.id, 2)]
+
+
+if __name__ == '__main__':
+    test_cart_lines_are_merged_and_updated_in_place()
+    test_import_old_session_cart()
+    print("✅ All cart tests passed!")
@@ -0,0 +1,134 @@
+"""
+Tests for the SQL-side catalog query engine (catalog.py)
+"""
+from sqlalchemy import event, text
+from database import db, Product
+from testing import make_app
+from catalog import query_catalog, typeahead_products
+from search_index import SEARCH_TABLE, fold_text, index_product, remove_product, rebuild_search_index
+
+
+def walk_pages(**filters):
+    """Follow next_cursor until the last page and return every product"""
+    products, cursor = query_catalog(limit=3, **filters)
+    while cursor:
+        page, cursor = query_catalog(limit=3, cursor=cursor, **filters)
+        products.extend(page)
+    return products
+
+
+def test_keyset_pages_match_full_sort():
+    app = make_app()
+    with app.app_context():
+        for sort, key, reverse in [('price_asc', Product.price, False),
+                                   ('price_desc', Product.price, True),
+                                   ('popular', Product.sold, True)]:
+            expected = sorted(Product.query.all(), key=lambda p: (getattr(p, key.key), p.id), reverse=reverse)
+            paged = walk_pages(sort=sort)
+            assert [p['id'] for p in paged] == [p.id for p in expected]
+
+
+def test_filters_are_combined():
+    app = make_app()
+    with app.app_context():
+        paged = walk_pages(category='Quần', price_range='0-200000')
+        assert [p['name'] for p in paged] == ['Quần short Nam']
+
+        # Tìm kiếm không phân biệt hoa thường với ký tự tiếng Việt
+        names = {p['name'] for p in walk_pages(search='ÁO')}
+        assert 'Áo thun Basic' in names
+        assert 'Quần Jeans Nam' not in names
+
+        sale = walk_pages(sale_only=True)
+        assert all(p['old_price'] > p['price'] for p in sale)
+
+
+def test_bad_cursor_returns_first_page():
+    app = make_app()
+    with app.app_context():
+        first, _ = query_catalog(limit=3)
+        again, _ = query_catalog(limit=3, cursor='not-a-cursor')
+        assert [p['id'] for p in again] == [p['id'] for p in first]
+
+
+def test_fold_text():
+    assert fold_text('Áo Đầm Xòe') == 'ao dam xoe'
+    assert fold_text(None) == ''
+
+
+def test_search_without_diacritics_and_prefix():
+    app = make_app()
+    with app.app_context():
+        names = [p['name'] for p in walk_pages(search='ao thun')]
+        assert names == ['Áo thun Basic']
+
+        # Prefix matching + name ranked above description
+        names = [p['name'] for p in walk_pages(search='hoo')]
+        assert names[0] == 'Áo khoác Hoodie'
+
+        # Danh mục cũng được tìm kiếm
+        names = {p['name'] for p in walk_pages(search='quan')}
+        assert names == {'Quần Jeans Nam', 'Quần short Nam'}
+
+
+def test_search_index_follows_product_writes():
+    app = make_app()
+    with app.app_context():
+        product = Product.query.filter_by(name='Váy dài').first()
+        product.name = 'Đầm maxi'
+        product.category = 'Đầm'
+        product.description = 'Đầm suông dáng dài'
+        index_product(product)
+        db.session.commit()
+        assert [p['id'] for p in walk_pages(search='dam maxi')] == [product.id]
+        assert walk_pages(search='vay dai') == []
+
+        remove_product(product.id)
+        db.session.delete(product)
+        db.session.commit()
+        assert walk_pages(search='dam maxi') == []
+
+
+def test_search_rows_are_found_by_rowid():
+    app = make_app()
+    with app.app_context():
+        product = Product.query.filter_by(name='Váy dài').first()
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        index_product(product)
+        remove_product(Product.query.filter_by(name='Áo thun Basic').first().id)
+        deletes = [sql for sql in statements if sql.startswith(f'DELETE FROM {SEARCH_TABLE} ')]
+        # product_id là cột UNINDEXED: xóa theo nó phải quét cả bảng FTS
+        assert deletes and all('WHERE rowid = ' in sql for sql in deletes)
+        plan = db.session.execute(text(f"EXPLAIN QUERY PLAN DELETE FROM {SEARCH_TABLE} WHERE rowid = 1")).all()
+        assert 'INDEX 0:=' in plan[0][-1]
+
+        db.session.commit()
+        assert walk_pages(search='ao thun basic') == []
+        assert [p['id'] for p in walk_pages(search='vay dai')] == [product.id]
+        count = db.session.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+        assert rebuild_search_index() == count + 1
+
+
+def test_typeahead_returns_few_light_rows():
+    app = make_app()
+    with app.app_context():
+        rows = typeahead_products('ao th', limit=3)
+        assert rows and rows[0]['name'] == 'Áo thun Basic'
+        assert set(rows[0]) == {'id', 'name', 'price', 'image', 'stock'}
+        assert len(typeahead_products('', limit=3)) == 3
+        best = Product.query.order_by(Product.sold.desc(), Product.id.desc()).first()
+        assert typeahead_products('', limit=1)[0]['id'] == best.id
+        assert typeahead_products('???') == []
+
+
+if __name__ == '__main__':
+    test_keyset_pages_match_full_sort()
+    test_filters_are_combined()
+    test_bad_cursor_returns_first_page()
+    test_fold_text()
+    test_search_without_diacritics_and_prefix()
+    test_search_index_follows_product_writes()
+    test_search_rows_are_found_by_rowid()
+    test_typeahead_returns_few_light_rows()
+    print("✅ All catalog tests passed!")
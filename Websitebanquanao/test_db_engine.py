@@ -0,0 +1,107 @@
+"""
+Tests for the SQLite engine configuration (database.configure_engines)
+"""
+import os
+import shutil
+import tempfile
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from database import db, read_session, primary_reads, Product
+from testing import make_app
+from bench_db_contention import run_mode
+from cache import MemoryCache, init_cache, cached_value
+
+
+def pragma(session, name):
+    return session.execute(text(f'PRAGMA {name}')).scalar()
+
+
+def test_file_database_uses_wal_pragmas_and_a_read_only_pool():
+    folder = tempfile.mkdtemp()
+    try:
+        app = make_app('sqlite:///' + os.path.join(folder, 'store.db'), DB_POOL_SIZE=3)
+        with app.app_context():
+            assert db.engine.pool.size() == 3
+            assert [pragma(db.session, name) for name in ('journal_mode', 'synchronous', 'busy_timeout')] == \
+                ['wal', 1, 5000]
+
+            reader = read_session()
+            assert reader is not db.session and reader is read_session()
+            assert reader.query(Product).count() == Product.query.count()
+            with pytest.raises(OperationalError):
+                reader.execute(text("UPDATE products SET sold = sold + 1"))
+            for engine in db.engines.values():
+                engine.dispose()
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_read_pool_can_be_turned_off_and_memory_databases_have_none():
+    app = make_app('sqlite://')
+    with app.app_context():
+        assert read_session() is db.session
+
+    folder = tempfile.mkdtemp()
+    try:
+        app = make_app('sqlite:///' + os.path.join(folder, 'store.db'), DB_READ_POOL_SIZE=0)
+        with app.app_context():
+            assert read_session() is db.session
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_reads_after_a_write_and_cache_fills_use_the_primary():
+    folder = tempfile.mkdtemp()
+    try:
+        app = make_app('sqlite:///' + os.path.join(folder, 'store.db'), SECRET_KEY='test')
+        init_cache(app, MemoryCache(), compute_context=primary_reads)
+
+        @app.route('/read')
+        def read():
+            loaded = cached_value('rail', lambda: read_session() is db.session)
+            return {'primary': read_session() is db.session, 'cache_fill_primary': loaded}
+
+        @app.route('/write', methods=['POST'])
+        def write():
+            db.session.query(Product).update({Product.sold: Product.sold + 1})
+            db.session.commit()
+            return {'primary': read_session() is db.session}
+
+        client = app.test_client()
+        assert client.get('/read').get_json() == {'primary': False, 'cache_fill_primary': True}
+        assert client.post('/write').get_json() == {'primary': True}
+        # Request tiếp theo của cùng trình duyệt (sau redirect) vẫn đọc primary
+        assert client.get('/read').get_json()['primary'] is True
+        assert app.test_client().get('/read').get_json()['primary'] is False
+
+        # Hết hạn: khóa bị xóa, session của khách trống lại
+        with client.session_transaction() as browser:
+            browser['read_primary_until'] -= 60
+        assert client.get('/read').get_json()['primary'] is False
+        with client.session_transaction() as browser:
+            assert 'read_primary_until' not in browser
+
+        app.config['READ_AFTER_WRITE_SECONDS'] = 0
+        client.post('/write')
+        assert client.get('/read').get_json()['primary'] is False
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_readers_and_writers_in_separate_processes_dont_lock_out():
+    result = run_mode('tuned', readers=1, writers=1, seconds=0.5)
+    assert result['reads'] > 0 and result['writes'] > 0
+    assert result['lock_errors'] == 0
+
+
+if __name__ == '__main__':
+    test_file_database_uses_wal_pragmas_and_a_read_only_pool()
+    test_read_pool_can_be_turned_off_and_memory_databases_have_none()
+    test_reads_after_a_write_and_cache_fills_use_the_primary()
+    test_readers_and_writers_in_separate_processes_dont_lock_out()
+    print("✅ All engine configuration tests passed!")
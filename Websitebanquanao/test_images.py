@@ -0,0 +1,117 @@
+"""
+Tests for resized image variants and srcset (images.py)
+"""
+import io
+import json
+import os
+import tempfile
+import pytest
+from werkzeug.datastructures import FileStorage
+from database import db, Product, Order
+from testing import make_app
+from images import (generate_variants, srcset_attrs, save_upload, is_immutable,
+                    hash_existing_images, rewrite_image_urls, archive_images, ARCHIVE_FOLDER)
+
+def test_variants_are_resized_webp_without_upscaling():
+    Image = pytest.importorskip('PIL.Image')
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'ao_thun.png')
+        Image.new('RGBA', (1000, 1200), (200, 30, 30, 255)).save(path)
+
+        variants = generate_variants(path)
+        assert sorted(variants, key=int) == ['160', '400', '800']
+        assert variants['400'] == '/Images/ao_thun_w400.webp'
+        with Image.open(os.path.join(folder, 'ao_thun_w400.webp')) as card:
+            assert card.format == 'WEBP' and card.size == (400, 480)
+
+        small = os.path.join(folder, 'icon.png')
+        Image.new('RGB', (100, 100)).save(small)
+        assert generate_variants(small) == {'100': '/Images/icon_w100.webp'}
+
+        broken = os.path.join(folder, 'broken.png')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        assert generate_variants(broken) == {}
+
+
+def test_oversized_images_are_skipped_before_decoding(monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    import images
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'poster.png')
+        Image.new('RGB', (300, 200)).save(path)
+
+        monkeypatch.setattr(images, 'MAX_IMAGE_PIXELS', 300 * 200 - 1)
+        assert generate_variants(path) == {}
+        assert os.listdir(folder) == ['poster.png']
+
+        # Giới hạn của chính Pillow (DecompressionBombError) cũng không làm job lỗi
+        monkeypatch.setattr(images, 'MAX_IMAGE_PIXELS', 10 ** 9)
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+        assert generate_variants(path) == {}
+
+
+def test_srcset_attrs():
+    variants = {'/Images/a.png': {'400': '/Images/a_w400.webp', '160': '/Images/a_w160.webp'}}
+    attrs = srcset_attrs(variants, '/Images/a.png', '50vw')
+    assert attrs == ' srcset="/Images/a_w160.webp 160w, /Images/a_w400.webp 400w" sizes="50vw"'
+    assert srcset_attrs(variants, '/Images/b.png', '50vw') == ''
+    assert srcset_attrs({}, None, '50vw') == ''
+
+
+def upload(data, filename):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def test_uploads_are_content_addressed_and_deduplicated():
+    with tempfile.TemporaryDirectory() as folder:
+        first = save_upload(upload(b'same bytes', 'thuntrang.PNG'), folder)
+        second = save_upload(upload(b'same bytes', 'thuntrang_copy.png'), folder)
+        other = save_upload(upload(b'other bytes', 'thuntrang.png'), folder)
+        assert first == second != other
+        assert first.endswith('.png') and is_immutable(os.path.basename(first))
+        assert len(os.listdir(folder)) == 2
+        assert not is_immutable('thuntrang.png')
+        assert is_immutable(os.path.basename(first)[:-4] + '_w400.webp')
+
+
+def test_existing_images_are_hashed_and_references_rewritten():
+    app = make_app()
+    with tempfile.TemporaryDirectory() as folder, app.app_context():
+        for name in ('thuntrang.png', 'thuntrang_504be2ec.png', 'F_icon.png'):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'white t-shirt')
+        # Dữ liệu kiểu cũ còn trỏ vào tên file gốc
+        old_url = '/Images/thuntrang.png'
+        product = Product.query.filter_by(name='Áo thun Basic').first()
+        product.image = old_url
+        product.images = json.dumps([old_url])
+        product.color_images = json.dumps({'Trắng': old_url})
+        order = Order.query.first()
+        order.items = json.dumps([{'name': product.name, 'image': old_url}])
+        db.session.commit()
+
+        mapping = hash_existing_images(folder)
+        assert '/Images/F_icon.png' not in mapping  # logo dùng thẳng trong template
+        assert len(set(mapping.values())) == 1
+        new_url = mapping[old_url]
+
+        assert rewrite_image_urls(mapping) > 0
+        db.session.commit()
+        assert archive_images(mapping, folder) == 2
+        db.session.expire_all()
+        assert product.image == new_url and json.loads(product.images) == [new_url]
+        assert product.to_dict()['color_images']['Trắng'] == new_url
+        assert json.loads(order.items)[0]['image'] == new_url
+
+        assert sorted(os.listdir(folder)) == sorted([ARCHIVE_FOLDER, 'F_icon.png', os.path.basename(new_url)])
+        assert sorted(os.listdir(os.path.join(folder, ARCHIVE_FOLDER))) == ['thuntrang.png', 'thuntrang_504be2ec.png']
+        assert hash_existing_images(folder) == {}
+
+
+if __name__ == '__main__':
+    test_variants_are_resized_webp_without_upscaling()
+    test_srcset_attrs()
+    test_uploads_are_content_addressed_and_deduplicated()
+    test_existing_images_are_hashed_and_references_rewritten()
+    print("✅ All image tests passed!")
@@ -0,0 +1,104 @@
+"""
+Tests for per-variant inventory and stock holds (inventory.py)
+"""
+from datetime import datetime, timedelta
+from database import db, Product, Inventory, StockReservation
+from testing import make_app
+from inventory import (hold_stock, commit_stock, release_stock, settle_order_stock,
+                       expired_order_ids, set_stock, adjust_shared_stock)
+
+
+def variant(product_id, size='', color=''):
+    db.session.expire_all()
+    return Inventory.query.filter_by(product_id=product_id, size=size, color=color).one()
+
+
+def test_products_get_a_shared_row_with_their_stock():
+    app = make_app()
+    with app.app_context():
+        assert Inventory.query.count() == Product.query.count()
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        assert variant(shirt.id).on_hand == shirt.stock
+
+        set_stock(shirt.id, 4, 'M', 'Đen')
+        adjust_shared_stock(shirt.id, -shirt.stock - 10)  # Không xuống dưới 0
+        db.session.commit()
+        assert (variant(shirt.id).on_hand, db.session.get(Product, shirt.id).stock) == (0, 4)
+
+
+def test_hold_is_per_variant_and_all_or_nothing():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        jeans = Product.query.filter_by(name='Quần Jeans Nam').first()
+        shirt_id, jeans_id = shirt.id, jeans.id
+        set_stock(shirt_id, 5)
+        set_stock(shirt_id, 1, 'M', 'Đen')
+        set_stock(jeans_id, 3)
+        db.session.commit()
+
+        black = {'id': shirt_id, 'size': 'M', 'color': 'Đen', 'qty': 2}
+        white = {'id': shirt_id, 'size': 'M', 'color': 'Trắng', 'qty': 2}
+        assert hold_stock('order-1', [dict(white), black, {'id': jeans_id, 'qty': 1}]) == [shirt_id]
+        db.session.rollback()
+        assert variant(shirt_id).reserved == 0 and variant(jeans_id).reserved == 0
+
+        black['qty'] = 1
+        assert hold_stock('order-1', [white, black, {'id': jeans_id, 'qty': 1}]) == []
+        db.session.commit()
+        assert (variant(shirt_id).reserved, variant(shirt_id, 'M', 'Đen').reserved) == (2, 1)
+        assert variant(shirt_id, 'M', 'Đen').available == 0
+        assert hold_stock('order-2', [black]) == [shirt_id]
+        assert hold_stock('order-2', [{'id': 'deleted', 'qty': 1}]) == ['deleted']
+
+
+def test_completion_commits_and_cancel_releases():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        shirt_id, sold = shirt.id, shirt.sold
+        set_stock(shirt_id, 10)
+        line = {'id': shirt_id, 'size': 'L', 'color': 'Đen', 'qty': 3}
+        hold_stock('paid', [line])
+        hold_stock('cancelled', [line])
+        db.session.commit()
+        assert variant(shirt_id).available == 4
+
+        assert commit_stock('paid') == 3
+        assert commit_stock('paid') == 0  # Chỉ trừ kho một lần
+        assert release_stock('cancelled') == 3
+        assert release_stock('paid') == 0  # Hàng đã bán không quay lại kho
+        db.session.commit()
+        db.session.expire_all()
+        row = variant(shirt_id)
+        product = db.session.get(Product, shirt_id)
+        assert (row.on_hand, row.reserved, product.stock, product.sold) == (7, 0, 7, sold + 3)
+        assert [r.status for r in StockReservation.query.order_by(StockReservation.id)] == ['committed', 'released']
+
+
+def test_expired_holds_are_found_until_the_order_is_confirmed():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        set_stock(shirt.id, 10)
+        now = datetime(2025, 12, 20, 10, 0)
+        line = {'id': shirt.id, 'qty': 1}
+        hold_stock('online', [line], expires_at=now + timedelta(minutes=30))
+        hold_stock('confirmed', [line], expires_at=now + timedelta(minutes=30))
+        hold_stock('cod', [line])
+        db.session.commit()
+        assert expired_order_ids(now) == []
+
+        class ShippedOrder:
+            id, status, payment_status = 'confirmed', 'shipping', 'pending'
+        settle_order_stock(ShippedOrder)
+        db.session.commit()
+        assert expired_order_ids(now + timedelta(hours=1)) == ['online']
+
+
+if __name__ == '__main__':
+    test_products_get_a_shared_row_with_their_stock()
+    test_hold_is_per_variant_and_all_or_nothing()
+    test_completion_commits_and_cancel_releases()
+    test_expired_holds_are_found_until_the_order_is_confirmed()
+    print("✅ All inventory tests passed!")
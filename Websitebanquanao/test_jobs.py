@@ -0,0 +1,72 @@
+"""
+Tests for the background job queue (jobs.py)
+"""
+import os
+import tempfile
+from datetime import datetime
+from database import db, Job
+from testing import make_app
+from jobs import job_handler, enqueue, work, run_worker_pool, job_counts
+
+
+processed = []
+
+
+@job_handler('test_record')
+def record_job(payload):
+    processed.append(payload['n'])
+
+
+@job_handler('test_fail')
+def fail_job(payload):
+    raise RuntimeError('boom')
+
+
+def test_jobs_run_after_commit_and_retry():
+    app = make_app()
+    with app.app_context():
+        processed.clear()
+        enqueue('test_record', {'n': 1})
+        db.session.rollback()
+        assert work('w1', once=True) == 0
+
+        enqueue('test_record', {'n': 2})
+        failing = enqueue('test_fail', max_attempts=2)
+        db.session.commit()
+        failing_id = failing.id
+
+        assert work('w1', once=True) == 2
+        assert processed == [2]
+        job = db.session.get(Job, failing_id)
+        assert (job.status, job.attempts) == ('queued', 1)
+        assert job.run_at > datetime.now() and 'boom' in job.last_error
+
+        # Đến hạn thử lại lần 2 -> hết lượt -> failed
+        job.run_at = datetime.now()
+        db.session.commit()
+        work('w1', once=True)
+        job = db.session.get(Job, failing_id)
+        assert (job.status, job.attempts) == ('failed', 2)
+        assert job_counts() == {'done': 1, 'failed': 1}
+
+
+def test_worker_pool_runs_each_job_once():
+    with tempfile.TemporaryDirectory() as folder:
+        app = make_app('sqlite:///' + os.path.join(folder, 'jobs.db'))
+        with app.app_context():
+            processed.clear()
+            for n in range(30):
+                enqueue('test_record', {'n': n})
+            db.session.commit()
+
+        assert run_worker_pool(app, threads=3, once=True, poll_interval=0.01) == 30
+        assert sorted(processed) == list(range(30))
+        with app.app_context():
+            assert job_counts() == {'done': 30}
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    test_jobs_run_after_commit_and_retry()
+    test_worker_pool_runs_each_job_once()
+    print("✅ All job queue tests passed!")
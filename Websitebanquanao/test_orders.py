@@ -0,0 +1,315 @@
+"""
+Tests for order line items and order queries (orders.py)
+"""
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+import orders
+from sqlalchemy import text
+from database import db, Product, Order, OrderItem, Inventory, StockReservation
+from testing import make_app
+from orders import (set_order_items, sync_order_status, count_purchases, last_purchased_item,
+                    backfill_order_items, normalize_order_dates, parse_order_filters, query_admin_orders,
+                    count_admin_orders, query_user_orders, order_line_items, hold_order_items,
+                    replace_order_items)
+from inventory import settle_order_stock
+from revenue import rebuild_revenue_rollups
+
+
+def new_order(user_email, items, status='pending'):
+    order = Order(id=str(uuid4()), user_email=user_email, subtotal=0, total=0, status=status)
+    set_order_items(order, items)
+    db.session.add(order)
+    db.session.commit()
+    return order
+
+
+def staff_order(product, qty, size='', color=''):
+    order = Order(id=str(uuid4()), user_email='khach@example.com', subtotal=0, total=0, status='pending')
+    failed = hold_order_items(order, [{'id': product.id, 'name': product.name, 'price': product.price,
+                                       'qty': qty, 'size': size, 'color': color}])
+    db.session.add(order)
+    return order, failed
+
+
+def complete(order):
+    order.status = 'completed'
+    sync_order_status(order)
+    settle_order_stock(order)
+    db.session.commit()
+
+
+def test_staff_created_orders_hold_and_take_stock():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        shirt_id, stock, sold = shirt.id, shirt.stock, shirt.sold
+        order, failed = staff_order(shirt, 3)
+        assert failed == []
+        db.session.commit()
+        assert Inventory.query.filter_by(product_id=shirt_id, size='', color='').one().reserved == 3
+
+        complete(order)
+        db.session.expire_all()
+        shirt = db.session.get(Product, shirt_id)
+        assert (shirt.stock, shirt.sold) == (stock - 3, sold + 3)
+
+        # Vượt tồn kho hoặc số lượng âm: không có gì được giữ, route rollback
+        for qty in (stock + 1, -2):
+            order, failed = staff_order(shirt, qty)
+            assert failed == [shirt_id]
+            db.session.rollback()
+        assert StockReservation.query.filter_by(status='held').count() == 0
+
+
+def test_edited_items_move_the_stock_holds():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        jeans = Product.query.filter_by(name='Quần Jeans Nam').first()
+        shirt_id, shirt_sold, jeans_id, jeans_stock = shirt.id, shirt.sold, jeans.id, jeans.stock
+        order, _ = staff_order(shirt, 2)
+        db.session.commit()
+
+        items = [{'id': jeans_id, 'name': jeans.name, 'price': jeans.price, 'qty': 4, 'size': '', 'color': ''}]
+        assert replace_order_items(order, items) == []
+        db.session.commit()
+        held = StockReservation.query.filter_by(order_id=order.id, status='held').all()
+        assert [(r.product_id, r.qty) for r in held] == [(jeans_id, 4)]
+        assert Inventory.query.filter_by(product_id=shirt_id, size='', color='').one().reserved == 0
+
+        # Hoàn thành đơn trừ kho theo dòng mới, không theo dòng cũ
+        complete(order)
+        db.session.expire_all()
+        assert db.session.get(Product, jeans_id).stock == jeans_stock - 4
+        assert db.session.get(Product, shirt_id).sold == shirt_sold
+
+        # Không đủ hàng cho dòng mới: báo lỗi để route rollback
+        order, _ = staff_order(shirt, 1)
+        db.session.commit()
+        too_many = [dict(items[0], qty=jeans_stock)]
+        assert replace_order_items(order, too_many) == [jeans_id]
+        db.session.rollback()
+        assert [r.product_id for r in StockReservation.query.filter_by(order_id=order.id, status='held')] == [shirt_id]
+
+
+def test_backfill_reads_legacy_json():
+    app = make_app()
+    with app.app_context():
+        jeans = Product.query.filter_by(name='Quần Jeans Nam').first()
+        # Seed orders use product_id/quantity; two customers bought the jeans
+        assert OrderItem.query.filter_by(product_id=jeans.id).count() == 2
+        assert count_purchases('nguyen.van.a@gmail.com', jeans.id) == 1
+
+        OrderItem.query.delete()
+        db.session.commit()
+        assert count_purchases('nguyen.van.a@gmail.com', jeans.id) == 0
+        assert backfill_order_items() == 7
+        db.session.commit()
+        assert count_purchases('nguyen.van.a@gmail.com', jeans.id) == 1
+
+
+def test_purchases_follow_order_status():
+    app = make_app()
+    with app.app_context():
+        dress = Product.query.filter_by(name='Váy dài').first()
+        # Cart items use id/qty
+        cart = [{'id': dress.id, 'name': dress.name, 'price': dress.price, 'qty': 2, 'size': 'S', 'color': 'Be'}]
+        first = new_order('tran.thi.b@gmail.com', cart)
+        new_order('tran.thi.b@gmail.com', cart, status='completed')
+        assert count_purchases('tran.thi.b@gmail.com', dress.id) == 1
+
+        first.status = 'completed'
+        sync_order_status(first)
+        db.session.commit()
+        assert count_purchases('tran.thi.b@gmail.com', dress.id) == 2
+        item = last_purchased_item('tran.thi.b@gmail.com', dress.id)
+        assert (item.size, item.color, item.quantity) == ('S', 'Be', 2)
+
+        # Sửa đơn thay thế toàn bộ dòng sản phẩm
+        set_order_items(first, [])
+        db.session.delete(first)
+        db.session.commit()
+        assert count_purchases('tran.thi.b@gmail.com', dress.id) == 1
+
+
+def test_normalize_legacy_order_dates():
+    app = make_app()
+    with app.app_context():
+        first, second = [o.id for o in Order.query.order_by(Order.id).limit(2)]
+        # Giá trị kiểu cũ: chuỗi của checkout() và của dữ liệu mẫu
+        db.session.execute(text("UPDATE orders SET created_at = '20/12/2025 13:46' WHERE id = :id"), {'id': first})
+        db.session.execute(text("UPDATE orders SET created_at = '2024-11-10 10:00:00' WHERE id = :id"), {'id': second})
+        broken = str(uuid4())
+        db.session.add(Order(id=broken, user_email='le.van.c@gmail.com', items='[]', subtotal=0, total=0))
+        db.session.flush()
+        db.session.execute(text("UPDATE orders SET created_at = 'hôm qua' WHERE id = :id"), {'id': broken})
+        db.session.commit()
+        db.session.expunge_all()
+
+        count, unparsed = normalize_order_dates()
+        # Chỉ đơn dd/mm/YYYY được chuyển; giá trị ISO đã đọc được thì bỏ qua
+        assert (count, unparsed) == (1, [broken])
+        db.session.commit()
+        assert normalize_order_dates() == (0, [])
+
+        # Giá trị không đọc được chuyển sang created_at_raw, đơn vẫn load được qua ORM
+        orders = {order.id: order for order in Order.query.all()}
+        assert orders[broken].created_at is None and orders[broken].created_at_raw == 'hôm qua'
+        assert broken in [row['id'] for row in query_admin_orders({})[0]]
+        assert orders[first].created_at == datetime(2025, 12, 20, 13, 46)
+        assert orders[second].created_at == datetime(2024, 11, 10, 10, 0)
+
+        newest = Order.query.order_by(Order.created_at.desc()).first()
+        assert newest.id == first
+        assert newest.to_dict()['created_at'] == '20/12/2025 13:46'
+
+
+def add_orders(count):
+    """count orders spread over January 2026 with cycling status/payment/customer"""
+    statuses = ['pending', 'shipping', 'completed', 'cancelled']
+    start = datetime(2026, 1, 1, 8, 0)
+    for i in range(count):
+        db.session.add(Order(id=str(uuid4()), user_email=f'khach{i % 3}@example.com', items='[]',
+                             subtotal=100000, total=100000, status=statuses[i % 4],
+                             payment_status='paid' if i % 2 else 'cod',
+                             created_at=start + timedelta(hours=6 * (i // 2))))  # 2 đơn cùng giờ
+    rebuild_revenue_rollups()
+    db.session.commit()
+
+
+def all_pages(filters, limit):
+    rows, cursor = query_admin_orders(filters, limit=limit)
+    while cursor:
+        page, cursor = query_admin_orders(filters, cursor=cursor, limit=limit)
+        rows += page
+    return rows
+
+
+def test_admin_order_pages_follow_created_at_and_id():
+    app = make_app()
+    with app.app_context():
+        add_orders(40)
+        expected = [(o.created_at, o.id) for o in Order.query.order_by(Order.created_at.desc(), Order.id.desc())]
+        rows = all_pages({}, limit=7)
+        assert [row['id'] for row in rows] == [order_id for _, order_id in expected]
+        assert set(rows[0]) == {'id', 'user_email', 'total', 'payment_method', 'payment_status',
+                                'status', 'created_at'}
+        assert query_admin_orders({}, cursor='rác')[0][0] == rows[0]
+
+
+def test_orders_without_created_at_are_paged_and_counted():
+    app = make_app()
+    with app.app_context():
+        add_orders(20)
+        undated = sorted(str(uuid4()) for _ in range(3))
+        for i, order_id in enumerate(undated):
+            db.session.add(Order(id=order_id, user_email='khach0@example.com', items='[]', subtotal=0, total=0,
+                                 status='completed' if i == 0 else 'pending'))
+        db.session.flush()
+        # Ngày tạo kiểu cũ không đọc được (xem normalize_order_dates)
+        Order.query.filter(Order.id.in_(undated)).update({'created_at': None}, synchronize_session=False)
+        db.session.commit()
+
+        dated = [o.id for o in Order.query.filter(Order.created_at.isnot(None))
+                 .order_by(Order.created_at.desc(), Order.id.desc())]
+        for limit in (3, 7, len(dated)):
+            assert [row['id'] for row in all_pages({}, limit=limit)] == dated + undated[::-1], limit
+        rows, cursor = query_user_orders('khach0@example.com', limit=2)
+        while cursor:
+            page, cursor = query_user_orders('khach0@example.com', cursor=cursor, limit=2)
+            rows += page
+        assert [row['id'] for row in rows][-3:] == undated[::-1]
+
+        assert count_admin_orders({}) == (Order.query.count(), True)
+        assert count_admin_orders({'status': 'completed'}) == (Order.query.filter_by(status='completed').count(), True)
+
+
+def test_admin_order_filters_and_counts():
+    app = make_app()
+    with app.app_context():
+        add_orders(40)
+        cases = [
+            {},
+            {'status': 'completed'},
+            {'date_from': '2026-01-03', 'date_to': '2026-01-05'},
+            {'status': 'completed', 'date_from': '2026-01-03'},
+            {'payment_status': 'paid', 'customer': 'khach1'},
+            {'status': 'shipping', 'date_to': '2026-01-02', 'customer': 'khach_'},
+        ]
+        for args in cases:
+            filters = parse_order_filters(args)
+            rows = all_pages(filters, limit=5)
+            query = Order.query
+            if 'status' in args:
+                query = query.filter(Order.status == args['status'])
+            if 'payment_status' in args:
+                query = query.filter(Order.payment_status == args['payment_status'])
+            if 'date_from' in args:
+                query = query.filter(Order.created_at >= datetime.fromisoformat(args['date_from']))
+            if 'date_to' in args:
+                query = query.filter(Order.created_at < datetime.fromisoformat(args['date_to']) + timedelta(days=1))
+            if 'customer' in args:
+                query = query.filter(Order.user_email.startswith(args['customer'], autoescape=True))
+            assert sorted(row['id'] for row in rows) == sorted(o.id for o in query), args
+            assert count_admin_orders(filters) == (len(rows), True), args
+
+        # '_' là ký tự thường, không phải wildcard của LIKE
+        assert count_admin_orders(parse_order_filters({'customer': 'khach_'})) == (0, True)
+        assert parse_order_filters({'status': 'x', 'date_from': '31/12/2025'}) == {}
+        assert parse_order_filters({'date_to': '2026-01-02'}) == {'date_to': date(2026, 1, 2)}
+
+
+def test_admin_order_count_is_bounded():
+    app = make_app()
+    with app.app_context():
+        add_orders(40)
+        limit = orders.ORDER_COUNT_LIMIT
+        orders.ORDER_COUNT_LIMIT = 5
+        try:
+            assert count_admin_orders({'payment_status': 'paid'}) == (5, False)
+            assert count_admin_orders({'customer': 'khach0'})[1] is False
+            # Không lọc: lấy từ revenue_rollups nên vẫn chính xác
+            assert count_admin_orders({}) == (Order.query.count(), True)
+        finally:
+            orders.ORDER_COUNT_LIMIT = limit
+
+
+def test_user_order_history_pages_headers_and_loads_items_lazily():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        add_orders(30)
+        order_id = new_order('khach1@example.com', [
+            {'id': shirt.id, 'name': shirt.name, 'price': 150000, 'qty': 2, 'size': 'M', 'color': 'Đen'},
+            {'id': shirt.id, 'name': shirt.name, 'price': 150000, 'qty': 1, 'size': 'L', 'color': 'Trắng'},
+        ]).id
+
+        rows, cursor = query_user_orders('khach1@example.com', limit=4)
+        while cursor:
+            page, cursor = query_user_orders('khach1@example.com', cursor=cursor, limit=4)
+            rows += page
+        expected = Order.query.filter_by(user_email='khach1@example.com').order_by(
+            Order.created_at.desc(), Order.id.desc())
+        assert [row['id'] for row in rows] == [o.id for o in expected]
+        assert rows[0]['id'] == order_id and rows[0]['item_count'] == 2
+        assert 'order_items' not in rows[0] and 'shipping_info' not in rows[0]
+
+        result = order_line_items(order_id, 'khach1@example.com')
+        assert result['status'] == 'pending'
+        assert [(item['size'], item['quantity']) for item in result['items']] == [('M', 2), ('L', 1)]
+        # Không xem được đơn của người khác
+        assert order_line_items(order_id, 'khach0@example.com') is None
+
+
+if __name__ == '__main__':
+    test_staff_created_orders_hold_and_take_stock()
+    test_edited_items_move_the_stock_holds()
+    test_backfill_reads_legacy_json()
+    test_purchases_follow_order_status()
+    test_normalize_legacy_order_dates()
+    test_admin_order_pages_follow_created_at_and_id()
+    test_orders_without_created_at_are_paged_and_counted()
+    test_admin_order_filters_and_counts()
+    test_admin_order_count_is_bounded()
+    test_user_order_history_pages_headers_and_loads_items_lazily()
+    print("✅ All order tests passed!")
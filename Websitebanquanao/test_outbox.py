@@ -0,0 +1,102 @@
+"""
+Tests for the mail outbox and pooled sender (outbox.py), against a local
+aiosmtpd server so no real network is used
+"""
+import socket
+from datetime import datetime, timedelta
+import pytest
+from flask_mail import Mail
+from database import db, OutboxMessage
+from testing import make_app
+from outbox import queue_mail, allow_mail, send_pending, outbox_counts, Throttle
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_mail_app(port):
+    app = make_app(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False,
+                   MAIL_DEFAULT_SENDER='shop@example.com')
+    return app, Mail(app)
+
+
+class Recorder:
+    def __init__(self):
+        self.sessions = set()
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append(envelope.rcpt_tos)
+        return '250 OK'
+
+
+def test_batches_share_one_smtp_connection():
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    handler = Recorder()
+    port = free_port()
+    controller = controller_module.Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        app, mail = make_mail_app(port)
+        with app.app_context():
+            for i in range(7):
+                queue_mail(f'user{i}@example.com', 'Xin chào', body='Nội dung')
+            db.session.commit()
+
+            assert send_pending(mail, batch_size=3) == 7
+            assert len(handler.messages) == 7 and len(handler.sessions) == 1
+            assert outbox_counts() == {'sent': 7}
+    finally:
+        controller.stop()
+
+
+def test_connection_failure_requeues_with_backoff():
+    app, mail = make_mail_app(free_port())  # Không có server nào lắng nghe
+    with app.app_context():
+        message = queue_mail('a@example.com', 'Xin chào', body='x', max_attempts=2)
+        db.session.commit()
+        message_id = message.id
+
+        assert send_pending(mail) == 0
+        message = db.session.get(OutboxMessage, message_id)
+        assert (message.status, message.attempts) == ('queued', 1)
+        assert message.next_attempt_at > datetime.now()
+
+        message.next_attempt_at = datetime.now()
+        db.session.commit()
+        send_pending(mail)
+        assert db.session.get(OutboxMessage, message_id).status == 'failed'
+
+
+def test_rate_limits():
+    app, _ = make_mail_app(free_port())
+    with app.app_context():
+        for _ in range(3):
+            assert allow_mail('a@example.com', 'password_reset', 3, timedelta(hours=1))
+            queue_mail('a@example.com', 'Reset', kind='password_reset')
+            db.session.commit()
+        assert not allow_mail('a@example.com', 'password_reset', 3, timedelta(hours=1))
+        assert allow_mail('b@example.com', 'password_reset', 3, timedelta(hours=1))
+
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    throttle = Throttle(per_minute=30, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        throttle.wait()
+    assert sleeps == [2.0, 2.0]
+
+
+if __name__ == '__main__':
+    test_batches_share_one_smtp_connection()
+    test_connection_failure_requeues_with_backoff()
+    test_rate_limits()
+    print("✅ All outbox tests passed!")
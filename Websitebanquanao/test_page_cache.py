@@ -0,0 +1,68 @@
+"""
+Tests for the anonymous page cache with ETag/304 (page_cache.py)
+"""
+from flask import Flask, request, session
+from cache import MemoryCache, init_cache
+from page_cache import cache_page, bump_catalog_version
+
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    init_cache(app, MemoryCache())
+    app.renders = []
+
+    @app.route('/products')
+    @cache_page()
+    def products():
+        app.renders.append(request.full_path)
+        return f"<p>{request.args.get('category', '')} #{len(app.renders)}</p>"
+
+    @app.route('/login')
+    def login():
+        session['user'] = {'email': 'a@example.com'}
+        return 'ok'
+
+    @app.route('/bump')
+    def bump():
+        bump_catalog_version()
+        return 'ok'
+
+    return app
+
+
+def test_anonymous_pages_are_cached_with_etag():
+    app = make_app()
+    client = app.test_client()
+
+    first = client.get('/products?category=Áo&sort=')
+    assert first.headers['X-Page-Cache'] == 'MISS'
+    # Cùng tham số, thứ tự khác, bỏ tham số rỗng -> cùng một mục cache
+    second = client.get('/products?sort=&category=Áo')
+    assert second.headers['X-Page-Cache'] == 'HIT'
+    assert second.data == first.data and len(app.renders) == 1
+
+    etag = first.headers['ETag']
+    not_modified = client.get('/products?category=Áo', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+
+    client.get('/bump')
+    third = client.get('/products?category=Áo', headers={'If-None-Match': etag})
+    assert third.status_code == 200 and third.headers['X-Page-Cache'] == 'MISS'
+    assert third.headers['ETag'] != etag
+
+
+def test_logged_in_requests_skip_the_cache():
+    app = make_app()
+    client = app.test_client()
+    client.get('/products')
+    client.get('/login')
+    response = client.get('/products')
+    assert 'X-Page-Cache' not in response.headers
+    assert len(app.renders) == 2
+
+
+if __name__ == '__main__':
+    test_anonymous_pages_are_cached_with_etag()
+    test_logged_in_requests_skip_the_cache()
+    print("✅ All page cache tests passed!")
@@ -0,0 +1,151 @@
+"""
+Tests for running on PostgreSQL (database.UUIDString / JSONText, replica
+reads, copy_database). They use the server in TEST_POSTGRES_URL, or start a
+throwaway one with the pgserver package; without either they are skipped.
+"""
+import os
+import tempfile
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from database import db, read_session, copy_database, Product, CartItem, Review
+from testing import make_app
+from cart_store import add_item
+from inventory import hold_stock, set_stock
+from catalog import query_catalog
+from product_io import import_products
+
+_server_url = None
+
+
+def postgres_url(name):
+    """URL of a new empty database called name on the test server"""
+    global _server_url
+    if _server_url is None:
+        _server_url = os.environ.get('TEST_POSTGRES_URL')
+        if not _server_url:
+            pgserver = pytest.importorskip('pgserver')
+            pytest.importorskip('psycopg2')
+            server = pgserver.get_server(tempfile.mkdtemp(), cleanup_mode='stop')
+            _server_url = server.get_uri().replace('postgresql://', 'postgresql+psycopg2://')
+    url = make_url(_server_url)
+    admin = create_engine(url, isolation_level='AUTOCOMMIT')
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)'))
+        conn.execute(text(f'CREATE DATABASE {name}'))
+    admin.dispose()
+    return url.set(database=name).render_as_string(hide_password=False)
+
+
+def dispose(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_schema_uses_native_uuid_and_jsonb():
+    app = make_app(postgres_url('shop_types'))
+    with app.app_context():
+        types = dict(db.session.execute(text(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_name = 'products' AND column_name IN ('id', 'sizes', 'images')")).fetchall())
+        assert types == {'id': 'uuid', 'sizes': 'jsonb', 'images': 'jsonb'}
+
+        # Ứng dụng vẫn thấy id và JSON dạng chuỗi như trên SQLite
+        product = Product.query.filter_by(name='Áo thun Basic').first()
+        assert isinstance(product.id, str) and product.sizes.startswith('[')
+        assert db.session.get(Product, 'not-a-uuid') is None
+        assert db.session.execute(text(
+            "SELECT count(*) FROM products WHERE sizes ? 'M'")).scalar() > 0
+    dispose(app)
+
+
+def test_upserts_and_conditional_updates_work_on_postgres():
+    app = make_app(postgres_url('shop_writes'))
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        add_item('le.van.c@gmail.com', shirt, 'Đen', 'M', 1)
+        add_item('le.van.c@gmail.com', shirt, 'Đen', 'M', 2)
+        set_stock(shirt.id, 2, 'M', 'Đen')
+        db.session.commit()
+        assert CartItem.query.one().qty == 3
+
+        line = {'id': shirt.id, 'size': 'M', 'color': 'Đen', 'qty': 3}
+        assert hold_stock('5b3c4d2e-0000-4000-8000-000000000001', [line]) == [shirt.id]
+        db.session.rollback()
+        line['qty'] = 2
+        assert hold_stock('5b3c4d2e-0000-4000-8000-000000000001', [line]) == []
+        db.session.commit()
+    dispose(app)
+
+
+def test_catalog_and_reviews_read_from_the_replica():
+    uri = postgres_url('shop_replica')
+    app = make_app(uri, SQLALCHEMY_READ_URI=uri)
+    with app.app_context():
+        statements = {'primary': 0, 'replica': 0}
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *args: statements.__setitem__('primary', statements['primary'] + 1))
+        event.listen(db.engines['read'], 'before_cursor_execute',
+                     lambda *args: statements.__setitem__('replica', statements['replica'] + 1))
+        product_id = db.session.query(Review.product_id).first()[0]
+        product_count = Product.query.count()
+        statements['primary'] = 0
+
+    client = app.test_client()
+
+    @app.route('/catalog')
+    def catalog():
+        products, _ = query_catalog(sort='popular')
+        return {'count': len(products), 'same_session': read_session() is db.session}
+
+    assert client.get('/catalog').get_json() == {'count': product_count, 'same_session': False}
+    with app.test_request_context():
+        from reviews import load_review_page
+        pagination, reviews = load_review_page(product_id)
+        assert reviews and pagination.total == len(reviews)
+    assert statements['replica'] > 0 and statements['primary'] == 0
+    dispose(app)
+
+
+def test_copy_sqlite_data_to_postgres():
+    target = postgres_url('shop_copy')
+    source = make_app('sqlite://')
+    with source.app_context():
+        counts = copy_database(target)
+        assert counts['products'] == Product.query.count() and counts['reviews'] == Review.query.count()
+
+    app = make_app(target)
+    with app.app_context():
+        assert Product.query.count() == counts['products']
+        # Sequence đã được đặt sau các id đã chép
+        review = Review(product_id=Product.query.first().id, user_email='a@example.com', rating=5, comment='ok')
+        db.session.add(review)
+        db.session.commit()
+        assert review.id == counts['reviews'] + 1
+    dispose(app)
+
+
+def test_bulk_import_upserts_on_postgres():
+    app = make_app(postgres_url('shop_import'))
+    with app.app_context():
+        shirt_id = Product.query.filter_by(name='Áo thun Basic').first().id
+        rows = [(1, {'name': 'Áo mới', 'price': 100000, 'stock': 3, 'sizes': 'S, M'}),
+                (2, {'id': shirt_id, 'name': 'Áo thun A', 'price': 1, 'stock': 1}),
+                (3, {'id': shirt_id, 'name': 'Áo thun B', 'price': 2, 'stock': 1})]
+        summary = import_products(iter(rows))
+        assert (summary['created'], summary['updated'], summary['invalid']) == (1, 1, 0)
+        db.session.expire_all()
+        assert db.session.get(Product, shirt_id).name == 'Áo thun B'
+        assert db.session.execute(text(
+            "SELECT count(*) FROM products WHERE sizes ? 'M' AND name = 'Áo mới'")).scalar() == 1
+    dispose(app)
+
+
+if __name__ == '__main__':
+    test_schema_uses_native_uuid_and_jsonb()
+    test_upserts_and_conditional_updates_work_on_postgres()
+    test_catalog_and_reviews_read_from_the_replica()
+    test_copy_sqlite_data_to_postgres()
+    test_bulk_import_upserts_on_postgres()
+    print("✅ All PostgreSQL tests passed!")
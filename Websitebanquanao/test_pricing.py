@@ -0,0 +1,76 @@
+"""
+Tests for checkout repricing (pricing.py)
+"""
+import pytest
+from database import db, Product, Inventory, CartItem
+from testing import make_app
+from pricing import price_cart
+from inventory import set_stock, hold_stock
+from cart_store import add_item, load_cart, parse_qty
+from bench_checkout import run_benchmark
+
+
+def test_cart_is_repriced_and_stock_checked_in_one_query():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        set_stock(shirt.id, 3)
+        db.session.commit()
+        cart = [
+            {'id': shirt.id, 'name': 'Tên cũ', 'price': 1, 'color': 'Đen', 'size': 'M', 'qty': 2},
+            {'id': shirt.id, 'name': 'Tên cũ', 'price': 1, 'color': 'Trắng', 'size': 'M', 'qty': 1},
+            {'id': 'deleted', 'name': 'Áo đã xóa', 'price': 1, 'color': '', 'size': '', 'qty': 1},
+        ]
+        lines, problems = price_cart(cart)
+        assert [(line['price'], line['name']) for line in lines] == [(shirt.price, shirt.name)] * 2
+        assert problems == ['Sản phẩm Áo đã xóa không còn bán']
+
+        # Hai màu dùng chung tồn kho: 2 + 2 > 3
+        cart[1]['qty'] = 2
+        _, problems = price_cart(cart[:2])
+        assert problems == [f'{shirt.name} chỉ còn 3 sản phẩm']
+
+        # Màu Đen có kho riêng, màu Trắng vẫn lấy từ kho chung
+        set_stock(shirt.id, 1, 'M', 'Đen')
+        db.session.commit()
+        _, problems = price_cart(cart[:2])
+        assert problems == [f'{shirt.name} (M / Đen) chỉ còn 1 sản phẩm']
+
+
+def test_negative_quantity_cannot_reach_checkout():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        set_stock(shirt.id, 5, 'M', 'Đen')
+        line = {'id': shirt.id, 'size': 'M', 'color': 'Đen', 'qty': 4}
+        assert hold_stock('order-a', [line]) == []
+        db.session.commit()
+
+        with pytest.raises(ValueError):
+            add_item('le.van.c@gmail.com', shirt, 'Đen', 'M', -100)
+        assert [parse_qty(value) for value in ('3', 2, '-1', 0, 'abc', 1.5, True)] == [3, 2, None, None, None, None, None]
+
+        # Dòng giỏ hàng sai (ghi thẳng vào bảng) vẫn bị chặn ở bước checkout
+        db.session.add(CartItem(user_email='le.van.c@gmail.com', product_id=shirt.id, name=shirt.name,
+                                price=shirt.price, image=shirt.image, color='Đen', size='M', qty=-100))
+        db.session.commit()
+        lines, problems = price_cart(load_cart('le.van.c@gmail.com'))
+        assert lines == [] and problems == [f'Số lượng của {shirt.name} không hợp lệ']
+
+        assert hold_stock('order-b', [dict(line, qty=-100)]) == [shirt.id]
+        db.session.rollback()
+        row = Inventory.query.filter_by(product_id=shirt.id, size='M', color='Đen').one()
+        assert (row.on_hand, row.reserved) == (5, 4)
+
+
+def test_parallel_checkouts_never_oversell():
+    result = run_benchmark(threads=8, stock=20, attempts=5)
+    assert result['oversold'] == 0
+    assert result['final_stock'] == 0 and result['orders'] == 20
+
+
+if __name__ == '__main__':
+    test_cart_is_repriced_and_stock_checked_in_one_query()
+    test_negative_quantity_cannot_reach_checkout()
+    test_parallel_checkouts_never_oversell()
+    print("✅ All pricing tests passed!")
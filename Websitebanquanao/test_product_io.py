@@ -0,0 +1,133 @@
+"""
+Tests for bulk product import / export (product_io.py)
+"""
+import io
+import json
+from database import db, Product, Inventory
+from testing import make_app
+from inventory import set_stock
+from catalog import query_catalog
+from product_io import read_rows, clean_row, import_products, export_products, RowError
+from bench_product_import import run_benchmark
+
+
+CSV = """id,name,price,old_price,category,image,sizes,colors,stock,featured
+,Áo polo Mùa Hè,259000,,Áo,/Images/polo.png,"S, M, L","Trắng, Đen",40,x
+,Quần short kaki,199000,249000,Quần,/Images/short.png,"[""29"", ""30""]",Be,15,
+,,100000,,Áo,,,,1,
+,Áo lỗi giá,abc,,Áo,,,,1,
+not-a-uuid,Áo lỗi id,100000,,Áo,,,,1,
+"""
+
+
+def test_csv_rows_are_validated_and_created():
+    app = make_app()
+    with app.app_context():
+        before = Product.query.count()
+        summary = import_products(read_rows(io.StringIO(CSV), 'csv'), batch_size=1)
+        assert (summary['created'], summary['updated'], summary['invalid']) == (2, 0, 3)
+        assert [error['line'] for error in summary['errors']] == [4, 5, 6]
+        assert Product.query.count() == before + 2
+
+        polo = Product.query.filter_by(name='Áo polo Mùa Hè').one()
+        assert json.loads(polo.sizes) == ['S', 'M', 'L'] and json.loads(polo.images) == ['/Images/polo.png']
+        assert polo.featured and polo.stock == 40 and polo.rating == 0
+        shared = Inventory.query.filter_by(product_id=polo.id, size='', color='').one()
+        assert shared.on_hand == 40
+        # Đã có trong chỉ mục tìm kiếm
+        assert [p['id'] for p in query_catalog(search='ao polo')[0]] == [polo.id]
+
+        short = Product.query.filter_by(name='Quần short kaki').one()
+        assert json.loads(short.sizes) == ['29', '30'] and short.old_price == 249000
+
+
+def test_existing_products_are_updated_in_place():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        shirt_id, sold, rating = shirt.id, shirt.sold, shirt.rating
+        set_stock(shirt_id, 5, 'M', 'Đen')  # Tồn kho theo biến thể không bị ghi đè
+        db.session.commit()
+        stock = db.session.get(Product, shirt_id).stock
+
+        rows = [(1, {'id': shirt_id, 'name': 'Áo thun Basic 2026', 'price': 209000, 'stock': stock + 10}),
+                (2, {'id': shirt_id, 'name': 'Áo thun Basic (sửa)', 'price': 219000, 'stock': stock + 10})]
+        summary = import_products(iter(rows))
+        assert (summary['created'], summary['updated']) == (0, 1)
+
+        db.session.expire_all()
+        shirt = db.session.get(Product, shirt_id)
+        assert (shirt.name, shirt.price) == ('Áo thun Basic (sửa)', 219000)
+        assert (shirt.sold, shirt.rating, shirt.stock) == (sold, rating, stock + 10)
+        assert Inventory.query.filter_by(product_id=shirt_id, size='M', color='Đen').one().on_hand == 5
+        assert summary['warnings'] == []
+
+
+def test_stock_that_per_variant_rows_block_is_reported():
+    app = make_app()
+    with app.app_context():
+        shirt = Product.query.filter_by(name='Áo thun Basic').first()
+        shirt_id = shirt.id
+        set_stock(shirt_id, 0)
+        set_stock(shirt_id, 5, 'M', 'Đen')
+        set_stock(shirt_id, 7, 'L', 'Đen')
+        db.session.commit()
+
+        # Tổng 12 nằm ở size/màu, hàng chung đã về 0: không giảm xuống 3 được
+        rows = [(2, {'id': shirt_id, 'name': 'Áo thun Basic', 'price': 199000, 'stock': 3})]
+        summary = import_products(iter(rows))
+        assert (summary['updated'], summary['invalid']) == (1, 0)
+        assert summary['warnings'] == [
+            {'line': 2, 'warning': 'Tồn kho theo size/màu: không đặt được 3, tồn kho hiện là 12'}]
+        assert db.session.get(Product, shirt_id).stock == 12
+
+
+def test_export_round_trips_through_import():
+    app = make_app()
+    with app.app_context():
+        for fmt in ('csv', 'jsonl'):
+            exported = ''.join(export_products(fmt, batch_size=2))
+            before = {p.id: (p.name, p.price, p.sizes, p.colors, p.color_images, p.stock) for p in Product.query}
+            summary = import_products(read_rows(io.StringIO(exported), fmt))
+            assert (summary['created'], summary['updated'], summary['invalid']) == (0, len(before), 0)
+            db.session.expire_all()
+            after = {p.id: (p.name, p.price, p.sizes, p.colors, p.color_images, p.stock) for p in Product.query}
+            assert after == before
+
+
+def test_export_streams_one_line_per_product():
+    app = make_app()
+    with app.app_context():
+        chunks = list(export_products('jsonl', batch_size=3))
+        assert len(chunks) == Product.query.count()
+        assert all(chunk.endswith('\n') and chunk.count('\n') == 1 for chunk in chunks)
+        assert next(export_products('csv')).startswith('id,name,price')
+
+
+def test_clean_row_messages():
+    for row, message in [({'name': 'A'}, 'Thiếu giá'), ({'name': 'A', 'price': -1}, 'price không được âm'),
+                         ({'name': 'A', 'price': 1, 'color_images': '[1]'}, 'color_images phải là JSON object')]:
+        try:
+            clean_row(row)
+        except RowError as exc:
+            assert str(exc) == message
+        else:
+            raise AssertionError(row)
+    assert list(read_rows(io.StringIO('{"name": "A"}\n\n[1]\n'), 'jsonl'))[1][0] == 3
+
+
+def test_benchmark_imports_every_row():
+    result = run_benchmark(products=300, per_row=20, batch_size=100)
+    assert (result['created'], result['invalid']) == (300, 0)
+    assert result['exported'] > 300  # Cả sản phẩm mẫu
+
+
+if __name__ == '__main__':
+    test_csv_rows_are_validated_and_created()
+    test_existing_products_are_updated_in_place()
+    test_stock_that_per_variant_rows_block_is_reported()
+    test_export_round_trips_through_import()
+    test_export_streams_one_line_per_product()
+    test_clean_row_messages()
+    test_benchmark_imports_every_row()
+    print("✅ All product import/export tests passed!")
@@ -0,0 +1,62 @@
+"""
+Tests for request-scoped memoization and the DB-hit counter (request_cache.py)
+"""
+from flask import render_template_string
+from database import db, Product
+import testing
+from request_cache import request_memo, install_query_counter, db_hits
+
+
+def make_app():
+    app = testing.make_app()
+    install_query_counter(app)
+    return app
+
+
+def test_helper_runs_once_per_request():
+    app = make_app()
+    calls = []
+
+    @request_memo
+    def get_categories():
+        calls.append(1)
+        return [c[0] for c in db.session.query(Product.category).distinct()]
+
+    @app.route('/')
+    def index():
+        return render_template_string(
+            "{% for p in range(20) %}{{ get_categories()|length }}{% endfor %}",
+            get_categories=get_categories)
+
+    app.config['DEBUG_DB_HITS'] = True
+    client = app.test_client()
+    for _ in range(2):
+        response = client.get('/')
+        assert response.headers['X-DB-Hits'] == '1'
+    assert len(calls) == 2
+
+
+def test_invalidate_and_outside_request():
+    app = make_app()
+    values = iter(range(10))
+
+    @request_memo
+    def counter():
+        return next(values)
+
+    with app.test_request_context('/'):
+        assert counter() == counter() == 0
+        counter.invalidate()
+        assert counter() == 1
+        assert db_hits() == 0
+        Product.query.count()
+        assert db_hits() == 1
+
+    with app.app_context():
+        assert counter() == 2 and counter() == 3
+
+
+if __name__ == '__main__':
+    test_helper_runs_once_per_request()
+    test_invalidate_and_outside_request()
+    print("✅ All request cache tests passed!")
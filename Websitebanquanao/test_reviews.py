@@ -0,0 +1,120 @@
+"""
+Tests for the batched review page loader and rating aggregates (reviews.py)
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from database import db, Product, User, Review, ReviewReply, ReviewLike
+from testing import make_app
+from reviews import load_review_page, apply_rating, rating_summary, rebuild_rating_summaries
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_reviews(product_id, count):
+    users = [u.email for u in User.query.all()]
+    for i in range(count):
+        review = Review(product_id=product_id, user_email=users[i % len(users)],
+                        rating=i % 5 + 1, comment=f'Review {i}')
+        db.session.add(review)
+        db.session.flush()
+        db.session.add(ReviewReply(review_id=review.id, user_email='admin@example.com', comment='Cảm ơn'))
+        db.session.add(ReviewLike(review_id=review.id, user_email='staff@example.com'))
+    db.session.commit()
+
+
+def test_query_count_does_not_grow_with_page_size():
+    app = make_app()
+    with app.app_context():
+        product_id = Product.query.filter_by(name='Váy dài').first().id
+        add_reviews(product_id, 12)
+
+        counts = []
+        for per_page in (2, 10):
+            db.session.expunge_all()
+            with count_queries() as statements:
+                pagination, reviews = load_review_page(product_id, per_page=per_page,
+                                                       user_email='staff@example.com')
+            assert len(reviews) == per_page
+            counts.append(len(statements))
+
+        # COUNT + page + users + like counts + viewer likes + replies
+        assert counts == [6, 6]
+
+
+def test_serialized_page_content():
+    app = make_app()
+    with app.app_context():
+        product = Product.query.filter_by(name='Váy dài').first()
+        add_reviews(product.id, 3)
+
+        _, reviews = load_review_page(product.id, user_email='staff@example.com')
+        assert len(reviews) == 3
+        for review in reviews:
+            assert review['helpful_count'] == 1
+            assert review['user_liked'] is True
+            assert [r['user_name'] for r in review['replies']] == ['Admin']
+            assert review['user_name'] != 'Người dùng'
+
+        _, reviews = load_review_page(product.id)
+        assert not any(review['user_liked'] for review in reviews)
+
+        # to_dict dùng chung bộ serializer
+        single = db.session.get(Review, reviews[0]['id']).to_dict('staff@example.com')
+        assert single['helpful_count'] == 1 and single['user_liked'] is True
+
+
+def test_rating_aggregates_follow_inserts_and_deletes():
+    app = make_app()
+    with app.app_context():
+        product_id = Product.query.filter_by(name='Áo khoác Hoodie').first().id
+        # Seed data: 5 sao + 4 sao
+        assert rating_summary(db.session.get(Product, product_id)) == (2, 4.5, {'5': 1, '4': 1, '3': 0, '2': 0, '1': 0})
+
+        review = Review(product_id=product_id, user_email='le.van.c@gmail.com', rating=1)
+        db.session.add(review)
+        apply_rating(product_id, 1, 1)
+        db.session.commit()
+        product = db.session.get(Product, product_id)
+        assert rating_summary(product) == (3, 3.3, {'5': 1, '4': 1, '3': 0, '2': 0, '1': 1})
+        assert product.reviews == 3 and product.rating == 3.3
+
+        apply_rating(product_id, review.rating, -1)
+        db.session.delete(review)
+        db.session.commit()
+        product = db.session.get(Product, product_id)
+        assert (product.reviews, product.rating, product.rating_count_1) == (2, 4.5, 0)
+
+
+def test_rebuild_repairs_drifted_aggregates():
+    app = make_app()
+    with app.app_context():
+        product = Product.query.filter_by(name='Quần Jeans Nam').first()
+        product.rating_count_5 = 40
+        product.reviews = 41
+        db.session.commit()
+
+        rebuild_rating_summaries()
+        db.session.commit()
+        product = db.session.get(Product, product.id)
+        assert rating_summary(product) == (2, 4.5, {'5': 1, '4': 1, '3': 0, '2': 0, '1': 0})
+        assert product.reviews == 2
+
+
+if __name__ == '__main__':
+    test_query_count_does_not_grow_with_page_size()
+    test_serialized_page_content()
+    test_rating_aggregates_follow_inserts_and_deletes()
+    test_rebuild_repairs_drifted_aggregates()
+    print("✅ All review tests passed!")
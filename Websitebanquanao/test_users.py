@@ -0,0 +1,103 @@
+"""
+Tests for the admin account list queries (users.py)
+"""
+from uuid import uuid4
+from sqlalchemy import event
+from database import db, User, Order
+from testing import make_app
+from users import role_counts, query_users, typeahead_customers, backfill_folded_columns
+
+
+def add_customers(count):
+    for i in range(count):
+        db.session.add(User(email=f'si{i:03d}@shop.vn', password='x', role='user',
+                            name=f'Khách sỉ {i}', phone=f'0900{i:06d}'))
+        for _ in range(i % 4):
+            db.session.add(Order(id=str(uuid4()), user_email=f'si{i:03d}@shop.vn', items='[]',
+                                 subtotal=0, total=0))
+    db.session.commit()
+
+
+def test_role_counts_match_per_role_queries():
+    app = make_app()
+    with app.app_context():
+        add_customers(12)
+        counts = role_counts()
+        assert counts['all'] == User.query.count()
+        for role in ('admin', 'staff', 'user'):
+            assert counts[role] == User.query.filter_by(role=role).count()
+
+
+def test_user_pages_carry_order_counts_without_loading_orders():
+    app = make_app()
+    with app.app_context():
+        add_customers(25)
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+        rows, cursor = query_users(role='user', limit=10)
+        pages = 1
+        while cursor:
+            page, cursor = query_users(role='user', cursor=cursor, limit=10)
+            rows += page
+            pages += 1
+        assert len(statements) == pages  # Một truy vấn cho mỗi trang
+        assert [row['email'] for row in rows] == sorted(u.email for u in User.query.filter_by(role='user'))
+
+        expected = {u.email: len(u.orders) for u in User.query.filter_by(role='user')}
+        assert {row['email']: row['order_count'] for row in rows} == expected
+
+
+def test_search_by_email_name_or_phone():
+    app = make_app()
+    with app.app_context():
+        add_customers(25)
+        assert [row['email'] for row in query_users(search='si00')[0]] == [f'si00{i}@shop.vn' for i in range(10)]
+        assert [row['email'] for row in query_users(search='sỉ 17')[0]] == ['si017@shop.vn']
+        assert [row['email'] for row in query_users(search='0900000021')[0]] == ['si021@shop.vn']
+        assert query_users(search='%')[0] == []
+        assert query_users(role='admin', search='si0')[0] == []
+
+
+def test_customer_typeahead_uses_prefixes():
+    app = make_app()
+    with app.app_context():
+        add_customers(25)
+        db.session.add(User(email='si.admin@shop.vn', password='x', role='staff', name='Khách sỉ nội bộ'))
+        db.session.commit()
+        assert [row['email'] for row in typeahead_customers('SI01', limit=3)] == [
+            'si010@shop.vn', 'si011@shop.vn', 'si012@shop.vn']
+        assert [row['email'] for row in typeahead_customers('Khách sỉ 2')] == [
+            'si002@shop.vn', 'si020@shop.vn', 'si021@shop.vn', 'si022@shop.vn', 'si023@shop.vn', 'si024@shop.vn']
+        assert typeahead_customers('0900000007')[0]['address'] is None
+
+
+def test_customer_search_ignores_case():
+    app = make_app()
+    with app.app_context():
+        db.session.add(User(email='Mixed.Case@Shop.vn', password='x', role='user', name='Nguyễn Thị Hoa'))
+        db.session.commit()
+        for search in ('nguyễn', 'NGUYỄN THỊ', 'mixed.case@shop', 'MIXED.CASE@SHOP.VN'):
+            assert 'Mixed.Case@Shop.vn' in [row['email'] for row in typeahead_customers(search)], search
+        assert [row['email'] for row in query_users(search='mixed.')[0]] == ['Mixed.Case@Shop.vn']
+        assert [row['email'] for row in query_users(search='thị hoa')[0]] == ['Mixed.Case@Shop.vn']
+
+        user = db.session.get(User, 'Mixed.Case@Shop.vn')
+        user.name = 'Đặng Hoa'
+        db.session.commit()
+        assert typeahead_customers('đặng')[0]['email'] == 'Mixed.Case@Shop.vn'
+
+        # Tài khoản có từ trước khi thêm cột
+        db.session.execute(db.update(User).values(email_folded=None, name_folded=None))
+        assert backfill_folded_columns(batch_size=2) == User.query.count()
+        assert typeahead_customers('nguyễn văn')[0]['name'] == 'Nguyễn Văn A'
+        assert typeahead_customers('  ') == []
+
+
+if __name__ == '__main__':
+    test_role_counts_match_per_role_queries()
+    test_user_pages_carry_order_counts_without_loading_orders()
+    test_search_by_email_name_or_phone()
+    test_customer_typeahead_uses_prefixes()
+    test_customer_search_ignores_case()
+    print("✅ All user admin tests passed!")
@@ -0,0 +1,158 @@
+"""
+Tests for voucher rules and usage limits (vouchers.py)
+"""
+import pytest
+from uuid import uuid4
+from database import db, Voucher, VoucherUsage, Order
+import testing
+from cache import MemoryCache, init_cache
+from vouchers import (VoucherError, discount_for, active_vouchers, invalidate_vouchers, check_voucher,
+                      redeem, save_voucher, release_voucher, settle_order_voucher,
+                      release_order_voucher)
+from orders import cancel_expired_order
+from bench_vouchers import run_benchmark
+
+
+def make_app():
+    app = testing.make_app()
+    init_cache(app, MemoryCache())
+    return app
+
+
+def rule(voucher_type, discount, min_order=0):
+    return {'code': 'X', 'type': voucher_type, 'discount': discount, 'min_order': min_order}
+
+
+def test_discount_math_per_type():
+    assert discount_for(rule('fixed', 50000), 30000, 30000) == 30000  # Không giảm quá tiền hàng
+    assert discount_for(rule('percent', 15), 333333, 30000) == 49999  # Làm tròn xuống đồng
+    assert discount_for(rule('shipping', 30000), 200000, 30000) == 30000
+    assert discount_for(rule('shipping', 30000), 600000, 0) == 0  # Đã được miễn phí ship
+    assert discount_for(rule('fixed', 50000, min_order=500000), 499000, 30000) == 0
+
+
+def test_active_vouchers_are_cached_until_invalidated():
+    app = make_app()
+    with app.app_context():
+        assert active_vouchers().get('SALE20')['discount'] == 20
+        Voucher.query.filter_by(code='SALE20').update({'active': False})
+        db.session.commit()
+        assert active_vouchers().get('SALE20') is not None
+
+        invalidate_vouchers()
+        assert active_vouchers().get('SALE20') is None
+        with pytest.raises(VoucherError):
+            check_voucher('SALE20', 'le.van.c@gmail.com', 1000000, 0)
+
+        save_voucher('VIP', type='percent', discount=30, min_order=1000000)
+        db.session.commit()
+        invalidate_vouchers()
+        vouchers = active_vouchers()
+        assert vouchers.best(2000000, 0) == (vouchers.get('VIP'), 600000)
+        assert vouchers.best(100000, 30000) == (vouchers.get('FREESHIP'), 30000)
+
+
+def test_usage_limits_are_enforced_at_redemption():
+    app = make_app()
+    with app.app_context():
+        save_voucher('FLASH', type='fixed', discount=10000, usage_limit=2, per_user_limit=1)
+        db.session.commit()
+        invalidate_vouchers()
+
+        redeem('FLASH', 'a@example.com')
+        db.session.commit()
+        with pytest.raises(VoucherError):
+            check_voucher('FLASH', 'a@example.com', 100000, 30000)
+        with pytest.raises(VoucherError):
+            redeem('FLASH', 'a@example.com')
+        db.session.rollback()
+
+        redeem('FLASH', 'b@example.com')
+        db.session.commit()
+        with pytest.raises(VoucherError):
+            redeem('FLASH', 'c@example.com')
+        db.session.rollback()
+
+        assert db.session.get(Voucher, 'FLASH').used_count == 2
+        assert VoucherUsage.query.filter_by(code='FLASH').count() == 2
+
+
+def test_cancelled_orders_give_the_use_back():
+    app = make_app()
+    with app.app_context():
+        save_voucher('FLASH', type='fixed', discount=10000, usage_limit=1, per_user_limit=1)
+        db.session.commit()
+        invalidate_vouchers()
+
+        # Đơn chuyển khoản chưa thanh toán quá hạn giữ hàng -> tự hủy
+        order_id = str(uuid4())
+        redeem('FLASH', 'a@example.com')
+        db.session.add(Order(id=order_id, user_email='a@example.com', items='[]', subtotal=100000, total=90000,
+                             voucher_discount=10000, voucher_code='FLASH', payment_method='banking',
+                             payment_status='pending', status='pending'))
+        db.session.commit()
+        with pytest.raises(VoucherError):
+            check_voucher('FLASH', 'b@example.com', 100000, 30000)
+
+        cancel_expired_order(order_id)
+        db.session.commit()
+        assert db.session.get(Order, order_id).status == 'cancelled'
+        assert db.session.get(Voucher, 'FLASH').used_count == 0
+        assert VoucherUsage.query.filter_by(code='FLASH', user_email='a@example.com').one().count == 0
+        check_voucher('FLASH', 'a@example.com', 100000, 30000)
+
+        # Chạy lại job hoặc hủy lần nữa không làm bộ đếm âm
+        cancel_expired_order(order_id)
+        release_voucher('FLASH', 'a@example.com')
+        db.session.commit()
+        assert db.session.get(Voucher, 'FLASH').used_count == 0
+
+        # Nhân viên mở lại đơn đã hủy -> tính lại lượt dùng
+        order = db.session.get(Order, order_id)
+        order.status = 'pending'
+        settle_order_voucher(order, 'cancelled')
+        db.session.commit()
+        assert db.session.get(Voucher, 'FLASH').used_count == 1
+
+
+def test_deleting_a_live_order_gives_the_use_back():
+    app = make_app()
+    with app.app_context():
+        save_voucher('XOA', type='fixed', discount=10000, usage_limit=5, per_user_limit=5)
+        db.session.commit()
+        invalidate_vouchers()
+        orders = []
+        for status in ('pending', 'cancelled'):
+            redeem('XOA', 'a@example.com')
+            order = Order(id=str(uuid4()), user_email='a@example.com', items='[]', subtotal=100000,
+                          total=90000, voucher_discount=10000, voucher_code='XOA', status='pending')
+            db.session.add(order)
+            if status == 'cancelled':
+                order.status = 'cancelled'
+                settle_order_voucher(order, 'pending')
+            orders.append(order)
+        db.session.commit()
+        assert db.session.get(Voucher, 'XOA').used_count == 1
+
+        # Đơn đã hủy đã trả lượt rồi, xóa không trả thêm lần nữa
+        for order in orders:
+            release_order_voucher(order)
+            db.session.delete(order)
+        db.session.commit()
+        assert db.session.get(Voucher, 'XOA').used_count == 0
+        assert VoucherUsage.query.filter_by(code='XOA').one().count == 0
+
+
+def test_benchmark_matches_brute_force():
+    result = run_benchmark(rules=200, carts=500, db_carts=50)
+    assert result['mismatches'] == 0
+
+
+if __name__ == '__main__':
+    test_discount_math_per_type()
+    test_active_vouchers_are_cached_until_invalidated()
+    test_usage_limits_are_enforced_at_redemption()
+    test_cancelled_orders_give_the_use_back()
+    test_deleting_a_live_order_gives_the_use_back()
+    test_benchmark_matches_brute_force()
+    print("✅ All voucher tests passed!")
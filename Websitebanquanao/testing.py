@@ -0,0 +1,15 @@
+"""
+Shared app factory for the tests: a bare Flask app on the database module,
+in-memory SQLite with the sample data unless another URI is given.
+"""
+from flask import Flask
+from database import init_db
+
+
+def make_app(uri='sqlite://', **config):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config)
+    init_db(app)
+    return app
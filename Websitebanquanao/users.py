@@ -0,0 +1,107 @@
+"""
+Queries for the admin account list and the order form's customer picker.
+Role counts come from one GROUP BY, the list is paged with a keyset cursor on
+email, and each row's order count is a correlated COUNT on the
+(user_email, created_at) index instead of loading User.orders.
+The customer picker matches on the case-folded email_folded / name_folded
+columns, so "nguyễn" finds "Nguyễn" and the prefix still uses an index.
+"""
+from sqlalchemy import and_, func, or_, select
+from database import db, fold_text, User, Order
+
+USER_PAGE_SIZE = 50
+TYPEAHEAD_LIMIT = 10
+ROLES = ('admin', 'staff', 'user')
+
+
+def role_counts():
+    """{'all': n, 'admin': n, 'staff': n, 'user': n} from a single query"""
+    counts = dict.fromkeys(ROLES, 0)
+    for role, count in db.session.query(User.role, func.count()).group_by(User.role):
+        counts[role or 'user'] = counts.get(role or 'user', 0) + count
+    counts['all'] = sum(counts.values())
+    return counts
+
+
+def user_row(row):
+    """Dict for one row of the admin account table"""
+    return {
+        'email': row.email,
+        'name': row.name,
+        'phone': row.phone,
+        'role': row.role,
+        'order_count': row.order_count,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+    }
+
+
+def query_users(role=None, search=None, cursor=None, limit=USER_PAGE_SIZE):
+    """One page of accounts ordered by email.
+
+    search matches an email prefix or part of the name / phone number,
+    ignoring case.
+    cursor is the email of the last row of the previous page.
+    Returns (rows, next_cursor).
+    """
+    order_count = (select(func.count(Order.id))
+                   .where(Order.user_email == User.email)
+                   .correlate(User)
+                   .scalar_subquery())
+    query = db.session.query(User.email, User.name, User.phone, User.role, User.created_at,
+                             order_count.label('order_count'))
+    if role in ROLES:
+        query = query.filter(User.role == role)
+    if search:
+        folded = fold_text(search)
+        query = query.filter(or_(User.email_folded.startswith(folded, autoescape=True),
+                                 User.name_folded.contains(folded, autoescape=True),
+                                 User.phone.contains(search, autoescape=True)))
+    if cursor:
+        query = query.filter(User.email > cursor)
+    rows = query.order_by(User.email).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].email
+    return [user_row(row) for row in rows], next_cursor
+
+
+def _prefix(column, value):
+    """column starts with value, written as a range so a plain index is used"""
+    return and_(column >= value, column < value + '\U0010ffff')
+
+
+def typeahead_customers(search, limit=TYPEAHEAD_LIMIT):
+    """At most `limit` customers whose email, name or phone starts with search,
+    ignoring case
+    """
+    search = (search or '').strip()
+    if not search:
+        return []
+    folded = fold_text(search)
+    rows = (db.session.query(User.email, User.name, User.phone, User.address)
+            .filter(User.role == 'user',
+                    or_(_prefix(User.email_folded, folded), _prefix(User.name_folded, folded),
+                        _prefix(User.phone, search)))
+            .order_by(User.email)
+            .limit(limit))
+    return [{'email': row.email, 'name': row.name, 'phone': row.phone, 'address': row.address} for row in rows]
+
+
+def backfill_folded_columns(batch_size=1000):
+    """Fill email_folded / name_folded for accounts created before those columns.
+    Returns the number of accounts updated.
+    """
+    count = 0
+    while True:
+        rows = (db.session.query(User.email, User.name)
+                .filter(User.email_folded.is_(None))
+                .limit(batch_size).all())
+        if not rows:
+            return count
+        db.session.execute(db.update(User), [
+            {'email': row.email, 'email_folded': fold_text(row.email), 'name_folded': fold_text(row.name)}
+            for row in rows
+        ])
+        count += len(rows)
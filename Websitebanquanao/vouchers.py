@@ -0,0 +1,212 @@
+"""
+Voucher rules and discount math.
+The active vouchers are kept in the shared cache (cache.py) and dropped
+from it whenever a voucher is saved, so pricing a cart doesn't query the
+vouchers table. Discounts are recomputed from the live cart every time the
+totals are calculated; the session only remembers the voucher code.
+Usage limits are enforced at checkout by redeem() with conditional UPDATEs
+on the voucher's counter and on the user's counter, so two parallel
+checkouts can't both take the last use. A cancelled order gives its use
+back (settle_order_voucher).
+"""
+from bisect import bisect_right
+from sqlalchemy import update, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db, Voucher, VoucherUsage
+from cache import cached_value, invalidate
+
+ACTIVE_VOUCHERS_KEY = 'active_vouchers'
+# Cache riêng của mỗi worker chỉ bị xóa ở worker đã sửa voucher -> TTL ngắn
+VOUCHER_CACHE_TTL = 60
+RULE_FIELDS = ('code', 'type', 'discount', 'min_order', 'usage_limit', 'per_user_limit')
+TYPES = ('fixed', 'percent', 'shipping')
+
+
+class VoucherError(Exception):
+    """The voucher can't be used; the message is shown to the customer"""
+
+
+def discount_for(rule, subtotal, shipping):
+    """Discount a rule gives on a cart, 0 if the cart is below min_order.
+    fixed: the amount, percent: a percentage of the subtotal (whole đồng),
+    shipping: up to the amount off the shipping fee. Never more than what
+    it applies to.
+    """
+    if subtotal < (rule['min_order'] or 0):
+        return 0
+    if rule['type'] == 'percent':
+        return subtotal * min(rule['discount'], 100) // 100
+    if rule['type'] == 'shipping':
+        return min(rule['discount'], shipping)
+    return min(rule['discount'], subtotal)
+
+
+class VoucherSet:
+    """Active voucher rules, indexed by code and by min_order"""
+
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=lambda rule: rule['min_order'] or 0)
+        self.by_code = {rule['code']: rule for rule in self.rules}
+        self._min_orders = [rule['min_order'] or 0 for rule in self.rules]
+        # Trong mỗi loại, giảm giá tăng theo rule['discount'] -> chỉ cần rule lớn
+        # nhất mỗi loại trong các rule đạt min_order (prefix max theo min_order)
+        self._prefix_best = []
+        best = {}
+        for rule in self.rules:
+            current = best.get(rule['type'])
+            if current is None or rule['discount'] > current['discount']:
+                best = dict(best, **{rule['type']: rule})
+            self._prefix_best.append(best)
+
+    def get(self, code):
+        return self.by_code.get(code)
+
+    def applicable(self, subtotal):
+        """Rules whose min_order the subtotal reaches"""
+        return self.rules[:bisect_right(self._min_orders, subtotal)]
+
+    def best(self, subtotal, shipping):
+        """(rule, discount) of the rule with the largest discount, or (None, 0)"""
+        count = bisect_right(self._min_orders, subtotal)
+        best, best_discount = None, 0
+        for rule in (self._prefix_best[count - 1].values() if count else ()):
+            discount = discount_for(rule, subtotal, shipping)
+            if discount > best_discount:
+                best, best_discount = rule, discount
+        return best, best_discount
+
+
+def _load_rules():
+    return [{field: getattr(voucher, field) for field in RULE_FIELDS}
+            for voucher in Voucher.query.filter_by(active=True)]
+
+
+def active_vouchers():
+    return VoucherSet(cached_value(ACTIVE_VOUCHERS_KEY, _load_rules, VOUCHER_CACHE_TTL))
+
+
+def invalidate_vouchers():
+    """Call after committing a change to the vouchers table"""
+    invalidate(ACTIVE_VOUCHERS_KEY)
+
+
+def voucher_discount(code, subtotal, shipping):
+    """Discount of the voucher code on the cart, 0 if it is unknown or inactive"""
+    rule = active_vouchers().get(code) if code else None
+    return discount_for(rule, subtotal, shipping) if rule else 0
+
+
+def check_voucher(code, user_email, subtotal, shipping):
+    """Return the rule for code, or raise VoucherError explaining why it can't be used"""
+    rule = active_vouchers().get(code)
+    if rule is None:
+        raise VoucherError('Mã giảm giá không hợp lệ')
+    if subtotal < (rule['min_order'] or 0):
+        raise VoucherError(f"Đơn hàng tối thiểu {rule['min_order']:,.0f}đ để sử dụng mã này".replace(',', '.'))
+    if rule['usage_limit'] is not None:
+        used = db.session.query(Voucher.used_count).filter_by(code=code).scalar() or 0
+        if used >= rule['usage_limit']:
+            raise VoucherError('Mã giảm giá đã hết lượt sử dụng')
+    if rule['per_user_limit'] is not None:
+        used = (db.session.query(VoucherUsage.count)
+                .filter_by(code=code, user_email=user_email).scalar() or 0)
+        if used >= rule['per_user_limit']:
+            raise VoucherError('Bạn đã dùng hết lượt của mã giảm giá này')
+    return rule
+
+
+def redeem(code, user_email):
+    """Count one use of the voucher inside the caller's checkout transaction.
+    Raises VoucherError if a limit is reached; the caller must roll back.
+    """
+    result = db.session.execute(
+        update(Voucher)
+        .where(Voucher.code == code, Voucher.active == True,
+               or_(Voucher.usage_limit.is_(None), Voucher.used_count < Voucher.usage_limit))
+        .values(used_count=Voucher.used_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise VoucherError('Mã giảm giá đã hết lượt sử dụng')
+
+    # Giới hạn đọc từ DB (không từ cache) để không vượt quá khi vừa sửa voucher
+    limit = db.session.query(Voucher.per_user_limit).filter_by(code=code).scalar()
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    table = VoucherUsage.__table__
+    statement = insert(table).values(code=code, user_email=user_email, count=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=['code', 'user_email'],
+        set_={'count': table.c.count + 1},
+        where=(table.c.count < limit) if limit is not None else None
+    )
+    result = db.session.execute(statement)
+    if result.rowcount != 1 or limit == 0:
+        raise VoucherError('Bạn đã dùng hết lượt của mã giảm giá này')
+
+
+def release_voucher(code, user_email):
+    """Give back one use of the voucher (order cancelled); counters never go below 0"""
+    db.session.execute(
+        update(Voucher)
+        .where(Voucher.code == code, Voucher.used_count > 0)
+        .values(used_count=Voucher.used_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(VoucherUsage)
+        .where(VoucherUsage.code == code, VoucherUsage.user_email == user_email, VoucherUsage.count > 0)
+        .values(count=VoucherUsage.count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _count_use(code, user_email):
+    """Take a use again without checking limits (staff reopened a cancelled order)"""
+    db.session.execute(
+        update(Voucher)
+        .where(Voucher.code == code)
+        .values(used_count=Voucher.used_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    table = VoucherUsage.__table__
+    statement = insert(table).values(code=code, user_email=user_email, count=1)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['code', 'user_email'],
+        set_={'count': table.c.count + 1}
+    ))
+
+
+def settle_order_voucher(order, previous_status):
+    """Release the order's voucher use when it becomes cancelled, count it
+    again if it leaves 'cancelled'. Runs inside the caller's transaction.
+    """
+    if not order.voucher_code or previous_status == order.status:
+        return
+    if order.status == 'cancelled':
+        release_voucher(order.voucher_code, order.user_email)
+    elif previous_status == 'cancelled':
+        _count_use(order.voucher_code, order.user_email)
+
+
+def release_order_voucher(order):
+    """Give back the voucher use of an order being deleted, unless cancelling
+    it already did. Runs inside the caller's transaction.
+    """
+    if order.voucher_code and order.status != 'cancelled':
+        release_voucher(order.voucher_code, order.user_email)
+
+
+def save_voucher(code, **fields):
+    """Create or update a voucher; invalidate_vouchers() after committing"""
+    voucher = db.session.get(Voucher, code)
+    if voucher is None:
+        voucher = Voucher(code=code, discount=0, min_order=0, type='fixed', active=True)
+        db.session.add(voucher)
+    for field, value in fields.items():
+        setattr(voucher, field, value)
+    if voucher.type not in TYPES:
+        raise ValueError(f"Unknown voucher type: {voucher.type}")
+    return voucher